@@ -1,95 +1,147 @@
 # agents/data_mart_agent.py
 import google.generativeai as genai
-import streamlit as st
 import re
 import json
 import pandas as pd
 
 # นำเข้า Tools ที่ Agent สามารถเรียกใช้ได้
-from tools.db_tools import execute_sql_query, get_table_schema
+from tools.db_tools import execute_sql_query, get_table_schema, describe_all_tables
+from tools.mart_tools import create_data_mart, list_data_marts, refresh_data_mart
+from tools.profile_tools import get_table_profile
+from agents.history import compact_history
+from agents.tool_output import fetch_result_page
+from agents.tool_executor import close_unanswered_calls, function_response_message, get_function_calls, run_tool_calls
+from agents.renderer import ResponseRenderer, stream_reply
+from tools.tracing import traced_prompt
 import config # สำหรับการเข้าถึง DATABASE_URL
 
 class DataMartAgent:
-    def __init__(self, api_key: str):
+    @classmethod
+    def build_system_instruction(cls) -> str:
         """
-        เริ่มต้น DataMartAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        System instruction ของ Agent (กำหนดครั้งเดียวตอนสร้าง model แทนการส่งซ้ำทุก prompt)
+        """
+        return (
+            f"You are a Data Mart Agent. Your goal is to help create and query data marts for reporting. "
+            f"You have access to a SQLite database at '{config.DATABASE_URL}' which serves as the Data Warehouse. "
+            f"You can use the following tools: `execute_sql_query` to run SQL commands, `get_table_schema` to inspect table schemas "
+            f"and `describe_all_tables` to fetch the whole warehouse schema in one call. "
+            f"For recurring reports, materialise a mart with `create_data_mart` (e.g. daily sales per customer/product); "
+            f"aggregate queries on the fact table that a mart can answer are automatically served from it. "
+            f"Use `list_data_marts` to see existing marts and `refresh_data_mart` to bring one up to date. "
+            f"To learn table sizes, null rates, distinct counts, frequent values or value ranges, use `get_table_profile` "
+            f"(served from a stored profile, refreshed incrementally) instead of COUNT(*)/COUNT(DISTINCT) scans with `execute_sql_query`. "
+            f"Large tool results are summarised with a `result_handle`; use `fetch_result_page` to read more rows. "
+            f"Always use the provided database URL for all database operations."
+        )
+
+    @classmethod
+    def build_model(cls, api_key: str):
+        """
+        สร้าง Gemini model ของ Agent นี้ (ไม่มี state ของบทสนทนา จึงใช้ร่วมกันข้าม session ได้)
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(
+        return genai.GenerativeModel(
             'gemini-2.0-flash-lite', # <--- ใช้ gemini-2.0-flash-lite ตามที่คุณแจ้ง
-            tools=[execute_sql_query, get_table_schema] # DMA จะเน้นการ Query จาก DW
+            tools=[execute_sql_query, get_table_schema, describe_all_tables, fetch_result_page,
+                   create_data_mart, refresh_data_mart, list_data_marts, get_table_profile], # DMA จะเน้นการ Query จาก DW
+            system_instruction=cls.build_system_instruction(),
         )
-        self.chat_session = self.model.start_chat(enable_automatic_function_calling=True)
 
-    def process_prompt(self, user_prompt: str, st_response_container):
+    def __init__(self, api_key: str, model=None):
+        """
+        เริ่มต้น DataMartAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        สามารถส่ง model (เช่น StubGenerativeModel) เข้ามาแทน Gemini สำหรับการทดสอบแบบ offline ได้
+        """
+        self.system_instruction = self.build_system_instruction()
+        self.model = model if model is not None else self.build_model(api_key)
+        self.chat_session = self.model.start_chat(enable_automatic_function_calling=False)
+
+    def _run_tool(self, tool_name: str, tool_args: dict) -> dict:
+        """
+        รัน Tool หนึ่งตัว (อาจถูกเรียกจาก worker thread จึงห้ามเรียก Streamlit ในนี้)
+
+        Returns:
+            dict: {"output": ผลลัพธ์ที่ส่งกลับให้ model, "display": ข้อความ markdown สำหรับแสดงใน UI}
+        """
+        # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
+        if tool_name in ["execute_sql_query", "get_table_schema", "describe_all_tables",
+                         "create_data_mart", "refresh_data_mart", "list_data_marts", "get_table_profile"]:
+             tool_args['database_url'] = config.DATABASE_URL
+
+        # ทำการเรียกใช้ Tool จริงๆ
+        if tool_name == "execute_sql_query":
+            actual_output = execute_sql_query(**tool_args)
+        elif tool_name == "get_table_schema":
+            actual_output = get_table_schema(**tool_args)
+        elif tool_name == "describe_all_tables":
+            actual_output = describe_all_tables(**tool_args)
+        elif tool_name == "fetch_result_page":
+            actual_output = fetch_result_page(**tool_args)
+        elif tool_name == "create_data_mart":
+            actual_output = create_data_mart(**tool_args)
+        elif tool_name == "refresh_data_mart":
+            actual_output = refresh_data_mart(**tool_args)
+        elif tool_name == "list_data_marts":
+            actual_output = list_data_marts(**tool_args)
+        elif tool_name == "get_table_profile":
+            actual_output = get_table_profile(**tool_args)
+        else:
+            actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Mart Agent"
+            return {"output": actual_output, "display": actual_output}
+        return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+    @traced_prompt
+    def process_prompt(self, user_prompt: str, st_response_container=None, event_sink=None):
         """
         ประมวลผลคำสั่งจากผู้ใช้สำหรับ Data Mart Agent
         แสดงผลลัพธ์แบบ Streaming ผ่าน st_response_container
 
         Args:
             user_prompt (str): คำสั่งจากผู้ใช้
-            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming
+            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming (None = ไม่แสดงผลใน UI)
+            event_sink: sink สำหรับรับ event ระหว่างประมวลผล (agents/events.py) เช่นจาก runtime แบบ headless
 
         Returns:
             tuple: (ข้อความตอบกลับทั้งหมด, SQL ที่สร้าง, ผลลัพธ์ Query ในรูปแบบ JSON string)
         """
-        full_response_parts = []
+        renderer = ResponseRenderer(st_response_container, sink=event_sink) # แสดงผลแบบเพิ่มทีละส่วนและรวมการอัปเดต UI
         sql_generated = ""
         query_results_json = None
 
-        context_prompt = (
-            f"You are a Data Mart Agent. Your goal is to help create and query data marts for reporting. "
-            f"You have access to a SQLite database at '{config.DATABASE_URL}' which serves as the Data Warehouse. "
-            f"You can use the following tools: `execute_sql_query` to run SQL commands and `get_table_schema` to inspect table schemas. "
-            f"Always use the provided database URL for all database operations."
-        )
-        self.chat_session.send_message(context_prompt)
+        # จำกัดขนาด history ให้อยู่ใน token budget ก่อนส่ง prompt ใหม่
+        compact_history(self.chat_session)
 
         try:
-            response = self.chat_session.send_message(user_prompt, stream=False) # <--- Changed to stream=False
-
-            if response.text:
-                full_response_parts.append(response.text)
-                st_response_container.markdown("".join(full_response_parts))
-
-            if hasattr(response, 'function_calls') and response.function_calls:
-                for fc in response.function_calls:
-                    tool_name = fc.name
-                    tool_args = fc.args
-                    tool_output_str = f"\n\n**Agent กำลังเรียกใช้ Tool:** `{tool_name}` พร้อม Arguments: `{tool_args}`\n"
-                    full_response_parts.append(tool_output_str)
-                    st_response_container.markdown("".join(full_response_parts))
-
-                    actual_output = "Tool output not available yet."
-                    # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
-                    if tool_name in ["execute_sql_query", "get_table_schema"]:
-                         tool_args['database_url'] = config.DATABASE_URL
-
-                    # ทำการเรียกใช้ Tool จริงๆ
-                    if tool_name == "execute_sql_query":
-                        actual_output = execute_sql_query(**tool_args)
-                        query_results_json = actual_output # เก็บผลลัพธ์ Query
-                        full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                        st_response_container.markdown("".join(full_response_parts))
-                    elif tool_name == "get_table_schema":
-                         actual_output = get_table_schema(**tool_args)
-                         full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                         st_response_container.markdown("".join(full_response_parts))
-                    else:
-                        actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Mart Agent"
-                        full_response_parts.append(actual_output)
-                        st_response_container.markdown("".join(full_response_parts))
-
-                    # ส่งผลลัพธ์ของ Tool กลับไปยัง Gemini
-                    self.chat_session.send_message(genai.Part.from_function_response(name=tool_name, response=actual_output))
-            
-            # ดึงข้อความสรุปสุดท้ายจาก Gemini หลังจาก Tool Call
-            final_response = self.chat_session.send_message("สรุปผลลัพธ์สุดท้ายของการดำเนินการทั้งหมดจากข้อมูล Tool output ที่ได้รับอย่างละเอียด", stream=False) # <--- Changed to stream=False
-            if final_response.text:
-                full_response_parts.append(final_response.text)
-                st_response_container.markdown("".join(full_response_parts))
-            
-            final_full_response_text = "".join(full_response_parts)
+            # ส่ง prompt แบบ streaming (Tool calls ถูกรันโดย Agent เอง จึงใช้ stream ได้)
+            response = stream_reply(self.chat_session, user_prompt, renderer)
+
+            tool_rounds = 0
+            while True:
+                function_calls = get_function_calls(response)
+                if not function_calls:
+                    break
+                if tool_rounds >= config.AGENT_MAX_TOOL_ROUNDS:
+                    renderer.append(f"\n{close_unanswered_calls(self.chat_session, function_calls)}\n")
+                    break
+                tool_rounds += 1
+
+                for fc in function_calls:
+                    renderer.tool_call(fc.name, dict(fc.args or {}))
+                renderer.flush()
+
+                # รัน Tool calls ทั้งหมด (call ที่อ่านอย่างเดียวรันพร้อมกัน) แล้วแสดงผลตามลำดับเดิม
+                results = run_tool_calls(function_calls, self._run_tool)
+                for result in results:
+                    renderer.tool_output(result["name"], result["output"], result["display"])
+                    if result["name"] == "execute_sql_query":
+                        query_results_json = result["output"] # เก็บผลลัพธ์ Query
+                renderer.flush()
+
+                # ส่งผลลัพธ์ของทุก Tool กลับไปยัง Gemini ใน message เดียว คำตอบที่ได้คือสรุปผลของรอบนี้
+                response = stream_reply(self.chat_session, function_response_message(results), renderer)
+
+            final_full_response_text = renderer.close()
 
             # ตรวจสอบและดึง SQL Code ที่ Gemini อาจสร้างขึ้นในรูปแบบ Text
             sql_blocks = re.findall(r"```sql\n(.*?)```", final_full_response_text, re.DOTALL)
@@ -99,6 +151,6 @@ class DataMartAgent:
             return final_full_response_text, sql_generated, query_results_json
 
         except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Mart Agent: {e}")
+            renderer.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Mart Agent: {e}")
             return f"เกิดข้อผิดพลาด: {str(e)}", "", ""
 
@@ -1,144 +1,243 @@
 # agents/data_pipeline_agent.py
 import google.generativeai as genai
-import streamlit as st
 import re
 import json
 import pandas as pd # Ensure pandas is imported for data processing/display
 
 # นำเข้า Tools ที่ Agent สามารถเรียกใช้ได้
-from tools.db_tools import execute_sql_query, get_db_engine, insert_data_into_table
-from tools.file_tools import create_dataframe_from_csv_content
+from tools.db_tools import execute_sql_query, get_db_engine, get_table_schema, insert_data_into_table
+from tools.file_tools import create_dataframe_from_csv_content, ingest_csv, load_csv_into_table, export_to_parquet, load_parquet_into_table
+from tools.pipeline_tools import create_pipeline, run_data_pipeline, list_pipelines, get_pipeline_runs
+from tools.profile_tools import profile_table, get_table_profile
+from agents.history import compact_history
+from agents.tool_output import fetch_result_page
+from agents.tool_executor import close_unanswered_calls, function_response_message, get_function_calls, run_tool_calls
+from agents.renderer import ResponseRenderer, stream_reply
+from agents.intent_router import intent_router
+from tools.tracing import traced_prompt, tracer
+from io import StringIO
 import config # สำหรับการเข้าถึง DATABASE_URL และ mock CSV content
 
 class DataPipelineAgent:
-    def __init__(self, api_key: str):
+    @classmethod
+    def build_system_instruction(cls) -> str:
         """
-        เริ่มต้น DataPipelineAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        System instruction ของ Agent (กำหนดครั้งเดียวตอนสร้าง model แทนการส่งซ้ำทุก prompt)
+        """
+        return (
+            f"You are a Data Pipeline Agent. Your goal is to help manage data pipelines. "
+            f"You have access to a SQLite database at '{config.DATABASE_URL}'. "
+            f"You can use the following tools: `execute_sql_query` to run SQL, "
+            f"`create_dataframe_from_csv_content` to process CSV data, "
+            f"`insert_data_into_table` to load data into tables, and "
+            f"`load_csv_into_table` to stream a CSV file from disk directly into a table (preferred for large files), "
+            f"`export_to_parquet` to snapshot a table or query result to a Parquet file (much smaller and faster to reload than CSV), and "
+            f"`load_parquet_into_table` to load a Parquet file into a table, optionally reading only some columns and filtered rows. "
+            f"For repeatable multi-step loads, define a pipeline with `create_pipeline` (stages with dependencies such as "
+            f"load_csv -> scd2 -> load_fact -> refresh_mart) and run it with `run_data_pipeline`; independent stages run in parallel "
+            f"and stages whose inputs have not changed are skipped. Use `list_pipelines` and `get_pipeline_runs` to inspect them. "
+            f"After loading data, check its quality with `get_table_profile` (row count, null fractions, distinct estimates, "
+            f"frequent values, histograms) instead of scanning the table with COUNT queries; `profile_table` forces a refresh. "
+            f"Large tool results are summarised with a `result_handle`; use `fetch_result_page` to read more rows. "
+            f"Always use the provided database URL for all database operations."
+        )
+
+    @classmethod
+    def build_model(cls, api_key: str):
+        """
+        สร้าง Gemini model ของ Agent นี้ (ไม่มี state ของบทสนทนา จึงใช้ร่วมกันข้าม session ได้)
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(
+        return genai.GenerativeModel(
             'gemini-2.0-flash-lite', # <--- ใช้ gemini-2.0-flash-lite ตามที่คุณแจ้ง
-            tools=[execute_sql_query, create_dataframe_from_csv_content, insert_data_into_table]
+            tools=[execute_sql_query, create_dataframe_from_csv_content, insert_data_into_table, load_csv_into_table, export_to_parquet, load_parquet_into_table,
+                   create_pipeline, run_data_pipeline, list_pipelines, get_pipeline_runs, profile_table, get_table_profile,
+                   fetch_result_page],
+            system_instruction=cls.build_system_instruction(),
         )
-        # เริ่มต้น chat session และเปิดใช้งาน automatic function calling
+
+    def __init__(self, api_key: str, model=None):
+        """
+        เริ่มต้น DataPipelineAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        สามารถส่ง model (เช่น StubGenerativeModel) เข้ามาแทน Gemini สำหรับการทดสอบแบบ offline ได้
+        """
+        self.system_instruction = self.build_system_instruction()
+        self.model = model if model is not None else self.build_model(api_key)
+        # เริ่มต้น chat session โดย Agent เป็นผู้รัน Tool calls เอง (รันขนานกันได้และส่งผลลัพธ์กลับใน message เดียว)
         # Session นี้จะคงอยู่ตลอดอายุของ Agent instance
-        self.chat_session = self.model.start_chat(enable_automatic_function_calling=True)
+        self.chat_session = self.model.start_chat(enable_automatic_function_calling=False)
 
-    def process_prompt(self, user_prompt: str, st_response_container):
+    def _run_tool(self, tool_name: str, tool_args: dict, user_prompt: str) -> dict:
+        """
+        รัน Tool หนึ่งตัว (อาจถูกเรียกจาก worker thread จึงห้ามเรียก Streamlit ในนี้)
+
+        Returns:
+            dict: {"output": ผลลัพธ์ที่ส่งกลับให้ model, "display": ข้อความ markdown สำหรับแสดงใน UI}
+        """
+        actual_output = "Tool output not available yet."
+
+        # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
+        if tool_name in ["execute_sql_query", "insert_data_into_table", "get_table_schema", "create_table_ddl", "load_csv_into_table", "export_to_parquet", "load_parquet_into_table",
+                         "create_pipeline", "run_data_pipeline", "list_pipelines", "get_pipeline_runs",
+                         "profile_table", "get_table_profile"]:
+            tool_args['database_url'] = config.DATABASE_URL
+
+        # ทำการเรียกใช้ Tool จริงๆ ตามชื่อฟังก์ชัน
+        if tool_name == "execute_sql_query":
+            actual_output = execute_sql_query(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name == "create_dataframe_from_csv_content":
+            display_parts = []
+            # intent router ส่ง kind และ table_name ที่ตรวจสอบแล้วมาให้ (model ส่งเฉพาะ csv_content หรือไม่ส่งเลย)
+            kind = tool_args.pop('kind', None)
+            db_table_name = tool_args.pop('table_name', None)
+            if 'csv_content' not in tool_args:
+                if kind == "customer" or (kind is None and "customer" in user_prompt.lower()):
+                    tool_args['csv_content'] = config.MOCK_CUSTOMER_CSV
+                elif kind == "sales" or (kind is None and "sales" in user_prompt.lower()):
+                    tool_args['csv_content'] = config.MOCK_SALES_CSV
+                else:
+                    actual_output = "ไม่พบเนื้อหา CSV ในคำสั่งหรือข้อมูลจำลอง"
+                    display_parts.append(actual_output)
+
+            if 'csv_content' in tool_args:
+                actual_output = create_dataframe_from_csv_content(**tool_args)
+                display_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
+
+                if "Error" not in actual_output:
+                    display_parts.append("\n" + f"**Agent กำลังพยายามโหลดข้อมูล CSV เข้า DB...**")
+                    try:
+                        if db_table_name is None:
+                            table_name_match = re.search(r'(?:into|to)\s+(\w+)(?:\s+table)?', user_prompt.lower())
+                            db_table_name = table_name_match.group(1) if table_name_match else None
+                        if db_table_name:
+                            # โหลด CSV เข้าตารางโดยตรงแบบทีละ chunk (ไม่แปลงเป็น JSON แล้ว parse ซ้ำ)
+                            load_stats = ingest_csv(config.DATABASE_URL, db_table_name, StringIO(tool_args['csv_content']))
+                            insert_result = f"Successfully inserted {load_stats['rows']} rows into '{db_table_name}' ({load_stats['rows_per_second']} rows/s)."
+                            load_msg = f"\n--- **โหลดข้อมูลเข้าตาราง `{db_table_name}` ผลลัพธ์:** {insert_result} ---"
+                        else:
+                            load_msg = "\n--- **ไม่สามารถระบุชื่อตารางปลายทางสำหรับโหลดข้อมูลได้จากคำสั่ง: โปรดระบุชัดเจน เช่น 'load to stg_customers'** ---"
+                    except Exception as e:
+                        load_msg = f"\n--- **เกิดข้อผิดพลาดในการโหลดข้อมูลเข้า DB:** {str(e)} ---"
+                    actual_output += load_msg
+                    display_parts.append(load_msg)
+            return {"output": actual_output, "display": "".join(display_parts)}
+
+        elif tool_name == "load_csv_into_table":
+            actual_output = load_csv_into_table(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name == "export_to_parquet":
+            actual_output = export_to_parquet(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name == "load_parquet_into_table":
+            actual_output = load_parquet_into_table(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name in ("create_pipeline", "run_data_pipeline", "list_pipelines", "get_pipeline_runs"):
+            pipeline_tools = {"create_pipeline": create_pipeline, "run_data_pipeline": run_data_pipeline,
+                              "list_pipelines": list_pipelines, "get_pipeline_runs": get_pipeline_runs}
+            actual_output = pipeline_tools[tool_name](**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```\n{actual_output}\n```\n"}
+
+        elif tool_name == "insert_data_into_table":
+            actual_output = insert_data_into_table(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name in ("profile_table", "get_table_profile"):
+            actual_output = (profile_table if tool_name == "profile_table" else get_table_profile)(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name == "get_table_schema":
+            actual_output = get_table_schema(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        elif tool_name == "fetch_result_page":
+            actual_output = fetch_result_page(**tool_args)
+            return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+        actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Pipeline Agent"
+        return {"output": actual_output, "display": actual_output}
+
+    def _run_fast_path(self, user_prompt: str, routed: dict, renderer: ResponseRenderer):
+        """
+        รัน Tool ที่ intent router เลือกให้โดยตรง แล้วบันทึกคำสั่งและผลลัพธ์ลง history ของ chat session
+        เพื่อให้ model เห็นบริบทนี้ใน prompt ถัดไป
+        """
+        tracer.annotate(fast_path=routed["intent"])
+        renderer.tool_call(routed["tool"], routed["args"])
+        result = self._run_tool(routed["tool"], dict(routed["args"]), user_prompt)
+        renderer.tool_output(routed["tool"], result["output"], result["display"])
+        renderer.append(f"\n{routed['summary']} (รันโดยตรงโดยไม่ผ่าน model)\n")
+
+        output = result["output"] if isinstance(result["output"], str) else str(result["output"])
+        self.chat_session.history = list(self.chat_session.history) + [
+            {"role": "user", "parts": [user_prompt]},
+            {"role": "model", "parts": [f"{routed['summary']}\nTool `{routed['tool']}` output:\n{output[:config.AGENT_HISTORY_TOOL_OUTPUT_CHARS]}"]},
+        ]
+        return renderer.close(), [{"name": routed["tool"], "args": routed["args"], "output": result["output"]}]
+
+    @traced_prompt
+    def process_prompt(self, user_prompt: str, st_response_container=None, event_sink=None):
         """
         ประมวลผลคำสั่งจากผู้ใช้โดยใช้ Gemini Pro และ Tools ที่กำหนด
         แสดงผลลัพธ์แบบ Streaming ผ่าน st_response_container
 
         Args:
             user_prompt (str): คำสั่งจากผู้ใช้
-            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming
+            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming (None = ไม่แสดงผลใน UI)
+            event_sink: sink สำหรับรับ event ระหว่างประมวลผล (agents/events.py) เช่นจาก runtime แบบ headless
 
         Returns:
             tuple: (ข้อความตอบกลับทั้งหมดจาก Agent, รายการ Tool Output)
         """
-        full_response_parts = [] # To accumulate all parts of the response for final display
+        renderer = ResponseRenderer(st_response_container, sink=event_sink) # แสดงผลแบบเพิ่มทีละส่วนและรวมการอัปเดต UI
         tool_outputs = []
-        
-        context_prompt = (
-            f"You are a Data Pipeline Agent. Your goal is to help manage data pipelines. "
-            f"You have access to a SQLite database at '{config.DATABASE_URL}'. "
-            f"You can use the following tools: `execute_sql_query` to run SQL, "
-            f"`create_dataframe_from_csv_content` to process CSV data, and "
-            f"`insert_data_into_table` to load data into tables. "
-            f"Always use the provided database URL for all database operations."
-        )
-        
-        # Send context to LLM
-        self.chat_session.send_message(context_prompt)
+
+        # คำสั่งที่ตรงกับ template (เช่น "load data/sales.csv into stg_sales", "count rows in fact_sales") รันทันทีโดยไม่เรียก model
+        routed = intent_router.route(user_prompt, config.DATABASE_URL) if config.INTENT_ROUTER_ENABLED else None
+        if routed is not None:
+            try:
+                return self._run_fast_path(user_prompt, routed, renderer)
+            except Exception as e:
+                renderer.error(f"เกิดข้อผิดพลาดในการรันคำสั่ง: {e}")
+                return f"เกิดข้อผิดพลาด: {str(e)}", []
+
+        # จำกัดขนาด history ให้อยู่ใน token budget ก่อนส่ง prompt ใหม่
+        compact_history(self.chat_session)
 
         try:
-            # Send the user's prompt to Gemini Pro with stream=False
-            response = self.chat_session.send_message(user_prompt, stream=False) # <--- Changed to stream=False
-
-            # Process the single response object
-            if response.text:
-                full_response_parts.append(response.text)
-                st_response_container.markdown("".join(full_response_parts)) # Update UI
-
-            if hasattr(response, 'function_calls') and response.function_calls: # Check attribute on the full response
-                for fc in response.function_calls:
-                    tool_name = fc.name
-                    tool_args = fc.args
-                    tool_output_str = f"\n\n**Agent กำลังเรียกใช้ Tool:** `{tool_name}` พร้อม Arguments: `{tool_args}`\n"
-                    full_response_parts.append(tool_output_str)
-                    st_response_container.markdown("".join(full_response_parts)) # Update UI
-
-                    actual_output = "Tool output not available yet."
-
-                    # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
-                    if tool_name in ["execute_sql_query", "insert_data_into_table", "get_table_schema", "create_table_ddl"]:
-                        tool_args['database_url'] = config.DATABASE_URL
-
-                    # ทำการเรียกใช้ Tool จริงๆ ตามชื่อฟังก์ชัน
-                    if tool_name == "execute_sql_query":
-                        actual_output = execute_sql_query(**tool_args)
-                        full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                        st_response_container.markdown("".join(full_response_parts))
-
-                    elif tool_name == "create_dataframe_from_csv_content":
-                        if 'csv_content' not in tool_args:
-                            if "customer" in user_prompt.lower():
-                                tool_args['csv_content'] = config.MOCK_CUSTOMER_CSV
-                            elif "sales" in user_prompt.lower():
-                                tool_args['csv_content'] = config.MOCK_SALES_CSV
-                            else:
-                                actual_output = "ไม่พบเนื้อหา CSV ในคำสั่งหรือข้อมูลจำลอง"
-                        
-                        if 'csv_content' in tool_args:
-                            actual_output = create_dataframe_from_csv_content(**tool_args)
-                            full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                            st_response_container.markdown("".join(full_response_parts))
-
-                            if "Error" not in actual_output and "DataFrame" in actual_output:
-                                temp_msg = "\n" + f"**Agent กำลังพยายามโหลดข้อมูล CSV เข้า DB...**"
-                                full_response_parts.append(temp_msg)
-                                st_response_container.markdown("".join(full_response_parts))
-                                try:
-                                    df_json_str = actual_output
-                                    table_name_match = re.search(r'(?:into|to)\s+(\w+)(?:\s+table)?', user_prompt.lower())
-                                    if table_name_match:
-                                        db_table_name = table_name_match.group(1)
-                                        insert_result = insert_data_into_table(config.DATABASE_URL, db_table_name, df_json_str)
-                                        actual_output += f"\n--- **โหลดข้อมูลเข้าตาราง `{db_table_name}` ผลลัพธ์:** {insert_result} ---"
-                                        full_response_parts.append(f"\n--- **โหลดข้อมูลเข้าตาราง `{db_table_name}` ผลลัพธ์:** {insert_result} ---")
-                                        st_response_container.markdown("".join(full_response_parts))
-                                    else:
-                                        actual_output += "\n--- **ไม่สามารถระบุชื่อตารางปลายทางสำหรับโหลดข้อมูลได้จากคำสั่ง: โปรดระบุชัดเจน เช่น 'load to stg_customers'** ---"
-                                        full_response_parts.append("\n--- **ไม่สามารถระบุชื่อตารางปลายทางสำหรับโหลดข้อมูลได้จากคำสั่ง: โปรดระบุชัดเจน เช่น 'load to stg_customers'** ---")
-                                        st_response_container.markdown("".join(full_response_parts))
-                                except Exception as e:
-                                    actual_output += f"\n--- **เกิดข้อผิดพลาดในการโหลดข้อมูลเข้า DB:** {str(e)} ---"
-                                    full_response_parts.append(f"\n--- **เกิดข้อผิดพลาดในการโหลดข้อมูลเข้า DB:** {str(e)} ---")
-                                    st_response_container.markdown("".join(full_response_parts))
-
-
-                    elif tool_name == "insert_data_into_table":
-                         actual_output = insert_data_into_table(**tool_args)
-                         full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                         st_response_container.markdown("".join(full_response_parts))
-                    else:
-                        actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Pipeline Agent"
-                        full_response_parts.append(actual_output)
-                        st_response_container.markdown("".join(full_response_parts))
-
-                    # ส่งผลลัพธ์ของ Tool กลับไปยัง Gemini เพื่อให้ Agent ประมวลผลต่อ
-                    self.chat_session.send_message(genai.Part.from_function_response(name=tool_name, response=actual_output))
-                    tool_outputs.append({"name": tool_name, "args": tool_args, "output": actual_output})
-            
-            # ดึงข้อความสรุปสุดท้ายจาก Gemini หลังจาก Tool Call (also with stream=False)
-            final_response = self.chat_session.send_message("สรุปผลลัพธ์สุดท้ายของการดำเนินการทั้งหมดจากข้อมูล Tool output ที่ได้รับอย่างละเอียด", stream=False) # <--- Changed to stream=False
-            if final_response.text:
-                full_response_parts.append(final_response.text)
-                st_response_container.markdown("".join(full_response_parts))
-            
-            return "".join(full_response_parts), tool_outputs
+            # ส่ง prompt แบบ streaming (Tool calls ถูกรันโดย Agent เอง จึงใช้ stream ได้)
+            response = stream_reply(self.chat_session, user_prompt, renderer)
+
+            tool_rounds = 0
+            while True:
+                function_calls = get_function_calls(response)
+                if not function_calls:
+                    break
+                if tool_rounds >= config.AGENT_MAX_TOOL_ROUNDS:
+                    renderer.append(f"\n{close_unanswered_calls(self.chat_session, function_calls)}\n")
+                    break
+                tool_rounds += 1
+
+                for fc in function_calls:
+                    renderer.tool_call(fc.name, dict(fc.args or {}))
+                renderer.flush()
+
+                # รัน Tool calls ทั้งหมด (call ที่อ่านอย่างเดียวรันพร้อมกัน) แล้วแสดงผลตามลำดับเดิม
+                results = run_tool_calls(function_calls, lambda name, args: self._run_tool(name, args, user_prompt))
+                for result in results:
+                    renderer.tool_output(result["name"], result["output"], result["display"])
+                    tool_outputs.append({"name": result["name"], "args": result["args"], "output": result["output"]})
+                renderer.flush()
+
+                # ส่งผลลัพธ์ของทุก Tool กลับไปยัง Gemini ใน message เดียว คำตอบที่ได้คือสรุปผลของรอบนี้
+                response = stream_reply(self.chat_session, function_response_message(results), renderer)
+
+            return renderer.close(), tool_outputs
 
         except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Pipeline Agent: {e}")
+            renderer.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Pipeline Agent: {e}")
             return f"เกิดข้อผิดพลาด: {str(e)}", []
-
@@ -1,101 +1,154 @@
 # agents/data_warehouse_agent.py
 import google.generativeai as genai
-import streamlit as st
 import re
 import json
 
 # นำเข้า Tools ที่ Agent สามารถเรียกใช้ได้
-from tools.db_tools import get_table_schema, create_table_ddl, execute_sql_query
+from tools.db_tools import get_table_schema, create_table_ddl, execute_sql_query, describe_all_tables
+from tools.warehouse_tools import apply_scd2_dimension, load_fact_sales
+from tools.index_advisor import get_slow_queries, recommend_indexes
+from tools.profile_tools import get_table_profile, list_table_profiles
+from agents.history import compact_history
+from agents.tool_output import fetch_result_page
+from agents.tool_executor import close_unanswered_calls, function_response_message, get_function_calls, run_tool_calls
+from agents.renderer import ResponseRenderer, stream_reply
+from tools.tracing import traced_prompt
 import config # สำหรับการเข้าถึง DATABASE_URL
 
 class DataWarehouseAgent:
-    def __init__(self, api_key: str):
+    # Tools ที่ Agent นี้อนุญาตให้เรียกใช้ (ชื่อ -> ฟังก์ชัน)
+    TOOLS = {
+        "get_table_schema": get_table_schema,
+        "describe_all_tables": describe_all_tables,
+        "create_table_ddl": create_table_ddl,
+        "execute_sql_query": execute_sql_query,
+        "fetch_result_page": fetch_result_page,
+        "apply_scd2_dimension": apply_scd2_dimension,
+        "load_fact_sales": load_fact_sales,
+        "get_slow_queries": get_slow_queries,
+        "recommend_indexes": recommend_indexes,
+        "get_table_profile": get_table_profile,
+        "list_table_profiles": list_table_profiles,
+    }
+    # Tools ที่ต้องใช้ DATABASE_URL
+    DB_TOOLS = {"get_table_schema", "describe_all_tables", "create_table_ddl", "execute_sql_query", "apply_scd2_dimension", "load_fact_sales",
+                "get_slow_queries", "recommend_indexes", "get_table_profile", "list_table_profiles"}
+
+    @classmethod
+    def build_system_instruction(cls) -> str:
         """
-        เริ่มต้น DataWarehouseAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        System instruction ของ Agent (กำหนดครั้งเดียวตอนสร้าง model แทนการส่งซ้ำทุก prompt)
+        """
+        return (
+            f"You are a Data Warehouse Agent. Your goal is to manage and optimize the Data Warehouse. "
+            f"You have access to a SQLite database at '{config.DATABASE_URL}'. "
+            f"You can use the following tools: `get_table_schema` to inspect table schemas, "
+            f"`describe_all_tables` to get every table's columns, keys, indexes and row estimates in one call, "
+            f"`create_table_ddl` to define new tables, and `execute_sql_query` to run SQL commands. "
+            f"To load a Type 2 slowly changing dimension (e.g. `stg_customers` into `dim_customer`), "
+            f"always use `apply_scd2_dimension` instead of writing the merge SQL yourself. "
+            f"To populate `fact_sales` from `stg_sales`, use `load_fact_sales` (incremental and safe to re-run) "
+            f"instead of a full reload with INSERT ... SELECT. "
+            f"To optimise performance, use `get_slow_queries` to find the slowest logged queries and `recommend_indexes` "
+            f"to analyse their query plans and propose (or, with create=true, build and benchmark) covering indexes. "
+            f"To learn table sizes, null rates, distinct counts, frequent values or value ranges, use `get_table_profile` "
+            f"(served from a stored profile, refreshed incrementally) instead of COUNT(*)/COUNT(DISTINCT) scans with `execute_sql_query`. "
+            f"Large tool results are summarised with a `result_handle`; use `fetch_result_page` to read more rows. "
+            f"Always use the provided database URL for all database operations."
+        )
+
+    @classmethod
+    def build_model(cls, api_key: str):
+        """
+        สร้าง Gemini model ของ Agent นี้ (ไม่มี state ของบทสนทนา จึงใช้ร่วมกันข้าม session ได้)
         """
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(
+        return genai.GenerativeModel(
             'gemini-2.0-flash-lite', # <--- ใช้ gemini-2.0-flash-lite ตามที่คุณแจ้ง
-            tools=[get_table_schema, create_table_ddl, execute_sql_query] # เพิ่ม Tools ที่เกี่ยวข้องกับการจัดการ DW
+            tools=list(cls.TOOLS.values()), # เพิ่ม Tools ที่เกี่ยวข้องกับการจัดการ DW
+            system_instruction=cls.build_system_instruction(),
         )
-        self.chat_session = self.model.start_chat(enable_automatic_function_calling=True)
 
-    def process_prompt(self, user_prompt: str, st_response_container):
+    def __init__(self, api_key: str, model=None):
+        """
+        เริ่มต้น DataWarehouseAgent ด้วย Gemini Pro Model และ Tools ที่กำหนด
+        สามารถส่ง model (เช่น StubGenerativeModel) เข้ามาแทน Gemini สำหรับการทดสอบแบบ offline ได้
+        """
+        self.system_instruction = self.build_system_instruction()
+        self.model = model if model is not None else self.build_model(api_key)
+        self.chat_session = self.model.start_chat(enable_automatic_function_calling=False)
+
+    def _run_tool(self, tool_name: str, tool_args: dict) -> dict:
+        """
+        รัน Tool หนึ่งตัว (อาจถูกเรียกจาก worker thread จึงห้ามเรียก Streamlit ในนี้)
+
+        Returns:
+            dict: {"output": ผลลัพธ์ที่ส่งกลับให้ model, "display": ข้อความ markdown สำหรับแสดงใน UI, "ddl": DDL ที่สร้าง (ถ้ามี)}
+        """
+        tool_func = self.TOOLS.get(tool_name)
+        if tool_func is None:
+            actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Warehouse Agent"
+            return {"output": actual_output, "display": actual_output}
+
+        # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
+        if tool_name in self.DB_TOOLS:
+            tool_args['database_url'] = config.DATABASE_URL
+        actual_output = tool_func(**tool_args)
+        if tool_name == "create_table_ddl" and "Error" not in actual_output:
+            ddl = actual_output.split("DDL: ")[-1].strip() # ดึงเฉพาะ DDL command
+            return {"output": actual_output, "display": f"Tool Output:\n```sql\n{ddl}\n```\n", "ddl": ddl}
+        return {"output": actual_output, "display": f"Tool Output:\n```json\n{actual_output}\n```\n"}
+
+    @traced_prompt
+    def process_prompt(self, user_prompt: str, st_response_container=None, event_sink=None):
         """
         ประมวลผลคำสั่งจากผู้ใช้สำหรับ Data Warehouse Agent
         แสดงผลลัพธ์แบบ Streaming ผ่าน st_response_container
 
         Args:
             user_prompt (str): คำสั่งจากผู้ใช้
-            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming
+            st_response_container (st.empty): Streamlit container สำหรับแสดงผลลัพธ์แบบ Streaming (None = ไม่แสดงผลใน UI)
+            event_sink: sink สำหรับรับ event ระหว่างประมวลผล (agents/events.py) เช่นจาก runtime แบบ headless
 
         Returns:
             tuple: (ข้อความตอบกลับทั้งหมดจาก Agent, SQL DDL/DML ที่ Agent สร้างขึ้น)
         """
-        full_response_parts = []
+        renderer = ResponseRenderer(st_response_container, sink=event_sink) # แสดงผลแบบเพิ่มทีละส่วนและรวมการอัปเดต UI
         sql_generated = "" # สำหรับเก็บ SQL ที่ Agent อาจจะสร้างขึ้นมา
 
-        context_prompt = (
-            f"You are a Data Warehouse Agent. Your goal is to manage and optimize the Data Warehouse. "
-            f"You have access to a SQLite database at '{config.DATABASE_URL}'. "
-            f"You can use the following tools: `get_table_schema` to inspect table schemas, "
-            f"`create_table_ddl` to define new tables, and `execute_sql_query` to run SQL commands. "
-            f"Always use the provided database URL for all database operations."
-        )
-        self.chat_session.send_message(context_prompt)
+        # จำกัดขนาด history ให้อยู่ใน token budget ก่อนส่ง prompt ใหม่
+        compact_history(self.chat_session)
 
         try:
-            response = self.chat_session.send_message(user_prompt, stream=False) # <--- Changed to stream=False
-
-            if response.text:
-                full_response_parts.append(response.text)
-                st_response_container.markdown("".join(full_response_parts))
-
-            if hasattr(response, 'function_calls') and response.function_calls:
-                for fc in response.function_calls:
-                    tool_name = fc.name
-                    tool_args = fc.args
-                    tool_output_str = f"\n\n**Agent กำลังเรียกใช้ Tool:** `{tool_name}` พร้อม Arguments: `{tool_args}`\n"
-                    full_response_parts.append(tool_output_str)
-                    st_response_container.markdown("".join(full_response_parts))
-
-                    actual_output = "Tool output not available yet."
-                    
-                    # บังคับใช้ DATABASE_URL จาก config เสมอสำหรับ Tools ที่เกี่ยวข้องกับฐานข้อมูล
-                    if tool_name in ["get_table_schema", "create_table_ddl", "execute_sql_query"]:
-                         tool_args['database_url'] = config.DATABASE_URL
-
-                    # ทำการเรียกใช้ Tool จริงๆ
-                    if tool_name in ["get_table_schema", "create_table_ddl", "execute_sql_query"]:
-                         tool_func = globals().get(tool_name) # ดึงฟังก์ชันจาก global scope (ควรจัดการให้ปลอดภัยใน production)
-                         if tool_func:
-                             actual_output = tool_func(**tool_args)
-                             if tool_name == "create_table_ddl" and "Error" not in actual_output:
-                                 sql_generated = actual_output.split("DDL: ")[-1].strip() # ดึงเฉพาะ DDL command
-                                 full_response_parts.append(f"Tool Output:\n```sql\n{sql_generated}\n```\n")
-                                 st_response_container.markdown("".join(full_response_parts))
-                             else:
-                                 full_response_parts.append(f"Tool Output:\n```json\n{actual_output}\n```\n")
-                                 st_response_container.markdown("".join(full_response_parts))
-                         else:
-                             actual_output = f"Tool '{tool_name}' ไม่พบหรือไม่รองรับ"
-                             full_response_parts.append(actual_output)
-                             st_response_container.markdown("".join(full_response_parts))
-                    else:
-                        actual_output = f"Tool `{tool_name}` ไม่รองรับโดย Data Warehouse Agent"
-                        full_response_parts.append(actual_output)
-                        st_response_container.markdown("".join(full_response_parts))
-
-                    # ส่งผลลัพธ์ของ Tool กลับไปยัง Gemini
-                    self.chat_session.send_message(genai.Part.from_function_response(name=tool_name, response=actual_output))
-            
-            # ดึงข้อความสรุปสุดท้ายจาก Gemini หลังจาก Tool Call
-            final_response = self.chat_session.send_message("สรุปผลลัพธ์สุดท้ายของการดำเนินการทั้งหมดจากข้อมูล Tool output ที่ได้รับอย่างละเอียด", stream=False) # <--- Changed to stream=False
-            if final_response.text:
-                full_response_parts.append(final_response.text)
-                st_response_container.markdown("".join(full_response_parts))
-            
-            final_full_response_text = "".join(full_response_parts)
+            # ส่ง prompt แบบ streaming (Tool calls ถูกรันโดย Agent เอง จึงใช้ stream ได้)
+            response = stream_reply(self.chat_session, user_prompt, renderer)
+
+            tool_rounds = 0
+            while True:
+                function_calls = get_function_calls(response)
+                if not function_calls:
+                    break
+                if tool_rounds >= config.AGENT_MAX_TOOL_ROUNDS:
+                    renderer.append(f"\n{close_unanswered_calls(self.chat_session, function_calls)}\n")
+                    break
+                tool_rounds += 1
+
+                for fc in function_calls:
+                    renderer.tool_call(fc.name, dict(fc.args or {}))
+                renderer.flush()
+
+                # รัน Tool calls ทั้งหมด (call ที่อ่านอย่างเดียวรันพร้อมกัน) แล้วแสดงผลตามลำดับเดิม
+                results = run_tool_calls(function_calls, self._run_tool)
+                for result in results:
+                    renderer.tool_output(result["name"], result["output"], result["display"])
+                    if result.get("ddl"):
+                        sql_generated = result["ddl"]
+                renderer.flush()
+
+                # ส่งผลลัพธ์ของทุก Tool กลับไปยัง Gemini ใน message เดียว คำตอบที่ได้คือสรุปผลของรอบนี้
+                response = stream_reply(self.chat_session, function_response_message(results), renderer)
+
+            final_full_response_text = renderer.close()
 
             # ตรวจสอบและดึง SQL Code ที่ Gemini อาจสร้างขึ้นในรูปแบบ Text
             sql_blocks = re.findall(r"```sql\n(.*?)```", final_full_response_text, re.DOTALL)
@@ -107,6 +160,6 @@ class DataWarehouseAgent:
             return final_full_response_text, sql_generated
 
         except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Warehouse Agent: {e}")
+            renderer.error(f"เกิดข้อผิดพลาดในการสื่อสารกับ Data Warehouse Agent: {e}")
             return f"เกิดข้อผิดพลาด: {str(e)}", ""
 
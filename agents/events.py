@@ -0,0 +1,110 @@
+# agents/events.py
+"""
+Event ที่ Agent ส่งออกระหว่างประมวลผล prompt และ sink สำหรับรับ event โดยไม่ขึ้นกับ UI
+
+event เป็น dict ที่มี key "type" เสมอ:
+- {"type": "text", "text": ...}                              ข้อความจาก model (ทีละส่วนตามที่ stream มา)
+- {"type": "tool_call", "tool": ..., "args": {...}}          Agent กำลังจะเรียก Tool
+- {"type": "tool_result", "tool": ..., "output": ...}        ผลลัพธ์ฉบับเต็มของ Tool
+- {"type": "error", "message": ...}                          เกิดข้อผิดพลาดระหว่างประมวลผล
+- {"type": "done", "status": ..., ...}                       prompt เสร็จสิ้น (ส่งโดย runtime)
+
+sink ต้องรับ event จากหลาย thread ได้ (Agent รันบน worker thread)
+"""
+from abc import ABC, abstractmethod
+import threading
+import json
+import sys
+
+class AgentCancelled(Exception):
+    """prompt ถูกยกเลิก (เช่น เกินเวลาที่กำหนด) ระหว่างที่ Agent กำลังทำงาน"""
+
+class EventSink(ABC):
+    """
+    sink พื้นฐาน: รับ event ผ่าน emit และมีสถานะ cancelled ที่ Agent ตรวจสอบระหว่างทำงาน
+    """
+    cancelled = False
+
+    @abstractmethod
+    def emit(self, event: dict):
+        """รับ event หนึ่งรายการ (อาจถูกเรียกจากหลาย thread)"""
+
+class CallbackSink(EventSink):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, event: dict):
+        self.callback(event)
+
+class ListSink(EventSink):
+    """เก็บ event ทั้งหมดไว้ในหน่วยความจำ (ใช้กับ batch และการทดสอบ)"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+class JsonlSink(EventSink):
+    """
+    เขียน event เป็น JSON หนึ่งบรรทัดต่อ event (ค่าเริ่มต้นคือ stdout)
+    ผลลัพธ์ Tool ที่ยาวเกิน max_output_chars จะถูกตัด (None = ไม่ตัด)
+    """
+
+    def __init__(self, stream=None, max_output_chars: int = None):
+        self.stream = stream or sys.stdout
+        self.max_output_chars = max_output_chars
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict):
+        output = event.get("output")
+        if self.max_output_chars is not None and isinstance(output, str) and len(output) > self.max_output_chars:
+            event = {**event, "output": output[:self.max_output_chars], "output_truncated": len(output)}
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+class AsyncQueueSink(EventSink):
+    """
+    ส่ง event จาก worker thread เข้า asyncio.Queue ของ event loop (สำหรับ async for event in runtime.stream(...))
+    """
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+
+    def emit(self, event: dict):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+class FanOutSink(EventSink):
+    """ส่ง event เดียวกันไปยังหลาย sink"""
+
+    def __init__(self, *sinks):
+        self.sinks = [s for s in sinks if s is not None]
+
+    def emit(self, event: dict):
+        for sink in self.sinks:
+            sink.emit(event)
+
+class RequestSink(EventSink):
+    """
+    sink ของ prompt หนึ่งครั้ง: เติม session_id/agent ให้ทุก event และเก็บสถานะการยกเลิกของ prompt นั้น
+    """
+
+    def __init__(self, sink: EventSink, **fields):
+        self.sink = sink
+        self.fields = fields
+        self.cancelled = False
+
+    def emit(self, event: dict):
+        # หลังถูกยกเลิก ส่งต่อเฉพาะ event "done" (ไม่ส่ง event ที่ Agent ยังทำค้างอยู่)
+        if self.cancelled and event["type"] != "done":
+            return
+        if self.sink is not None:
+            self.sink.emit({**self.fields, **event})
+
+    def cancel(self):
+        self.cancelled = True
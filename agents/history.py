@@ -0,0 +1,113 @@
+# agents/history.py
+import google.generativeai as genai
+
+import config
+
+# ประมาณจำนวน token จากจำนวนตัวอักษร (ประมาณ 4 ตัวอักษรต่อ token)
+CHARS_PER_TOKEN = 4
+SUMMARY_PREFIX = "[สรุปบทสนทนาก่อนหน้า]"
+
+def _role(content) -> str:
+    return content["role"] if isinstance(content, dict) else content.role
+
+def _parts(content) -> list:
+    parts = content["parts"] if isinstance(content, dict) else content.parts
+    return [parts] if isinstance(parts, str) else list(parts)
+
+def _is_function_response(part) -> bool:
+    return not isinstance(part, str) and "function_response" in part
+
+def _part_text(part) -> str:
+    if isinstance(part, str):
+        return part
+    if _is_function_response(part):
+        return str(dict(part.function_response.response).get("result", ""))
+    if "function_call" in part:
+        return f"{part.function_call.name}({dict(part.function_call.args)})"
+    return getattr(part, "text", "") or ""
+
+def estimate_tokens(history) -> int:
+    """
+    ประมาณจำนวน token ของ history ทั้งหมด
+    """
+    chars = sum(len(_part_text(part)) for content in history for part in _parts(content))
+    return chars // CHARS_PER_TOKEN
+
+def _collapse_part(part, max_chars: int):
+    """
+    ย่อผลลัพธ์ของ Tool ที่ยาวเกิน max_chars ให้เหลือเฉพาะส่วนต้น
+    """
+    if not _is_function_response(part):
+        return part
+    result = _part_text(part)
+    if len(result) <= max_chars:
+        return part
+    collapsed = result[:max_chars] + f"... [ตัดทอนผลลัพธ์ Tool อีก {len(result) - max_chars} ตัวอักษร]"
+    return genai.protos.Part(
+        function_response=genai.protos.FunctionResponse(name=part.function_response.name, response={"result": collapsed})
+    )
+
+def _is_turn_start(content) -> bool:
+    # Turn ใหม่เริ่มที่ข้อความของผู้ใช้ที่ไม่ใช่ผลลัพธ์ของ Tool
+    return _role(content) == "user" and not any(_is_function_response(part) for part in _parts(content))
+
+def _summarise(dropped, previous_summary: str, max_chars: int) -> str:
+    lines = [previous_summary] if previous_summary else []
+    for content in dropped:
+        text = " ".join(_part_text(part) for part in _parts(content) if not _is_function_response(part)).strip()
+        if text:
+            speaker = "ผู้ใช้" if _role(content) == "user" else "Agent"
+            lines.append(f"- {speaker}: {text[:200]}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        summary = "..." + summary[-max_chars:]
+    return summary
+
+def compact_history(chat_session, token_budget: int = None, tool_output_chars: int = None, summary_chars: int = None) -> dict:
+    """
+    จำกัดขนาด history ของ chat session ให้อยู่ใน token budget
+
+    1. ย่อผลลัพธ์ของ Tool ที่ยาวเกินใน turn ก่อนหน้า
+    2. ถ้ายังเกิน budget ให้ตัด turn เก่าที่สุดออก และแทนที่ด้วยข้อความสรุปสั้นๆ หนึ่งคู่ (user/model)
+
+    Returns:
+        dict: {"tokens_before", "tokens_after", "dropped_turns"}
+    """
+    token_budget = token_budget or config.AGENT_HISTORY_TOKEN_BUDGET
+    tool_output_chars = tool_output_chars or config.AGENT_HISTORY_TOOL_OUTPUT_CHARS
+    summary_chars = summary_chars or config.AGENT_HISTORY_SUMMARY_CHARS
+
+    history = list(chat_session.history)
+    tokens_before = estimate_tokens(history)
+    if tokens_before <= token_budget:
+        return {"tokens_before": tokens_before, "tokens_after": tokens_before, "dropped_turns": 0}
+
+    history = [{"role": _role(content), "parts": [_collapse_part(part, tool_output_chars) for part in _parts(content)]}
+               for content in history]
+
+    previous_summary = ""
+    if history and _part_text(_parts(history[0])[0]).startswith(SUMMARY_PREFIX):
+        previous_summary = _part_text(_parts(history[0])[0])[len(SUMMARY_PREFIX):].strip()
+        history = history[2:]
+
+    turn_starts = [i for i, content in enumerate(history) if _is_turn_start(content)]
+    dropped_turns = 0
+    cut = 0
+    # เก็บ turn ล่าสุดไว้เสมอ
+    for next_start in turn_starts[1:]:
+        if estimate_tokens(history[cut:]) <= token_budget:
+            break
+        cut = next_start
+        dropped_turns += 1
+
+    summary = _summarise(history[:cut], previous_summary, summary_chars)
+    history = history[cut:]
+    if summary:
+        history = [
+            {"role": "user", "parts": [f"{SUMMARY_PREFIX}\n{summary}"]},
+            {"role": "model", "parts": ["รับทราบ"]},
+        ] + history
+
+    chat_session.history = history
+    tokens_after = estimate_tokens(history)
+    return {"tokens_before": tokens_before, "tokens_after": tokens_after, "dropped_turns": dropped_turns}
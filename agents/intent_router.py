@@ -0,0 +1,154 @@
+# agents/intent_router.py
+"""
+Intent router: จับคู่คำสั่งที่พบบ่อยกับ template ที่รู้จัก แล้วรัน Tool ได้ทันทีโดยไม่ต้องถาม model
+
+- รองรับเฉพาะคำสั่งที่ตรงกับ template ทั้งประโยค (คำสั่งที่ซับซ้อนกว่านั้นส่งให้ model ตามปกติ)
+- ตรวจชื่อตาราง/ไฟล์/pipeline กับของจริงก่อน (schema catalog, ระบบไฟล์, pipeline ที่บันทึกไว้) ถ้าไม่พบจะส่งให้ model
+- นับจำนวน prompt ที่ตอบได้ทันที (hit) และที่ต้องส่งให้ model (miss) เพื่อรายงาน hit rate
+"""
+import threading
+import os
+import re
+
+from tools.db_tools import db_connection
+from tools.schema_catalog import schema_catalog
+from tools.pipeline import list_pipeline_definitions
+import config
+
+_POLITE = r"(?:please\s+|pls\s+|ช่วย\s*|กรุณา\s*)?"
+_END = r"\s*(?:please|ให้หน่อย|หน่อย|ด้วย|ครับ|ค่ะ|คะ)?\s*[.!?]*"
+_TABLE = r"(?:the\s+)?(?:table\s+|ตาราง\s*)?[`'\"]?(?P<table>[A-Za-z_][A-Za-z0-9_]*)[`'\"]?(?:\s+table)?"
+
+def _mock_csv_columns(kind: str) -> set:
+    # คอลัมน์จาก header ของ CSV จำลองใน config (บรรทัดแรกที่ไม่ว่าง)
+    content = config.MOCK_CUSTOMER_CSV if kind == "customer" else config.MOCK_SALES_CSV
+    header = next(line for line in content.splitlines() if line.strip())
+    return {column.strip().lower() for column in header.split(",")}
+
+def _template(pattern: str):
+    return re.compile(rf"{_POLITE}{pattern}{_END}", re.IGNORECASE)
+
+# intent -> template (ต้องตรงทั้งประโยค)
+TEMPLATES = {
+    "load_file": [
+        _template(r"(?:load|import|ingest|โหลด|นำเข้า)\s*(?:the\s+)?(?:file\s+|ไฟล์\s*)?[`'\"]?(?P<path>[^\s`'\"]+\.(?P<ext>csv|parquet|pq))[`'\"]?"
+                  rf"\s*(?:into|to|เข้า(?:สู่)?)\s*{_TABLE}(?P<upsert>\s+(?:with\s+)?upsert)?"),
+    ],
+    "load_mock_data": [
+        _template(r"(?:load|import|โหลด)\s*(?:the\s+)?(?:mock\s+|sample\s+|ข้อมูล(?:จำลอง)?\s*)?(?P<kind>customer|sales)s?(?:\s+(?:data|csv))?"
+                  rf"\s*(?:into|to|เข้า(?:สู่)?)\s*{_TABLE}"),
+    ],
+    "table_schema": [
+        _template(rf"(?:show|get|display|what\s+is|what's)\s+(?:the\s+)?(?:schema|structure|columns)\s+(?:of|for|in)\s+{_TABLE}"),
+        _template(rf"describe\s+{_TABLE}"),
+        _template(rf"(?:แสดง|ดู)?\s*(?:schema|โครงสร้าง|คอลัมน์)\s*(?:ของ)?\s*{_TABLE}"),
+    ],
+    "count_rows": [
+        _template(rf"(?:count|how\s+many)\s+(?:the\s+)?(?:rows|records)\s+(?:are\s+)?(?:there\s+)?(?:in|of)\s+{_TABLE}"),
+        _template(rf"count\s+{_TABLE}"),
+        _template(rf"(?:นับ)?\s*จำนวน(?:แถว|ข้อมูล|record)(?:ทั้งหมด)?\s*(?:ใน|ของ)?\s*{_TABLE}(?:\s*มีกี่แถว)?"),
+        _template(rf"{_TABLE}\s*มีกี่(?:แถว|record)"),
+    ],
+    "preview_rows": [
+        _template(rf"(?:show|preview|display|get)\s+(?:the\s+)?(?:first\s+|top\s+)?(?P<limit>\d+)?\s*(?:rows|records)\s+(?:of|from|in)\s+{_TABLE}"),
+        _template(rf"preview\s+{_TABLE}"),
+        _template(rf"(?:แสดง|ดู)\s*(?:ข้อมูล)?\s*(?P<limit>\d+)?\s*(?:แถวแรก)?\s*(?:ของ|จาก|ใน)?\s*{_TABLE}"),
+    ],
+    "run_pipeline": [
+        _template(r"(?:run|execute|trigger|start|รัน)\s+(?:the\s+)?(?:pipeline|ไปป์ไลน์)\s+[`'\"]?(?P<pipeline>[A-Za-z0-9_\-]+)[`'\"]?(?P<force>\s+(?:with\s+)?force)?"),
+    ],
+}
+
+class IntentRouter:
+    """
+    จับคู่ prompt กับ template และคืนค่า Tool call ที่ต้องรัน (หรือ None ถ้าต้องส่งให้ model)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"prompts": 0, "hits": 0, "misses": 0, "by_intent": {}}
+
+    def _resolve_table(self, database_url: str, name: str):
+        # เทียบชื่อตารางแบบไม่สนตัวพิมพ์เล็ก/ใหญ่กับ schema catalog (ไม่ต้อง query ฐานข้อมูลถ้า cache อยู่แล้ว)
+        tables = schema_catalog.describe_all(database_url, lambda: db_connection(database_url))
+        return {table.lower(): table for table in tables}.get(name.lower())
+
+    def _build(self, intent: str, match, database_url: str):
+        groups = match.groupdict()
+        if intent == "load_file":
+            path = groups["path"]
+            if not os.path.isfile(path):
+                return None
+            tool = "load_csv_into_table" if groups["ext"].lower() == "csv" else "load_parquet_into_table"
+            args = {"table_name": groups["table"], "file_path": path, "upsert": bool(groups.get("upsert"))}
+            return tool, args, f"โหลดไฟล์ `{path}` เข้าตาราง `{groups['table']}`"
+        if intent == "run_pipeline":
+            if groups["pipeline"] not in {p["name"] for p in list_pipeline_definitions(database_url)}:
+                return None
+            args = {"pipeline_name": groups["pipeline"], "force": bool(groups.get("force"))}
+            return "run_data_pipeline", args, f"รัน pipeline `{groups['pipeline']}`"
+
+        table = self._resolve_table(database_url, groups["table"])
+        if table is None:
+            return None
+        if intent == "load_mock_data":
+            # ใช้ข้อมูล CSV จำลองใน config ตาม kind (customer/sales) และโหลดเข้าตารางที่มีอยู่แล้วเท่านั้น
+            # ตารางต้องมีทุกคอลัมน์ของ CSV จำลอง มิฉะนั้นให้ model ตัดสินใจ (เช่นโหลดผิดตาราง)
+            kind = groups["kind"].lower()
+            description = schema_catalog.describe(database_url, lambda: db_connection(database_url), table)
+            if description is None or not _mock_csv_columns(kind) <= {column.lower() for column in description["columns"]}:
+                return None
+            return ("create_dataframe_from_csv_content", {"kind": kind, "table_name": table},
+                    f"โหลดข้อมูล {kind} จำลองเข้าตาราง `{table}`")
+        if intent == "table_schema":
+            return "get_table_schema", {"table_name": table}, f"Schema ของตาราง `{table}`"
+        if intent == "count_rows":
+            return ("execute_sql_query", {"query": f'SELECT COUNT(*) AS row_count FROM "{table}"'},
+                    f"จำนวนแถวในตาราง `{table}`")
+        limit = min(int(groups.get("limit") or config.INTENT_ROUTER_PREVIEW_ROWS), config.TOOL_OUTPUT_PAGE_MAX_ROWS)
+        return ("execute_sql_query", {"query": f'SELECT * FROM "{table}" LIMIT {limit}'},
+                f"{limit} แถวแรกของตาราง `{table}`")
+
+    def route(self, user_prompt: str, database_url: str):
+        """
+        คืนค่า {"intent", "tool", "args", "summary"} ถ้า prompt ตรงกับ template และอ้างถึงสิ่งที่มีอยู่จริง มิฉะนั้นคืน None
+        """
+        prompt = " ".join((user_prompt or "").split())
+        routed = None
+        for intent, templates in TEMPLATES.items():
+            for template in templates:
+                match = template.fullmatch(prompt)
+                if match is None:
+                    continue
+                try:
+                    built = self._build(intent, match, database_url)
+                except Exception:
+                    built = None # ตรวจสอบไม่ได้ (เช่นเชื่อมต่อฐานข้อมูลไม่ได้) ให้ model จัดการ
+                if built is not None:
+                    tool, args, summary = built
+                    routed = {"intent": intent, "tool": tool, "args": args, "summary": summary}
+                break
+            if routed is not None:
+                break
+
+        with self._lock:
+            self._stats["prompts"] += 1
+            if routed is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._stats["by_intent"][routed["intent"]] = self._stats["by_intent"].get(routed["intent"], 0) + 1
+        return routed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self._stats, "by_intent": dict(self._stats["by_intent"])}
+        stats["hit_rate"] = round(stats["hits"] / stats["prompts"], 4) if stats["prompts"] else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {"prompts": 0, "hits": 0, "misses": 0, "by_intent": {}}
+
+# Intent router ที่ใช้ร่วมกันทั้ง process
+intent_router = IntentRouter()
@@ -0,0 +1,200 @@
+# agents/renderer.py
+import pandas as pd
+import time
+import uuid
+import json
+
+from agents.tool_executor import get_function_calls, get_response_text
+from agents.events import AgentCancelled
+from tools.tracing import tracer
+import config
+
+class ResponseRenderer:
+    """
+    แสดงคำตอบของ Agent แบบเพิ่มทีละส่วนใน Streamlit container
+
+    - ข้อความถูกเก็บเป็น segment; แต่ละครั้งที่อัปเดตจะ render ใหม่เฉพาะ segment ล่าสุด ไม่ใช่ข้อความทั้งหมด
+    - การอัปเดตถูกรวมกันตามเวลา/จำนวนตัวอักษร (throttle) เพื่อลดจำนวนครั้งที่ส่งข้อมูลไปยัง browser
+    - ผลลัพธ์ Tool ขนาดใหญ่ถูกแสดงเป็น expander ที่ยุบไว้ พร้อมตัวอย่างหน้าแรกและปุ่มดาวน์โหลด แทน JSON ทั้งก้อน
+
+    ถ้า container ไม่รองรับการแบ่ง segment (เช่น container จำลองที่มีแค่ markdown) จะ render ข้อความทั้งหมดแบบ throttle แทน
+    ถ้า container เป็น None จะไม่แสดงผลใน UI เลย (โหมด headless) และส่งเฉพาะ event ไปยัง sink
+    sink (agents/events.py) ได้รับ event text/tool_call/tool_result/error ทุกครั้งโดยไม่ถูก throttle
+    """
+
+    def __init__(self, container=None, min_interval: float = None, min_chars: int = None, sink=None):
+        self.min_interval = config.RENDER_MIN_INTERVAL_S if min_interval is None else min_interval
+        self.min_chars = config.RENDER_MIN_CHARS if min_chars is None else min_chars
+        self._container = container
+        self._sink = sink
+        self._root = container.container() if hasattr(container, "container") else None
+        self._parts = []          # ข้อความทั้งหมดของคำตอบ (สำหรับคืนค่าและเก็บใน history)
+        self._segment = []        # ข้อความของ segment ปัจจุบัน
+        self._placeholder = None  # st.empty ของ segment ปัจจุบัน
+        self._pending_chars = 0
+        self._last_flush = 0.0
+        self.flush_count = 0
+        self.render_seconds = 0.0  # เวลารวมที่ใช้ส่งข้อมูลไปยัง UI (บันทึกเป็น span "render" ตอน close)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def _emit(self, event: dict):
+        if self._sink is not None:
+            self._sink.emit(event)
+
+    def _check_cancelled(self):
+        if self._sink is not None and self._sink.cancelled:
+            raise AgentCancelled("prompt ถูกยกเลิก")
+
+    def append(self, text: str):
+        if not text:
+            return
+        self._check_cancelled()
+        self._emit({"type": "text", "text": text})
+        self._append_markdown(text)
+
+    def _append_markdown(self, text: str):
+        self._parts.append(text)
+        self._segment.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self.min_chars or time.monotonic() - self._last_flush >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._pending_chars:
+            return
+        started = time.perf_counter()
+        if self._container is None:
+            pass
+        elif self._root is None:
+            self._container.markdown(self.text)
+        else:
+            if self._placeholder is None:
+                self._placeholder = self._root.empty()
+            segment_text = "".join(self._segment)
+            self._placeholder.markdown(segment_text)
+            # ปิด segment ที่ยาวแล้ว (เมื่อ code block ครบคู่) เพื่อไม่ให้ต้อง render ข้อความยาวซ้ำ
+            if len(segment_text) >= config.RENDER_SEGMENT_CHARS and segment_text.count("```") % 2 == 0:
+                self._end_segment()
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.flush_count += 1
+        self.render_seconds += time.perf_counter() - started
+
+    def _end_segment(self):
+        self._segment = []
+        self._placeholder = None
+
+    def tool_call(self, tool_name: str, tool_args: dict):
+        """
+        แจ้งว่า Agent กำลังเรียก Tool (แสดงใน UI และส่ง event tool_call)
+        """
+        self._check_cancelled()
+        self._emit({"type": "tool_call", "tool": tool_name, "args": tool_args})
+        self._append_markdown(f"\n\n**Agent กำลังเรียกใช้ Tool:** `{tool_name}` พร้อม Arguments: `{tool_args}`\n")
+
+    def tool_output(self, tool_name: str, output, display: str):
+        """
+        แสดงผลลัพธ์ของ Tool: ผลลัพธ์ขนาดเล็กแสดงแบบ inline ตามเดิม ผลลัพธ์ขนาดใหญ่แสดงเป็นบล็อกที่ยุบไว้
+        """
+        output = output if isinstance(output, str) else str(output)
+        self._emit({"type": "tool_result", "tool": tool_name, "output": output})
+        if len(output) <= config.RENDER_TOOL_OUTPUT_INLINE_CHARS:
+            self._append_markdown(display)
+            return
+
+        try:
+            parsed = json.loads(output)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict) and isinstance(parsed.get("rows"), list):
+            parsed = parsed["rows"]
+        records = parsed if isinstance(parsed, list) else None
+        size_label = f"{len(records)} แถว" if records is not None else f"{len(output)} ตัวอักษร"
+        placeholder_text = f"\nTool Output: `{tool_name}` ({size_label}, แสดงแบบย่อ)\n"
+
+        if self._root is None:
+            self._append_markdown(placeholder_text)
+            return
+
+        self.flush()
+        self._end_segment()
+        self._parts.append(placeholder_text)
+        started = time.perf_counter()
+        with self._root.expander(f"Tool Output: {tool_name} ({size_label})", expanded=False):
+            import streamlit as st
+            page_rows = config.RENDER_TOOL_OUTPUT_PAGE_ROWS
+            if records is not None:
+                st.dataframe(pd.DataFrame.from_records(records[:page_rows]))
+                if len(records) > page_rows:
+                    st.caption(f"แสดง {page_rows} แถวแรกจากทั้งหมด {len(records)} แถว")
+            else:
+                st.code(output[:config.RENDER_TOOL_OUTPUT_INLINE_CHARS])
+            st.download_button(
+                "ดาวน์โหลดผลลัพธ์ฉบับเต็ม", output, file_name=f"{tool_name}.json",
+                mime="application/json", key=f"download-{uuid.uuid4().hex}",
+            )
+        self.render_seconds += time.perf_counter() - started
+
+    def error(self, message: str):
+        """
+        แจ้งข้อผิดพลาด (แสดงด้วย st.error เมื่อรันใน Streamlit และส่ง event error)
+        """
+        self._emit({"type": "error", "message": message})
+        if self._root is not None:
+            import streamlit as st
+            st.error(message)
+
+    def close(self) -> str:
+        self.flush()
+        tracer.record("render", "render", self.render_seconds * 1000, flushes=self.flush_count, chars=sum(len(p) for p in self._parts))
+        return self.text
+
+def render_stream(response, renderer: ResponseRenderer) -> str:
+    """
+    อ่าน response แบบ streaming ทีละ chunk และส่งข้อความต่อให้ renderer ทันที
+    คืนค่าข้อความทั้งหมดของ response นี้
+    """
+    texts = []
+    for chunk in response:
+        text = get_response_text(chunk)
+        if text:
+            texts.append(text)
+            renderer.append(text)
+    return "".join(texts)
+
+def stream_reply(chat_session, content, renderer: ResponseRenderer):
+    """
+    ส่ง message ให้ model แล้วแสดงคำตอบผ่าน renderer ทันทีที่ได้รับ (ตาม config.AGENT_STREAM_RESPONSES)
+    บันทึก span "send_message" ครอบทั้งการส่งและการอ่าน stream พร้อมเวลาถึง chunk แรกและจำนวน token (ถ้ามี)
+
+    Returns:
+        response ของ model (ใช้ดึง function calls ต่อ)
+    """
+    span = tracer.start_span("send_message", "llm", stream=config.AGENT_STREAM_RESPONSES)
+    render_before = renderer.render_seconds
+    started = time.perf_counter()
+    try:
+        options = {"request_options": {"timeout": config.AGENT_MODEL_REQUEST_TIMEOUT_S}} if config.AGENT_MODEL_REQUEST_TIMEOUT_S > 0 else {}
+        response = chat_session.send_message(content, stream=config.AGENT_STREAM_RESPONSES, **options)
+        span.set(first_response_ms=round((time.perf_counter() - started) * 1000, 3))
+        text = render_stream(response, renderer)
+    except Exception as e:
+        tracer.end_span(span, error=e)
+        raise
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        span.set(
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            total_tokens=getattr(usage, "total_token_count", None),
+        )
+    span.set(
+        response_chars=len(text),
+        function_calls=len(get_function_calls(response)),
+        render_ms=round((renderer.render_seconds - render_before) * 1000, 3),
+    )
+    tracer.end_span(span)
+    return response
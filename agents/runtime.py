@@ -0,0 +1,297 @@
+# agents/runtime.py
+"""
+Runtime แบบ asyncio สำหรับรัน Agent โดยไม่ต้องใช้ Streamlit (headless)
+
+- แต่ละ session มี Agent (และ chat session) ของตัวเอง prompt ของ session เดียวกันรันทีละ prompt ตามลำดับ
+- prompt ของหลาย session รันพร้อมกันบน thread pool โดยจำกัดจำนวนด้วย concurrency
+- prompt ที่เกิน timeout จะถูกยกเลิก (Agent หยุดที่ event ถัดไป) และรายงานสถานะ "timeout"
+  slot ของ concurrency ถูกคืนทันทีและ session นั้นถูกปิด (prompt ถัดไปของ session id เดิมได้ Agent ใหม่)
+  ส่วนการเรียก model ที่ค้างอยู่จะจบเองตาม config.AGENT_MODEL_REQUEST_TIMEOUT_S
+- session ที่ว่างนานเกิน config.AGENT_RUNTIME_SESSION_IDLE_S หรือเกิน config.AGENT_RUNTIME_MAX_SESSIONS (LRU) ถูกปิดอัตโนมัติ
+- event ระหว่างประมวลผล (text, tool_call, tool_result, error, done) ถูกส่งไปยัง sink ที่กำหนด (agents/events.py)
+
+ตัวอย่าง CLI:
+    python -m agents.runtime --agent mart --prompt "ยอดขายรวมตามสินค้า"
+    python -m agents.runtime --batch prompts.jsonl --concurrency 8 --timeout 60 --output results.jsonl
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import contextvars
+import functools
+import importlib
+import argparse
+import asyncio
+import time
+import json
+import sys
+
+from agents.events import FanOutSink, JsonlSink, AsyncQueueSink, RequestSink
+import config
+
+# ชื่อย่อของ Agent -> (module, class)
+AGENT_TYPES = {
+    "pipeline": ("agents.data_pipeline_agent", "DataPipelineAgent"),
+    "warehouse": ("agents.data_warehouse_agent", "DataWarehouseAgent"),
+    "mart": ("agents.data_mart_agent", "DataMartAgent"),
+}
+
+def load_agent_class(agent_type: str):
+    if agent_type not in AGENT_TYPES:
+        raise ValueError(f"ไม่รู้จัก Agent '{agent_type}' (เลือกได้: {', '.join(AGENT_TYPES)})")
+    module_name, class_name = AGENT_TYPES[agent_type]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def _result_fields(agent_type: str, output) -> dict:
+    """
+    แปลงค่าที่ process_prompt ของแต่ละ Agent คืนมา (tuple) เป็น dict
+    """
+    if not isinstance(output, tuple):
+        return {"text": output}
+    fields = {"text": output[0]}
+    if agent_type == "mart":
+        fields.update(sql=output[1], query_results=output[2])
+    elif agent_type == "warehouse":
+        fields.update(sql=output[1])
+    elif agent_type == "pipeline":
+        fields.update(tool_outputs=output[1])
+    return fields
+
+class _Session:
+    def __init__(self, agent_type: str, agent):
+        self.agent_type = agent_type
+        self.agent = agent
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+
+class AgentRuntime:
+    """
+    รัน prompt ของหลาย session พร้อมกันแบบ asyncio
+
+    Args:
+        concurrency (int): จำนวน prompt สูงสุดที่รันพร้อมกัน
+        timeout (float): เวลาสูงสุดต่อ prompt เป็นวินาที (None/0 = ไม่จำกัด)
+        model_factory: callable(agent_class) ที่คืนค่า model (ค่าเริ่มต้นคือ Gemini model ผ่าน build_model)
+        sink: sink ที่รับ event ของทุก prompt (เพิ่มเติมจาก sink ที่ส่งให้แต่ละ prompt)
+    """
+
+    def __init__(self, concurrency: int = None, timeout: float = None, model_factory=None, sink=None, api_key: str = None):
+        self.concurrency = concurrency or config.AGENT_RUNTIME_CONCURRENCY
+        self.timeout = config.AGENT_RUNTIME_TIMEOUT_S if timeout is None else timeout
+        self.api_key = api_key or config.GEMINI_API_KEY
+        self.model_factory = model_factory or (lambda agent_class: agent_class.build_model(self.api_key))
+        self.sink = sink
+        self._models = {}      # agent_type -> model (ใช้ร่วมกันทุก session)
+        self._sessions = OrderedDict()    # session_id -> _Session (เรียงจากใช้ล่าสุดนานที่สุด)
+        self._semaphore = None
+        # thread เผื่อไว้อีกเท่าตัวสำหรับ prompt ที่ timeout แล้วแต่ thread ยังไม่จบ (คืน slot ไปแล้ว)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="agent-runtime")
+
+    def _session(self, session_id: str, agent_type: str) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is not None:
+            if session.agent_type != agent_type:
+                raise ValueError(f"session '{session_id}' ใช้ Agent '{session.agent_type}' อยู่แล้ว")
+            self._sessions.move_to_end(session_id)
+            return session
+        self._evict_sessions()
+        agent_class = load_agent_class(agent_type)
+        if agent_type not in self._models:
+            self._models[agent_type] = self.model_factory(agent_class)
+        session = _Session(agent_type, agent_class(api_key=self.api_key, model=self._models[agent_type]))
+        self._sessions[session_id] = session
+        return session
+
+    def _evict_sessions(self):
+        """
+        ปิด session ที่ว่างนานเกิน idle TTL และ session ที่ใช้ล่าสุดนานที่สุดเมื่อจำนวน session เต็ม
+        (ข้าม session ที่กำลังรัน prompt อยู่)
+        """
+        idle_s = config.AGENT_RUNTIME_SESSION_IDLE_S
+        max_sessions = config.AGENT_RUNTIME_MAX_SESSIONS
+        now = time.monotonic()
+        idle = [sid for sid, s in self._sessions.items() if not s.lock.locked() and idle_s > 0 and now - s.last_used > idle_s]
+        for session_id in idle:
+            self.close_session(session_id)
+        if max_sessions > 0 and len(self._sessions) >= max_sessions:
+            for session_id in [sid for sid, s in self._sessions.items() if not s.lock.locked()]:
+                if len(self._sessions) < max_sessions:
+                    break
+                self.close_session(session_id)
+
+    def close_session(self, session_id: str) -> bool:
+        """
+        ปิด session และทิ้ง Agent พร้อม chat history ของ session นั้น
+        prompt ที่กำลังรันอยู่จะรันต่อจนจบ แต่ prompt ถัดไปของ session id เดิมจะได้ Agent ใหม่
+
+        Returns:
+            True ถ้ามี session นี้อยู่
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.closed = True
+        return True
+
+    async def run(self, session_id: str, agent_type: str, prompt: str, sink=None, timeout: float = None) -> dict:
+        """
+        รัน prompt หนึ่งครั้งของ session และคืนค่าผลลัพธ์ (status: ok / error / timeout)
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = self.timeout if timeout is None else timeout
+        request_sink = RequestSink(FanOutSink(self.sink, sink), session_id=session_id, agent=agent_type)
+        result = {"session_id": session_id, "agent": agent_type, "prompt": prompt}
+        started = time.perf_counter()
+
+        queue_started = time.perf_counter()
+        while True:
+            try:
+                session = self._session(session_id, agent_type)
+            except Exception as e:
+                result.update(status="error", error=str(e), elapsed_ms=0.0)
+                request_sink.emit({"type": "done", "status": "error", "error": str(e)})
+                return result
+            await session.lock.acquire()
+            if not session.closed:
+                break
+            # session ถูกปิดระหว่างรอ (เช่น prompt ก่อนหน้า timeout) ให้ใช้ session ใหม่ของ session id เดิม
+            session.lock.release()
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            session.lock.release()
+            raise
+        queued_ms = (time.perf_counter() - queue_started) * 1000
+        run = functools.partial(session.agent.process_prompt, prompt, None, request_sink)
+        future = loop.run_in_executor(self._executor, contextvars.copy_context().run, run)
+        slot = {"held": True}
+
+        def release_slot():
+            if slot["held"]:
+                slot["held"] = False
+                self._semaphore.release()
+
+        def release(_):
+            # lock ของ session คืนเมื่อ thread ทำงานเสร็จจริง ส่วน slot อาจถูกคืนไปแล้วตอน timeout
+            release_slot()
+            session.last_used = time.monotonic()
+            session.lock.release()
+        future.add_done_callback(release)
+
+        try:
+            output = await asyncio.wait_for(asyncio.shield(future), timeout or None)
+            fields = _result_fields(agent_type, output)
+            failed = isinstance(fields["text"], str) and fields["text"].startswith("เกิดข้อผิดพลาด")
+            result.update(fields, status="error" if failed else "ok")
+        except asyncio.TimeoutError:
+            request_sink.cancel()
+            # thread อาจค้างอยู่ใน send_message (ไม่มี event ให้ยกเลิก) จึงคืน slot ทันทีและปิด session นี้
+            # chat history ของ session อยู่ในสถานะไม่แน่นอนแล้ว จึงไม่นำกลับมาใช้อีก
+            release_slot()
+            if self._sessions.get(session_id) is session:
+                self.close_session(session_id)
+            result.update(status="timeout", error=f"เกินเวลา {timeout} วินาที")
+        except Exception as e:
+            result.update(status="error", error=str(e))
+        result.update(queued_ms=round(queued_ms, 3), elapsed_ms=round((time.perf_counter() - started) * 1000, 3))
+        request_sink.emit({"type": "done", "status": result["status"], "elapsed_ms": result["elapsed_ms"]})
+        return result
+
+    async def stream(self, session_id: str, agent_type: str, prompt: str, timeout: float = None):
+        """
+        รัน prompt และ yield event ทีละตัวตามที่เกิดขึ้น (event สุดท้ายคือ "done")
+        """
+        queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.run(session_id, agent_type, prompt, AsyncQueueSink(asyncio.get_running_loop(), queue), timeout))
+        while True:
+            event = await queue.get()
+            yield event
+            if event["type"] == "done":
+                break
+        await task
+
+    async def run_batch(self, requests: list, sink=None) -> list:
+        """
+        รัน request หลายรายการพร้อมกัน (แต่ละรายการเป็น dict ที่มี prompt และอาจมี session_id, agent, timeout)
+        คืนผลลัพธ์ตามลำดับของ requests
+        """
+        tasks = []
+        for index, request in enumerate(requests):
+            tasks.append(self.run(
+                str(request.get("session_id") or f"batch-{index}"),
+                request.get("agent", "mart"),
+                request["prompt"],
+                sink=sink,
+                timeout=request.get("timeout"),
+            ))
+        return await asyncio.gather(*tasks)
+
+    def close(self):
+        for session_id in list(self._sessions):
+            self.close_session(session_id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def _stub_model_factory(agent_class):
+    """
+    model จำลองสำหรับรัน CLI แบบ offline: ตอบกลับด้วยข้อความของ prompt โดยไม่เรียก Tool
+    """
+    from agents.stub_model import StubGenerativeModel, StubResponse
+    def reply(content, history):
+        return StubResponse(f"[{agent_class.__name__}] ได้รับคำสั่ง: {content}" if isinstance(content, str) else "รับทราบผลลัพธ์ของ Tool")
+    return StubGenerativeModel(reply)
+
+def _read_requests(path: str) -> list:
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [json.loads(line) for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+async def _main_async(args) -> int:
+    events_sink = JsonlSink(sys.stderr if args.output else sys.stdout, max_output_chars=args.max_output_chars) if args.events else None
+    runtime = AgentRuntime(
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        model_factory=_stub_model_factory if args.stub else None,
+        sink=events_sink,
+    )
+    try:
+        if args.batch:
+            requests = _read_requests(args.batch)
+        else:
+            requests = [{"session_id": args.session_id, "agent": args.agent, "prompt": args.prompt}]
+        results = await runtime.run_batch([{"agent": args.agent, **r} for r in requests])
+    finally:
+        runtime.close()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for result in results:
+            output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="รัน Agent แบบ headless (prompt เดียวหรือ batch จากไฟล์ JSONL)")
+    parser.add_argument("--agent", default="mart", choices=sorted(AGENT_TYPES), help="Agent ที่ใช้ (ค่าเริ่มต้นสำหรับ batch ที่ไม่ระบุ agent)")
+    parser.add_argument("--prompt", help="prompt เดียว")
+    parser.add_argument("--session-id", default="cli", help="session id ของ prompt เดียว")
+    parser.add_argument("--batch", help='ไฟล์ JSONL ของ request ({"prompt": ..., "agent": ..., "session_id": ...}) หรือ - สำหรับ stdin')
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None, help="เวลาสูงสุดต่อ prompt (วินาที)")
+    parser.add_argument("--output", help="ไฟล์ JSONL สำหรับผลลัพธ์ (ค่าเริ่มต้น stdout)")
+    parser.add_argument("--events", action="store_true", help="พิมพ์ event ระหว่างประมวลผลเป็น JSONL ด้วย")
+    parser.add_argument("--max-output-chars", type=int, default=2000, help="ตัดผลลัพธ์ Tool ใน event ให้สั้นลง")
+    parser.add_argument("--stub", action="store_true", help="ใช้ stub model แทน Gemini (offline)")
+    args = parser.parse_args(argv)
+    if not args.prompt and not args.batch:
+        parser.error("ต้องระบุ --prompt หรือ --batch")
+    return asyncio.run(_main_async(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
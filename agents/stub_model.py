@@ -0,0 +1,68 @@
+# agents/stub_model.py
+"""
+Model จำลองแบบ offline ที่ตอบกลับตาม script ที่กำหนดไว้ล่วงหน้า
+ใช้แทน genai.GenerativeModel เพื่อทดสอบ process_prompt ของ Agent โดยไม่ต้องเรียก Gemini API
+"""
+
+class StubFunctionCall:
+    def __init__(self, name: str, args: dict = None):
+        self.name = name
+        self.args = dict(args or {})
+
+    def __repr__(self):
+        return f"StubFunctionCall({self.name!r}, {self.args!r})"
+
+class StubResponse:
+    def __init__(self, text: str = "", function_calls=None, usage_metadata=None):
+        self.text = text
+        self.function_calls = [
+            fc if isinstance(fc, StubFunctionCall) else StubFunctionCall(*fc) for fc in (function_calls or [])
+        ]
+        self.usage_metadata = usage_metadata
+
+    def __iter__(self):
+        # จำลอง response แบบ streaming: ข้อความถูกส่งทีละคำ ตามด้วย function calls ใน chunk สุดท้าย
+        words = self.text.split(" ") if self.text else []
+        for i, word in enumerate(words):
+            yield StubResponse(word if i == len(words) - 1 else word + " ")
+        if self.function_calls:
+            yield StubResponse("", self.function_calls)
+
+class StubChatSession:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream: bool = False, **kwargs):
+        self.model.sent_messages.append(content)
+        self.history.append({"role": "user", "parts": [content] if isinstance(content, str) else list(content)})
+        response = self.model.next_response(content, self.history)
+        self.history.append({"role": "model", "parts": [response.text] + [repr(fc) for fc in response.function_calls]})
+        return response
+
+class StubGenerativeModel:
+    """
+    script เป็นได้ทั้ง list ของ StubResponse (ตอบตามลำดับ วนซ้ำเมื่อหมด)
+    หรือ callable(content, history) ที่คืนค่า StubResponse
+    """
+
+    def __init__(self, script=None, tools=None, system_instruction=None):
+        self.script = script if script is not None else [StubResponse("OK")]
+        self.tools = tools
+        self.system_instruction = system_instruction
+        self.sent_messages = []
+        self._position = 0
+
+    def next_response(self, content, history) -> StubResponse:
+        if callable(self.script):
+            return self.script(content, history)
+        response = self.script[self._position % len(self.script)]
+        self._position += 1
+        return response
+
+    def start_chat(self, history=None, **kwargs):
+        return StubChatSession(self, history)
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.sent_messages)
@@ -0,0 +1,148 @@
+# agents/tool_executor.py
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+import contextvars
+import json
+import re
+
+from tools.query_cache import is_read_only_query
+from agents.tool_output import shape_tool_output
+from tools.tracing import tracer
+import config
+
+# Tools ที่อ่านข้อมูลอย่างเดียว รันพร้อมกันได้โดยไม่ขึ้นต่อกัน
+READ_ONLY_TOOLS = {"get_table_schema", "describe_all_tables", "fetch_result_page", "list_data_marts", "get_slow_queries", "list_pipelines", "get_pipeline_runs",
+                   "get_table_profile", "list_table_profiles"}
+
+_ROW_COUNT = re.compile(r'"row_count": (\d+)')
+
+def is_read_only_tool_call(tool_name: str, tool_args: dict) -> bool:
+    """
+    ตรวจสอบว่า Tool call นี้อ่านข้อมูลอย่างเดียวหรือไม่ (ใช้ตัดสินว่ารันขนานกับ call อื่นได้)
+    """
+    if tool_name in READ_ONLY_TOOLS:
+        return True
+    if tool_name == "execute_sql_query":
+        return is_read_only_query(tool_args.get("query", ""))
+    return False
+
+def get_function_calls(response) -> list:
+    """
+    ดึงรายการ function call จาก response ของ model (รองรับทั้ง Gemini SDK และ stub model)
+    """
+    function_calls = getattr(response, "function_calls", None)
+    if function_calls is not None:
+        return list(function_calls)
+    calls = []
+    for part in getattr(response, "parts", None) or []:
+        function_call = getattr(part, "function_call", None)
+        if function_call is not None and function_call.name:
+            calls.append(function_call)
+    return calls
+
+def get_response_text(response) -> str:
+    """
+    ดึงข้อความจาก response โดยไม่ error เมื่อ response มีแต่ function call
+    """
+    try:
+        return response.text or ""
+    except (ValueError, AttributeError):
+        return "".join(getattr(part, "text", "") or "" for part in getattr(response, "parts", None) or [])
+
+def _row_cap(tool_name: str, tool_args: dict) -> int:
+    # execute_sql_query ที่ model เรียกโดยไม่ระบุ max_rows/page_size ถูกจำกัดจำนวนแถว (ไม่ต่อ JSON ของทั้งตาราง)
+    if tool_name != "execute_sql_query" or tool_args.get("max_rows") or tool_args.get("page_size"):
+        return 0
+    return config.TOOL_SQL_MAX_ROWS
+
+def _run_one(run_tool, tool_name: str, tool_args: dict) -> dict:
+    row_cap = _row_cap(tool_name, tool_args)
+    if row_cap:
+        tool_args = {**tool_args, "max_rows": row_cap}
+    with tracer.span(tool_name, "tool", args_bytes=len(json.dumps(tool_args, default=str))) as span:
+        try:
+            output = run_tool(tool_name, tool_args)
+        except Exception as e:
+            message = f"Error running tool '{tool_name}': {str(e)}"
+            output = {"output": message, "display": message}
+            span.set(failed=True)
+        result = {"name": tool_name, "args": tool_args, **output}
+        # ผลลัพธ์ที่ยาวเกินจะถูกย่อก่อนส่งให้ model ส่วนฉบับเต็มยังอยู่ใน result["output"] สำหรับแสดงผล
+        if tool_name == "fetch_result_page":
+            result["model_output"], result["result_handle"] = str(result["output"]), None
+        else:
+            result["model_output"], result["result_handle"] = shape_tool_output(result["output"])
+        span.set(output_bytes=len(str(result["output"])), model_output_bytes=len(result["model_output"]))
+        row_count = _ROW_COUNT.search(result["model_output"]) if result["result_handle"] else None
+        if row_count:
+            span.set(rows=int(row_count.group(1)))
+            if row_cap and int(row_count.group(1)) >= row_cap:
+                span.set(row_cap_reached=True)
+                result["model_output"] += (
+                    f"\n(แสดงเฉพาะ {row_cap} แถวแรก ผลลัพธ์อาจมีมากกว่านี้ ใช้ page_size/page_token หรือ aggregate ใน SQL แทน)"
+                )
+        return result
+
+def run_tool_calls(function_calls, run_tool, max_workers: int = None) -> list:
+    """
+    รัน Tool calls ทั้งหมดจาก response เดียว และคืนผลลัพธ์ตามลำดับเดิม
+
+    Tool call ที่อ่านอย่างเดียวซึ่งอยู่ติดกันจะรันพร้อมกันบน thread pool ขนาดจำกัด
+    ส่วน call ที่เขียนข้อมูลจะรันทีละตัวตามลำดับ เพื่อไม่ให้ลำดับการทำงานเปลี่ยน
+
+    Args:
+        function_calls: รายการ function call จาก model (มี .name และ .args)
+        run_tool: callable(tool_name, tool_args) ที่คืนค่า dict อย่างน้อยมี key "output"
+        max_workers (int): จำนวน thread สูงสุด
+
+    Returns:
+        list: dict ของแต่ละ call ({"name", "args", "output", ...}) ตามลำดับของ function_calls
+    """
+    max_workers = max_workers or config.AGENT_TOOL_WORKERS
+    calls = [(fc.name, dict(fc.args or {})) for fc in function_calls]
+    results = [None] * len(calls)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = []  # (index, future) ของ call อ่านอย่างเดียวที่กำลังรันพร้อมกัน
+
+        def drain():
+            for index, future in pending:
+                results[index] = future.result()
+            pending.clear()
+
+        for index, (tool_name, tool_args) in enumerate(calls):
+            if is_read_only_tool_call(tool_name, tool_args):
+                # คัดลอก context เพื่อให้ span ของ Tool ใน worker thread เป็นลูกของ span ของ prompt
+                pending.append((index, pool.submit(contextvars.copy_context().run, _run_one, run_tool, tool_name, tool_args)))
+            else:
+                drain()
+                results[index] = _run_one(run_tool, tool_name, tool_args)
+        drain()
+
+    return results
+
+def function_response_message(results) -> list:
+    """
+    รวมผลลัพธ์ของทุก Tool เป็น message เดียวสำหรับส่งกลับไปยัง model
+    """
+    return [
+        genai.protos.Part(
+            function_response=genai.protos.FunctionResponse(
+                name=result["name"], response={"result": result.get("model_output", str(result["output"]))}
+            )
+        )
+        for result in results
+    ]
+
+def close_unanswered_calls(chat_session, function_calls):
+    """
+    ตอบ function call ที่ค้างอยู่เมื่อใช้รอบ Tool ครบ AGENT_MAX_TOOL_ROUNDS แล้ว (ไม่รัน Tool และไม่เรียก model เพิ่ม)
+    Gemini ไม่รับ history ที่มี function call โดยไม่มี function response ตามมา จึงเพิ่ม response และคำตอบปิดท้ายลง history
+    """
+    message = f"Tool budget exhausted ({config.AGENT_MAX_TOOL_ROUNDS} tool rounds per prompt); this call was not run."
+    results = [{"name": fc.name, "output": message, "model_output": message} for fc in function_calls]
+    chat_session.history = list(chat_session.history) + [
+        {"role": "user", "parts": function_response_message(results)},
+        {"role": "model", "parts": [message]},
+    ]
+    return message
@@ -0,0 +1,156 @@
+# agents/tool_output.py
+from collections import OrderedDict
+import pandas as pd
+import threading
+import uuid
+import json
+
+import config
+
+# เก็บผลลัพธ์ฉบับเต็มของ Tool ที่ถูกย่อก่อนส่งให้ model (handle -> output) แบบ LRU
+_result_store = OrderedDict()
+_result_store_lock = threading.Lock()
+
+def store_full_result(output: str) -> str:
+    """
+    เก็บผลลัพธ์ฉบับเต็มไว้ในหน่วยความจำ และคืนค่า handle สำหรับอ้างอิงภายหลัง
+    """
+    handle = f"result-{uuid.uuid4().hex[:12]}"
+    with _result_store_lock:
+        _result_store[handle] = output
+        while len(_result_store) > config.TOOL_RESULT_STORE_MAX_ENTRIES:
+            _result_store.popitem(last=False)
+    return handle
+
+def get_full_result(handle: str):
+    """
+    คืนค่าผลลัพธ์ฉบับเต็มจาก handle หรือ None ถ้าไม่พบ (ถูก evict ไปแล้ว)
+    """
+    with _result_store_lock:
+        output = _result_store.get(handle)
+        if output is not None:
+            _result_store.move_to_end(handle)
+        return output
+
+def _column_stats(df: pd.DataFrame) -> dict:
+    stats = {}
+    for column in df.columns:
+        series = df[column]
+        column_stats = {"nulls": int(series.isna().sum())}
+        numeric = pd.to_numeric(series, errors="coerce")
+        if numeric.notna().sum() == series.notna().sum() and series.notna().any():
+            column_stats.update(
+                min=float(numeric.min()), max=float(numeric.max()), mean=round(float(numeric.mean()), 4)
+            )
+        else:
+            as_text = series.dropna().astype(str)
+            column_stats["distinct"] = int(as_text.nunique())
+            column_stats["top"] = as_text.value_counts().head(3).to_dict()
+        stats[str(column)] = column_stats
+    return stats
+
+def _summarise_records(records: list, sample_rows: int) -> dict:
+    df = pd.DataFrame.from_records(records)
+    head = records[:sample_rows]
+    tail = records[-sample_rows:] if len(records) > sample_rows * 2 else records[sample_rows:]
+    return {
+        "row_count": len(records),
+        "columns": [str(c) for c in df.columns],
+        "column_stats": _column_stats(df),
+        "head": head,
+        "tail": tail,
+    }
+
+def _shrink_steps(summary: dict):
+    # ลดขนาดสรุปทีละขั้น (สถิติของคอลัมน์ -> ตัวอย่างแถว -> รายชื่อคอลัมน์) โดยคงโครงสร้างให้เป็น JSON ที่ถูกต้อง
+    summary.pop("column_stats", None)
+    yield
+    summary["head"], summary["tail"] = summary["head"][:2], summary["tail"][-2:]
+    yield
+    summary["head"], summary["tail"] = summary["head"][:1], []
+    yield
+    summary["head"] = []
+    yield
+    columns = summary["columns"]
+    summary["column_count"] = len(columns)
+    summary["columns"] = columns[:20]
+    yield
+    summary.pop("columns")
+    yield
+
+def _fit_summary(summary: dict, limit: int) -> str:
+    """
+    serialize สรุปให้ยาวไม่เกิน limit โดยตัดส่วนของโครงสร้างออกก่อน serialize (ไม่ตัดข้อความ JSON กลางทาง)
+    """
+    steps = _shrink_steps(summary)
+    shaped = json.dumps(summary, ensure_ascii=False, default=str)
+    while len(shaped) > limit and next(steps, False) is not False:
+        shaped = json.dumps(summary, ensure_ascii=False, default=str)
+    return shaped
+
+def shape_tool_output(output, max_chars: int = None, sample_rows: int = None) -> tuple:
+    """
+    ย่อผลลัพธ์ของ Tool ที่ยาวเกิน max_chars ให้เป็นสรุปขนาดเล็กก่อนส่งให้ model
+
+    ผลลัพธ์แบบตาราง (JSON array ของ records) จะถูกสรุปเป็นจำนวนแถว สถิติของแต่ละคอลัมน์
+    และตัวอย่างแถวต้น/ท้าย ส่วนข้อความอื่นจะถูกตัดเหลือส่วนต้นและท้าย
+    ผลลัพธ์ฉบับเต็มถูกเก็บไว้ในเครื่องและอ้างอิงได้ผ่าน result_handle
+
+    Returns:
+        tuple: (ข้อความที่ส่งให้ model, result_handle หรือ None ถ้าไม่ได้ย่อ)
+    """
+    max_chars = max_chars or config.TOOL_OUTPUT_MAX_CHARS
+    sample_rows = sample_rows or config.TOOL_OUTPUT_SAMPLE_ROWS
+    output = output if isinstance(output, str) else str(output)
+    if len(output) <= max_chars:
+        return output, None
+
+    handle = store_full_result(output)
+    try:
+        parsed = json.loads(output)
+    except ValueError:
+        parsed = None
+
+    records = None
+    summary = {"result_handle": handle, "truncated": True, "full_size_chars": len(output)}
+    if isinstance(parsed, list) and all(isinstance(r, dict) for r in parsed):
+        records = parsed
+    elif isinstance(parsed, dict) and isinstance(parsed.get("rows"), list):
+        records = parsed["rows"]
+        summary["next_page_token"] = parsed.get("next_page_token")
+
+    if records is not None:
+        summary.update(_summarise_records(records, sample_rows))
+        summary["note"] = "ผลลัพธ์ถูกย่อ ใช้ fetch_result_page กับ result_handle เพื่อดูแถวเพิ่มเติม"
+        return _fit_summary(summary, max_chars * 2), handle
+
+    half = max_chars // 2
+    summary["head"] = output[:half]
+    summary["tail"] = output[-half:]
+    return json.dumps(summary, ensure_ascii=False), handle
+
+def fetch_result_page(result_handle: str, offset: int = 0, limit: int = 50):
+    """
+    ดึงแถวของผลลัพธ์ฉบับเต็มที่ถูกย่อไว้ โดยอ้างอิงจาก result_handle
+
+    Args:
+        result_handle (str): handle ที่ได้จากผลลัพธ์ที่ถูกย่อ
+        offset (int): แถวเริ่มต้น (หรือบรรทัดเริ่มต้นสำหรับผลลัพธ์ที่ไม่ใช่ตาราง)
+        limit (int): จำนวนแถวสูงสุดที่ต้องการ
+    """
+    output = get_full_result(result_handle)
+    if output is None:
+        return f"Error: ไม่พบผลลัพธ์สำหรับ handle '{result_handle}' (อาจหมดอายุแล้ว)"
+    offset, limit = max(int(offset), 0), min(max(int(limit), 1), config.TOOL_OUTPUT_PAGE_MAX_ROWS)
+    try:
+        parsed = json.loads(output)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, dict) and isinstance(parsed.get("rows"), list):
+        parsed = parsed["rows"]
+    if isinstance(parsed, list):
+        page = parsed[offset:offset + limit]
+        return json.dumps({"offset": offset, "rows": page, "total_rows": len(parsed)}, ensure_ascii=False, default=str)
+    # ผลลัพธ์ที่ไม่ใช่ตาราง แบ่งหน้าตามบรรทัด
+    lines = output.splitlines()
+    return "\n".join(lines[offset:offset + limit])
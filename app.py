@@ -1,17 +1,14 @@
 # app.py
+import time
+_script_started = time.perf_counter() # ใช้วัดเวลา render ของแต่ละ rerun
+
 import streamlit as st
-import google.generativeai as genai
-import pandas as pd
+import importlib
 import json
+import sys
 
-# Import configuration and agents
+# Import configuration (Agent และ Tools จะถูก import เมื่อใช้งานจริงเท่านั้น เพื่อให้หน้าแรกโหลดเร็ว)
 import config
-from agents.data_pipeline_agent import DataPipelineAgent
-from agents.data_warehouse_agent import DataWarehouseAgent
-from agents.data_mart_agent import DataMartAgent
-
-# Import tools for initial database setup (optional, but convenient here)
-from tools.db_tools import create_table_ddl, execute_sql_query, get_db_engine
 
 # --- Streamlit UI Page Configuration (MUST BE FIRST) ---
 st.set_page_config(layout="wide") # ตั้งค่า Layout ให้กว้าง
@@ -24,16 +21,58 @@ st.title("Agentic AI for Data Management Prototype")
 #st.sidebar.info(f"DEBUG: API Key being used (first 5 chars): `{config.GEMINI_API_KEY[:5]}...`")
 # --- END DEBUGGING SECTION ---
 
-# --- Initialize Agents ---
-# กำหนด API Key ก่อนที่จะ Initialise Models
-genai.configure(api_key=config.GEMINI_API_KEY)
-
-# สร้าง Instance ของ Agent แต่ละตัว (จะสร้างและจัดการ chat_session ภายในแต่ละ Agent)
-# Model ที่ใช้จะถูกกำหนดใน constructor ของแต่ละ Agent
-pipeline_agent = DataPipelineAgent(api_key=config.GEMINI_API_KEY)
-warehouse_agent = DataWarehouseAgent(api_key=config.GEMINI_API_KEY)
-mart_agent = DataMartAgent(api_key=config.GEMINI_API_KEY)
-
+# --- Lazy Agent Initialization ---
+# ชื่อ Agent ใน UI -> (module, class) ซึ่งจะถูก import ตอนที่ผู้ใช้เลือก Agent นั้นครั้งแรกเท่านั้น
+AGENT_CLASSES = {
+    "Data Pipeline Agent": ("agents.data_pipeline_agent", "DataPipelineAgent"),
+    "Data Warehouse Agent": ("agents.data_warehouse_agent", "DataWarehouseAgent"),
+    "Data Mart Agent": ("agents.data_mart_agent", "DataMartAgent"),
+}
+
+def _load_agent_class(agent_name: str):
+    module_name, class_name = AGENT_CLASSES[agent_name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+@st.cache_resource(show_spinner=False)
+def get_agent_model(agent_name: str):
+    """
+    สร้าง Gemini model ของ Agent ครั้งเดียวต่อ process (ใช้ร่วมกันทุก session และทุก rerun)
+    """
+    return _load_agent_class(agent_name).build_model(config.GEMINI_API_KEY)
+
+def get_agent(agent_name: str):
+    """
+    คืนค่า Agent ของ session ปัจจุบัน สร้างใหม่เฉพาะครั้งแรกที่ผู้ใช้เลือก Agent นั้น
+    (แต่ละ session มี chat_session ของตัวเอง แต่ใช้ model ร่วมกัน)
+    """
+    agents = st.session_state.setdefault("agents", {})
+    if agent_name not in agents:
+        started = time.perf_counter()
+        agents[agent_name] = _load_agent_class(agent_name)(api_key=config.GEMINI_API_KEY, model=get_agent_model(agent_name))
+        st.session_state.setdefault("perf", {})[f"build {agent_name} (ms)"] = round((time.perf_counter() - started) * 1000, 1)
+    return agents[agent_name]
+
+def attach_data_preview(message: dict, query_results_json):
+    """
+    แปลงผลลัพธ์ Query เป็น DataFrame ตัวอย่างครั้งเดียวตอนบันทึกข้อความ (ไม่ต้อง parse ซ้ำทุก rerun)
+    ถ้าผลลัพธ์ยาวเกิน CHAT_PREVIEW_MAX_ROWS จะเก็บฉบับเต็มไว้บนดิสก์และอ้างอิงด้วย result_id
+    """
+    try:
+        records = json.loads(query_results_json)
+    except (TypeError, ValueError):
+        records = None
+    if isinstance(records, dict) and isinstance(records.get("rows"), list):
+        records = records["rows"] # ผลลัพธ์แบบแบ่งหน้า
+    if not isinstance(records, list):
+        message["data_preview_error"] = True
+        return
+
+    import pandas as pd
+    message["data_preview"] = pd.DataFrame.from_records(records[:config.CHAT_PREVIEW_MAX_ROWS])
+    message["total_rows"] = len(records)
+    if len(records) > config.CHAT_PREVIEW_MAX_ROWS:
+        from tools.result_spill import result_spill
+        message["result_id"] = result_spill.spill(records)
 
 st.sidebar.header("แผงควบคุม Agent")
 
@@ -44,6 +83,7 @@ if 'db_initialized' not in st.session_state:
 with st.sidebar.expander("ตั้งค่าฐานข้อมูล Prototype"):
     st.markdown("คลิกปุ่มนี้เพื่อสร้างตารางเริ่มต้นสำหรับฐานข้อมูล SQLite ของคุณ")
     if st.button("เริ่มต้นฐานข้อมูล Prototype"):
+        from tools.db_tools import create_table_ddl
         try:
             # สร้างตาราง Staging สำหรับลูกค้า
             customer_schema = {"customer_id": "INTEGER PRIMARY KEY", "name": "TEXT", "email": "TEXT", "registration_date": "TEXT", "is_active": "BOOLEAN"}
@@ -54,11 +94,11 @@ with st.sidebar.expander("ตั้งค่าฐานข้อมูล Proto
             create_table_ddl(config.DATABASE_URL, "stg_sales", json.dumps(sales_schema))
 
             # สร้างตาราง Fact (สำหรับ DW)
-            fact_sales_schema = {"sale_id": "INTEGER PRIMARY KEY AUTOINCREMENT", "order_id": "INTEGER", "customer_id": "INTEGER", "product_id": "TEXT", "sale_date": "TEXT", "amount": "REAL"}
+            fact_sales_schema = {"sale_id": "INTEGER PRIMARY KEY AUTOINCREMENT", "order_id": "INTEGER", "customer_key": "INTEGER", "product_id": "TEXT", "sale_date": "TEXT", "amount": "REAL"}
             create_table_ddl(config.DATABASE_URL, "fact_sales", json.dumps(fact_sales_schema))
 
             # สร้างตาราง Dimension (สำหรับ DW)
-            dim_customer_schema = {"customer_key": "INTEGER PRIMARY KEY AUTOINCREMENT", "customer_id": "INTEGER", "name": "TEXT", "email": "TEXT", "start_date": "TEXT", "end_date": "TEXT", "is_current": "BOOLEAN"}
+            dim_customer_schema = {"customer_key": "INTEGER PRIMARY KEY AUTOINCREMENT", "customer_id": "INTEGER", "name": "TEXT", "email": "TEXT", "start_date": "TEXT", "end_date": "TEXT", "is_current": "BOOLEAN", "row_hash": "TEXT"}
             create_table_ddl(config.DATABASE_URL, "dim_customer", json.dumps(dim_customer_schema))
 
             st.sidebar.success("ฐานข้อมูลเริ่มต้นด้วยตาราง `stg_customers`, `stg_sales`, `fact_sales`, `dim_customer` เรียบร้อยแล้ว!")
@@ -81,18 +121,35 @@ if agent_choice not in st.session_state:
 # --- END NEW ---
 
 # --- NEW: Display chat messages from history ---
-for message in st.session_state[agent_choice]:
+# แสดงเฉพาะข้อความล่าสุด (ข้อความเก่ากว่านั้นแสดงเมื่อผู้ใช้กดปุ่ม) เพื่อให้ rerun ไม่ช้าลงตามความยาวของบทสนทนา
+messages = st.session_state[agent_choice]
+window_key = f"{agent_choice}_history_window"
+history_window = st.session_state.setdefault(window_key, config.CHAT_HISTORY_RENDER_WINDOW)
+hidden_messages = max(len(messages) - history_window, 0)
+if hidden_messages:
+    if st.button(f"แสดงข้อความก่อนหน้า ({hidden_messages} ข้อความ)", key=f"{agent_choice}_show_older"):
+        st.session_state[window_key] = history_window + config.CHAT_HISTORY_RENDER_WINDOW
+        st.rerun()
+
+for message in messages[hidden_messages:]:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
         if "sql_code" in message and message["sql_code"]:
             st.code(message["sql_code"], language="sql")
-        if "data_preview" in message and message["data_preview"] is not None:
-            try:
-                # Assuming data_preview is JSON string of DataFrame
-                df = pd.read_json(message["data_preview"])
-                st.dataframe(df)
-            except ValueError:
-                st.warning("ไม่สามารถแสดงผลลัพธ์ข้อมูลเป็น DataFrame ได้.")
+        if message.get("data_preview") is not None:
+            # data_preview เป็น DataFrame ที่ parse ไว้แล้วตอนบันทึกข้อความ
+            st.dataframe(message["data_preview"])
+            if message.get("result_id"):
+                st.caption(f"แสดง {len(message['data_preview'])} แถวแรกจากทั้งหมด {message['total_rows']} แถว")
+                if st.toggle("แสดงผลลัพธ์ฉบับเต็ม", key=f"full_result_{message['result_id']}"):
+                    from tools.result_spill import result_spill
+                    full_df = result_spill.load(message["result_id"], limit=config.CHAT_FULL_RESULT_MAX_ROWS)
+                    if full_df is None:
+                        st.warning("ผลลัพธ์ฉบับเต็มถูกลบไปแล้ว")
+                    else:
+                        st.dataframe(full_df)
+        elif message.get("data_preview_error"):
+            st.warning("ไม่สามารถแสดงผลลัพธ์ข้อมูลเป็น DataFrame ได้.")
 # --- END NEW ---
 
 # Textarea สำหรับให้ผู้ใช้ป้อนคำสั่ง
@@ -121,25 +178,59 @@ if user_prompt: # ตรวจสอบเมื่อมีการป้อ
             generated_sql = ""
             query_results_json = None
 
+            agent = get_agent(agent_choice)
             if agent_choice == "Data Pipeline Agent":
-                full_response_text, tool_outputs = pipeline_agent.process_prompt(user_prompt, agent_response_container)
+                full_response_text, tool_outputs = agent.process_prompt(user_prompt, agent_response_container)
                 # DPA's process_prompt now handles streaming its own output and tool calls
                 # And returns the final consolidated text.
                 # Data preview from tool_outputs handled inside the agent's process_prompt.
             elif agent_choice == "Data Warehouse Agent":
-                full_response_text, generated_sql = warehouse_agent.process_prompt(user_prompt, agent_response_container)
+                full_response_text, generated_sql = agent.process_prompt(user_prompt, agent_response_container)
             else: # Data Mart Agent
-                full_response_text, generated_sql, query_results_json = mart_agent.process_prompt(user_prompt, agent_response_container)
+                full_response_text, generated_sql, query_results_json = agent.process_prompt(user_prompt, agent_response_container)
 
             # --- NEW: Append agent's final response to chat history ---
             agent_message_content = {"role": "agent", "content": full_response_text}
             if generated_sql:
                 agent_message_content["sql_code"] = generated_sql
             if query_results_json is not None:
-                agent_message_content["data_preview"] = query_results_json
+                attach_data_preview(agent_message_content, query_results_json)
             
             st.session_state[agent_choice].append(agent_message_content)
+            # จำกัดจำนวนข้อความที่เก็บใน session เพื่อไม่ให้หน่วยความจำโตไม่สิ้นสุด
+            del st.session_state[agent_choice][:-config.CHAT_HISTORY_MAX_MESSAGES]
             # --- END NEW ---
 
 # Placeholder for previous prompts (optional, can be removed)
 # if execute_button and user_prompt: ...
+
+# --- Performance: เวลา render ของ rerun นี้ (รวมการสร้าง Agent ถ้ามี) ---
+perf = st.session_state.setdefault("perf", {})
+render_ms = round((time.perf_counter() - _script_started) * 1000, 1)
+perf.setdefault("first render (ms)", render_ms)
+perf["last rerun (ms)"] = render_ms
+with st.sidebar.expander("Performance"):
+    st.json(perf)
+
+# --- Fast path ของ Data Pipeline Agent: สัดส่วน prompt ที่รันได้ทันทีโดยไม่เรียก model ---
+with st.sidebar.expander("Fast path (intent router)"):
+    # ไม่ import router เอง (ดึง db_tools/pandas/SQLAlchemy มาด้วย) ใช้เฉพาะเมื่อ Agent import ไว้แล้ว
+    router_module = sys.modules.get("agents.intent_router")
+    router_stats = router_module.intent_router.stats() if router_module else {"prompts": 0}
+    if router_stats["prompts"]:
+        st.metric("Hit rate", f"{router_stats['hit_rate']:.0%}", help=f"{router_stats['hits']} จาก {router_stats['prompts']} prompt")
+        st.json(router_stats["by_intent"])
+    else:
+        st.caption("ยังไม่มี prompt" if config.INTENT_ROUTER_ENABLED else "Fast path ถูกปิด (INTENT_ROUTER_ENABLED=0)")
+
+# --- Latency ต่อ Agent จาก tracing (process_prompt, LLM, Tool, SQL, render) ---
+with st.sidebar.expander("Latency (tracing)"):
+    from tools.tracing import tracer
+    latency = tracer.latency_summary()
+    if latency:
+        import pandas as pd
+        st.dataframe(pd.DataFrame(latency), hide_index=True)
+        if config.TRACE_EXPORT_PATH:
+            st.caption(f"Span ทั้งหมดถูกบันทึกที่ `{config.TRACE_EXPORT_PATH}`")
+    else:
+        st.caption("ยังไม่มีข้อมูล tracing" if config.TRACING_ENABLED else "Tracing ถูกปิด (TRACING_ENABLED=0)")
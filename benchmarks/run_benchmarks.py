@@ -0,0 +1,432 @@
+# benchmarks/run_benchmarks.py
+"""
+Benchmark ของทุก Tool ใน tools/ และ process_prompt ของทั้งสาม Agent (ใช้ StubGenerativeModel แทน Gemini)
+บนข้อมูลจำลองขนาดที่กำหนด แล้วเขียนผลเป็น JSON สำหรับเทียบกับผลครั้งก่อน
+
+ตัวอย่าง:
+    python -m benchmarks.run_benchmarks --scale 100k --output bench.json
+    python -m benchmarks.run_benchmarks --scale 1m --baseline bench.json --threshold 1.25
+"""
+from datetime import datetime, timezone
+from contextlib import contextmanager
+import subprocess
+import statistics
+import argparse
+import platform
+import sqlite3
+import tempfile
+import time
+import json
+import sys
+import os
+
+from benchmarks.synthetic_data import build_warehouse, generate_customers, generate_sales, parse_scale
+import config
+
+def _percentile(timings: list, q: float) -> float:
+    if len(timings) == 1:
+        return timings[0]
+    return statistics.quantiles(timings, n=100, method="inclusive")[int(q) - 1]
+
+def measure(name: str, group: str, func, repeats: int = None, setup=None, rows: int = None) -> dict:
+    """
+    รัน func ซ้ำ repeats ครั้ง (เรียก setup ก่อนทุกครั้งโดยไม่นับเวลา) และคืนค่าสถิติเวลาเป็นมิลลิวินาที
+    ผลลัพธ์ที่เป็นข้อความขึ้นต้นด้วย "Error" (รูปแบบ error ของ Tool) ถูกบันทึกเป็น error
+    """
+    repeats = repeats or config.BENCHMARK_REPEATS
+    timings, error, result = [], None, None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        try:
+            result = func()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            break
+        timings.append((time.perf_counter() - started) * 1000)
+        if isinstance(result, str) and result.startswith("Error"):
+            error = result[:500]
+            break
+
+    report = {"name": name, "group": group, "repeats": len(timings)}
+    if timings:
+        report.update(
+            median_ms=round(statistics.median(timings), 3),
+            p95_ms=round(_percentile(timings, 95), 3),
+            min_ms=round(min(timings), 3),
+            max_ms=round(max(timings), 3),
+        )
+        if rows:
+            report["rows"] = rows
+            report["rows_per_second"] = round(rows / (report["median_ms"] / 1000), 1) if report["median_ms"] else None
+    if error:
+        report["error"] = error
+    print(f"  {group:<13} {name:<48} " + (f"{report['median_ms']:>10.3f} ms" if timings else "     ERROR") + (f"  ({error[:80]})" if error else ""), file=sys.stderr)
+    return report
+
+class _MarkdownSink:
+    """
+    container จำลองที่มีแค่ markdown (ResponseRenderer จะ render แบบไม่แบ่ง segment) ใช้แทน Streamlit ตอน benchmark
+    """
+
+    def __init__(self):
+        self.updates = 0
+
+    def markdown(self, text: str):
+        self.updates += 1
+
+def bench_db_tools(database_url: str, sales: int) -> list:
+    from tools.db_tools import (
+        execute_sql_query, fetch_query_page, iter_query_batches, iter_query_ndjson, get_table_schema,
+        describe_all_tables, table_exists, create_table_ddl, insert_data_into_table, bulk_load, get_engine_stats,
+        _encode_page_token,
+    )
+    from tools.query_cache import query_cache
+
+    aggregate = "SELECT product_id, COUNT(*) AS orders, SUM(amount) AS revenue FROM stg_sales GROUP BY product_id"
+    point = "SELECT * FROM stg_sales WHERE order_id = 12345"
+    paged = "SELECT * FROM stg_sales ORDER BY order_id"
+    page_50_token = _encode_page_token(paged, 49 * 100)
+    scan_limit = 10_000
+    batch_rows = min(sales, 100_000)
+    small_records = json.dumps([{"id": i, "label": f"row {i}", "value": i * 1.5} for i in range(1000)])
+
+    scratch_schema = json.dumps({"id": "INTEGER PRIMARY KEY", "label": "TEXT", "value": "REAL"})
+
+    def drop_scratch():
+        execute_sql_query(database_url, "DROP TABLE IF EXISTS bench_scratch")
+
+    def recreate_scratch():
+        drop_scratch()
+        create_table_ddl(database_url, "bench_scratch", scratch_schema)
+
+    return [
+        measure("execute_sql_query (aggregate, cold)", "db_tools", lambda: execute_sql_query(database_url, aggregate), setup=query_cache.clear, rows=sales),
+        measure("execute_sql_query (aggregate, cached)", "db_tools", lambda: execute_sql_query(database_url, aggregate)),
+        measure("execute_sql_query (point lookup)", "db_tools", lambda: execute_sql_query(database_url, point), setup=query_cache.clear),
+        measure(f"execute_sql_query (max_rows={scan_limit})", "db_tools",
+                lambda: execute_sql_query(database_url, "SELECT * FROM stg_sales", max_rows=scan_limit), setup=query_cache.clear, rows=scan_limit),
+        measure("execute_sql_query (page_size=100)", "db_tools",
+                lambda: execute_sql_query(database_url, paged, page_size=100), setup=query_cache.clear),
+        measure("fetch_query_page (page 50 x 100 rows)", "db_tools",
+                lambda: fetch_query_page(database_url, paged, 100, page_50_token)),
+        measure(f"iter_query_batches ({batch_rows} rows)", "db_tools",
+                lambda: sum(len(b) for b in iter_query_batches(database_url, "SELECT * FROM stg_sales", max_rows=batch_rows)), rows=batch_rows),
+        measure(f"iter_query_ndjson ({batch_rows} rows)", "db_tools",
+                lambda: sum(len(c) for c in iter_query_ndjson(database_url, "SELECT * FROM stg_sales", max_rows=batch_rows)), rows=batch_rows),
+        measure("get_table_schema", "db_tools", lambda: get_table_schema(database_url, "stg_sales")),
+        measure("describe_all_tables", "db_tools", lambda: describe_all_tables(database_url)),
+        measure("table_exists", "db_tools", lambda: table_exists(database_url, "stg_sales")),
+        measure("create_table_ddl (with index)", "db_tools",
+                lambda: create_table_ddl(database_url, "bench_scratch", scratch_schema, json.dumps([["label"]])), setup=drop_scratch),
+        measure("insert_data_into_table (1000 rows JSON)", "db_tools",
+                lambda: insert_data_into_table(database_url, "bench_scratch", small_records), setup=recreate_scratch, rows=1000),
+        measure("insert_data_into_table (1000 rows upsert)", "db_tools",
+                lambda: insert_data_into_table(database_url, "bench_scratch", small_records, upsert=True), rows=1000),
+        measure(f"bulk_load ({sales} rows)", "db_tools",
+                lambda: bulk_load(database_url, "bench_sales_copy", generate_sales(sales, max(sales // 10, 1))),
+                setup=lambda: execute_sql_query(database_url, "DROP TABLE IF EXISTS bench_sales_copy"), repeats=1, rows=sales),
+        measure("get_engine_stats", "db_tools", lambda: get_engine_stats(database_url)),
+    ]
+
+def bench_file_tools(database_url: str, customers: int, work_dir: str) -> list:
+    from tools.file_tools import (
+        create_dataframe_from_csv_content, save_dataframe_to_csv, load_csv_into_table, export_to_parquet, load_parquet_into_table, pa,
+    )
+    from tools.db_tools import execute_sql_query
+
+    csv_path = os.path.join(work_dir, "customers.csv")
+    sample = next(generate_customers(min(customers, 10_000)))
+    sample_csv = sample.to_csv(index=False)
+    sample_json = sample.to_json(orient="records")
+    for number, frame in enumerate(generate_customers(customers)):
+        frame.to_csv(csv_path, mode="w" if number == 0 else "a", header=number == 0, index=False)
+    drop_copy = lambda: execute_sql_query(database_url, "DROP TABLE IF EXISTS bench_customers_copy")
+
+    results = [
+        measure(f"create_dataframe_from_csv_content ({len(sample)} rows)", "file_tools",
+                lambda: create_dataframe_from_csv_content(sample_csv), rows=len(sample)),
+        measure(f"save_dataframe_to_csv ({len(sample)} rows)", "file_tools",
+                lambda: save_dataframe_to_csv(sample_json, os.path.join(work_dir, "sample.csv")), rows=len(sample)),
+        measure(f"load_csv_into_table ({customers} rows)", "file_tools",
+                lambda: load_csv_into_table(database_url, "bench_customers_copy", csv_path), setup=drop_copy, repeats=1, rows=customers),
+    ]
+    if pa is None:
+        results.append({"name": "export_to_parquet / load_parquet_into_table", "group": "file_tools", "skipped": "pyarrow is not installed"})
+        return results
+    parquet_path = os.path.join(work_dir, "stg_sales.parquet")
+    results += [
+        measure("export_to_parquet (stg_sales)", "file_tools", lambda: export_to_parquet(database_url, parquet_path, table_name="stg_sales"), repeats=1),
+        measure("load_parquet_into_table (filtered, 2 columns)", "file_tools",
+                lambda: load_parquet_into_table(database_url, "bench_sales_parquet", parquet_path, json.dumps(["order_id", "amount"]),
+                                                json.dumps([["order_id", "<=", 100_000]])),
+                setup=lambda: execute_sql_query(database_url, "DROP TABLE IF EXISTS bench_sales_parquet"), repeats=1),
+    ]
+    return results
+
+def bench_warehouse_tools(database_url: str, customers: int, sales: int) -> list:
+    from tools.warehouse_tools import apply_scd2_dimension, load_fact_sales
+    from tools.db_tools import bulk_load, execute_sql_query
+
+    changed = max(customers // 100, 1)
+    late_sales = max(sales // 100, 1)
+    return [
+        measure(f"apply_scd2_dimension (initial, {customers} rows)", "warehouse", lambda: apply_scd2_dimension(database_url), repeats=1, rows=customers),
+        measure("apply_scd2_dimension (no changes)", "warehouse", lambda: apply_scd2_dimension(database_url), rows=customers),
+        measure(f"apply_scd2_dimension ({changed} changed rows)", "warehouse", lambda: apply_scd2_dimension(database_url),
+                setup=lambda: execute_sql_query(database_url, f"UPDATE stg_customers SET email = 'moved' || abs(random()) || '@example.com' WHERE customer_id <= {changed}"),
+                repeats=1, rows=changed),
+        measure(f"load_fact_sales (initial, {sales} rows)", "warehouse", lambda: load_fact_sales(database_url), repeats=1, rows=sales),
+        measure("load_fact_sales (no new rows)", "warehouse", lambda: load_fact_sales(database_url)),
+        measure(f"load_fact_sales ({late_sales} new rows)", "warehouse", lambda: load_fact_sales(database_url),
+                setup=lambda: bulk_load(database_url, "stg_sales", generate_sales(late_sales, customers, seed=7, start_id=sales + 1)),
+                repeats=1, rows=late_sales),
+    ]
+
+def bench_mart_tools(database_url: str, sales: int) -> list:
+    from tools.mart_tools import create_data_mart, refresh_data_mart, list_data_marts
+    from tools.db_tools import execute_sql_query
+    from tools.query_cache import query_cache
+
+    routed = "SELECT sale_date, SUM(amount) AS revenue FROM fact_sales GROUP BY sale_date"
+    return [
+        measure("create_data_mart (mart_bench_daily)", "mart_tools",
+                lambda: create_data_mart(database_url, "mart_bench_daily", json.dumps(["sale_date", "product_id"]), json.dumps(["sum(amount)", "count(*)"])),
+                repeats=1, rows=sales),
+        measure("refresh_data_mart (incremental, no changes)", "mart_tools", lambda: refresh_data_mart(database_url, "mart_bench_daily")),
+        measure("refresh_data_mart (full)", "mart_tools", lambda: refresh_data_mart(database_url, "mart_bench_daily", full_refresh=True), repeats=1),
+        measure("list_data_marts", "mart_tools", lambda: list_data_marts(database_url)),
+        measure("execute_sql_query (routed to mart)", "mart_tools", lambda: execute_sql_query(database_url, routed), setup=query_cache.clear),
+    ]
+
+def bench_support_tools(database_url: str) -> list:
+    from tools.index_advisor import recommend_indexes, get_slow_queries
+    from tools.analytics_engine import analytics_engine
+    from tools.db_tools import db_connection, _tables_in_query
+    from tools.query_log import query_log
+    from tools.schema_catalog import schema_catalog
+    from tools.result_spill import result_spill
+    from agents.tool_output import shape_tool_output
+
+    connect = lambda: db_connection(database_url)
+    records = [{"order_id": i, "product_id": f"P{i % 500:04d}", "amount": i * 0.5} for i in range(20_000)]
+    spilled = {}
+    query = "SELECT customer_id, SUM(amount) FROM stg_sales WHERE product_id = 'P0001' GROUP BY customer_id"
+
+    results = [
+        measure("recommend_indexes (explicit query)", "index_advisor", lambda: recommend_indexes(database_url, query)),
+        measure("get_slow_queries", "index_advisor", lambda: get_slow_queries(database_url)),
+        measure("query_log.slowest", "query_log", lambda: query_log.slowest(database_url)),
+        measure("schema_catalog.describe_all (cold)", "schema", lambda: schema_catalog.describe_all(database_url, connect),
+                setup=lambda: schema_catalog.invalidate(database_url)),
+        measure("schema_catalog.describe_all (cached)", "schema", lambda: schema_catalog.describe_all(database_url, connect)),
+        measure("result_spill.spill (20000 rows)", "spill", lambda: spilled.update(id=result_spill.spill(records)), rows=len(records)),
+        measure("result_spill.load (first 100 rows)", "spill", lambda: result_spill.load(spilled["id"], 0, 100)),
+        measure("shape_tool_output (20000 rows JSON)", "agents", lambda: shape_tool_output(json.dumps(records))),
+    ]
+    if analytics_engine.available():
+        tables = _tables_in_query(database_url, query)
+        results.append(measure("analytics_engine.execute (duckdb)", "analytics",
+                               lambda: analytics_engine.execute(database_url, connect, query, tables)))
+    else:
+        results.append({"name": "analytics_engine.execute (duckdb)", "group": "analytics", "skipped": "duckdb is not installed"})
+    return results
+
+def _agent_scenarios(work_dir: str) -> dict:
+    """
+    Script ของ stub model ต่อ Agent: รอบแรกเรียก Tool รอบที่สองตอบสรุปเป็นข้อความยาว (จำลอง streaming)
+    """
+    from agents.stub_model import StubResponse
+
+    summary = StubResponse(" ".join(["ยอดขายรวมตามสินค้าและวันที่"] * 200))
+    csv_path = os.path.join(work_dir, "customers.csv")
+    return {
+        "DataMartAgent": [
+            StubResponse("", [("execute_sql_query", {"query": "SELECT product_id, SUM(amount) AS revenue FROM fact_sales GROUP BY product_id ORDER BY revenue DESC"}),
+                              ("list_data_marts", {})]),
+            summary,
+        ],
+        "DataWarehouseAgent": [
+            StubResponse("", [("describe_all_tables", {}), ("get_slow_queries", {"limit": 5})]),
+            StubResponse("", [("load_fact_sales", {})]),
+            summary,
+        ],
+        "DataPipelineAgent": [
+            StubResponse("", [("load_csv_into_table", {"table_name": "bench_pipeline_customers", "file_path": csv_path, "upsert": True})]),
+            StubResponse("", [("execute_sql_query", {"query": "SELECT COUNT(*) AS customers FROM bench_pipeline_customers"})]),
+            summary,
+        ],
+    }
+
+def bench_agents(database_url: str, work_dir: str, prompts: int) -> list:
+    from agents.data_mart_agent import DataMartAgent
+    from agents.data_warehouse_agent import DataWarehouseAgent
+    from agents.data_pipeline_agent import DataPipelineAgent
+    from agents.stub_model import StubGenerativeModel
+
+    # Agent อ่าน config.DATABASE_URL ทุกครั้งที่รัน Tool จึงชี้ไปที่ฐานข้อมูล benchmark ระหว่างรัน
+    original_url = config.DATABASE_URL
+    config.DATABASE_URL = database_url
+    results = []
+    try:
+        for agent_class in (DataMartAgent, DataWarehouseAgent, DataPipelineAgent):
+            script = _agent_scenarios(work_dir)[agent_class.__name__]
+            model = StubGenerativeModel(script)
+            agent = agent_class(api_key="", model=model)
+            sink = _MarkdownSink()
+
+            def run_prompt():
+                output = agent.process_prompt("benchmark prompt", sink)
+                text = output[0] if isinstance(output, tuple) else output
+                if text.startswith("เกิดข้อผิดพลาด"):
+                    raise RuntimeError(text)
+
+            report = measure(f"{agent_class.__name__}.process_prompt", "agents", run_prompt, repeats=prompts)
+            report["round_trips_per_prompt"] = model.round_trips / max(report["repeats"], 1)
+            report["render_updates_per_prompt"] = sink.updates / max(report["repeats"], 1)
+            results.append(report)
+    finally:
+        config.DATABASE_URL = original_url
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+def compare_with_baseline(results: list, baseline_path: str, threshold: float) -> list:
+    """
+    เทียบ median_ms กับผลครั้งก่อน คืนค่ารายการ benchmark ที่ช้าลงเกิน threshold เท่า
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["group"], r["name"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["group"], result["name"]))
+        if not previous or "median_ms" not in result or not previous.get("median_ms"):
+            continue
+        result["baseline_median_ms"] = previous["median_ms"]
+        result["ratio"] = round(result["median_ms"] / previous["median_ms"], 3)
+        if result["ratio"] > threshold:
+            regressions.append(result)
+    return regressions
+
+@contextmanager
+def _outputs_in(work_dir: str):
+    """
+    ชี้ฐานข้อมูลผลลัพธ์ที่ spill และไฟล์ trace ไปไว้ใน work_dir ระหว่าง benchmark (ไม่เขียนลงโฟลเดอร์ data ของแอป)
+    """
+    from tools.result_spill import result_spill
+    from tools.tracing import tracer
+
+    saved = (config.RESULT_SPILL_DATABASE_URL, result_spill.database_url, result_spill._initialized, tracer.export_path)
+    tracer.flush()
+    config.RESULT_SPILL_DATABASE_URL = result_spill.database_url = "sqlite:///" + os.path.join(work_dir, "result_spill.db")
+    result_spill._initialized = False
+    tracer.export_path = os.path.join(work_dir, "traces.jsonl")
+    try:
+        yield
+    finally:
+        tracer.flush()
+        config.RESULT_SPILL_DATABASE_URL, result_spill.database_url, result_spill._initialized, tracer.export_path = saved
+
+def run(scale: int, customers: int = None, database_url: str = None, repeats: int = None, prompts: int = None, seed: int = 42) -> dict:
+    """
+    สร้างข้อมูลจำลองและรัน benchmark ทั้งหมด
+
+    Args:
+        scale (int): จำนวนแถวของ stg_sales
+        customers (int): จำนวนลูกค้า (ค่าเริ่มต้นคือ scale / 10)
+        database_url (str): ฐานข้อมูลสำหรับ benchmark (ตารางเดิมทั้งหมดจะถูกลบ)
+        repeats (int): จำนวนครั้งที่รันซ้ำต่อ benchmark
+        prompts (int): จำนวน prompt ต่อ Agent
+
+    Returns:
+        dict: {"meta": ข้อมูลสภาพแวดล้อม, "results": ผลของแต่ละ benchmark}
+    """
+    from tools.file_tools import pa
+    from tools.analytics_engine import analytics_engine
+
+    database_url = database_url or config.BENCHMARK_DATABASE_URL
+    customers = customers or max(scale // 10, 100)
+    if repeats:
+        config.BENCHMARK_REPEATS = repeats
+    prompts = prompts or config.BENCHMARK_REPEATS
+
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="agentic_bench_") as work_dir, _outputs_in(work_dir):
+        print(f"Generating {customers} customers and {scale} sales into {database_url}", file=sys.stderr)
+        load_stats = build_warehouse(database_url, customers, scale, seed)
+        results = [
+            {"name": f"generate + bulk_load {table}", "group": "setup", "rows": stats["rows"],
+             "median_ms": round(stats["seconds"] * 1000, 3), "rows_per_second": stats["rows_per_second"], "repeats": 1}
+            for table, stats in load_stats.items()
+        ]
+        results += bench_db_tools(database_url, scale)
+        results += bench_file_tools(database_url, customers, work_dir)
+        results += bench_warehouse_tools(database_url, customers, scale)
+        results += bench_mart_tools(database_url, scale)
+        results += bench_support_tools(database_url)
+        results += bench_agents(database_url, work_dir, prompts)
+
+    meta = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "scale": scale,
+        "customers": customers,
+        "seed": seed,
+        "repeats": config.BENCHMARK_REPEATS,
+        "database_url": database_url,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sqlite": sqlite3.sqlite_version,
+        "cpu_count": os.cpu_count(),
+        "pyarrow": pa is not None,
+        "duckdb": analytics_engine.available(),
+        "analytics_engine": config.ANALYTICS_ENGINE,
+        "mart_routing": config.MART_ROUTING_ENABLED,
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+    return {"meta": meta, "results": results}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark tools/ และ Agent ทั้งหมดบนข้อมูลจำลอง")
+    parser.add_argument("--scale", default="10k", help="จำนวนแถวของ stg_sales เช่น 10k, 1m, 10m (ค่าเริ่มต้น 10k)")
+    parser.add_argument("--customers", default=None, help="จำนวนลูกค้า (ค่าเริ่มต้นคือ scale / 10)")
+    parser.add_argument("--database-url", default=None, help="ฐานข้อมูลสำหรับ benchmark (ค่าเริ่มต้น config.BENCHMARK_DATABASE_URL)")
+    parser.add_argument("--repeats", type=int, default=None, help="จำนวนครั้งที่รันซ้ำต่อ benchmark")
+    parser.add_argument("--prompts", type=int, default=None, help="จำนวน prompt ต่อ Agent")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="ไฟล์ JSON สำหรับผลลัพธ์ (ค่าเริ่มต้นพิมพ์ออก stdout)")
+    parser.add_argument("--baseline", default=None, help="ไฟล์ JSON ผลครั้งก่อน สำหรับตรวจหา regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="อัตราส่วน median ที่ถือว่าช้าลง (ค่าเริ่มต้น 1.25)")
+    args = parser.parse_args(argv)
+
+    report = run(
+        parse_scale(args.scale),
+        customers=parse_scale(args.customers) if args.customers else None,
+        database_url=args.database_url,
+        repeats=args.repeats,
+        prompts=args.prompts,
+        seed=args.seed,
+    )
+    regressions = compare_with_baseline(report["results"], args.baseline, args.threshold) if args.baseline else []
+    report["meta"]["regressions"] = [r["name"] for r in regressions]
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload)
+        print(f"Wrote {len(report['results'])} results to {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+    for regression in regressions:
+        print(f"REGRESSION {regression['group']}/{regression['name']}: {regression['baseline_median_ms']} ms -> "
+              f"{regression['median_ms']} ms (x{regression['ratio']})", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# benchmarks/synthetic_data.py
+"""
+สร้างข้อมูลลูกค้าและยอดขายจำลองแบบ deterministic (seed เดียวกันได้ข้อมูลเดียวกัน) ในขนาดที่กำหนด
+ใช้ schema เดียวกับตารางที่ปุ่ม "เริ่มต้นฐานข้อมูล Prototype" ใน app.py สร้าง
+"""
+from sqlalchemy import text
+import numpy as np
+import pandas as pd
+import json
+import re
+
+from tools.db_tools import bulk_load, create_table_ddl, db_connection
+from tools.mart_catalog import mart_catalog
+from tools.query_cache import query_cache
+from tools.schema_catalog import schema_catalog
+import config
+
+# Schema เดียวกับ app.py
+WAREHOUSE_SCHEMAS = {
+    "stg_customers": {"customer_id": "INTEGER PRIMARY KEY", "name": "TEXT", "email": "TEXT", "registration_date": "TEXT", "is_active": "BOOLEAN"},
+    "stg_sales": {"order_id": "INTEGER PRIMARY KEY", "customer_id": "INTEGER", "product_id": "TEXT", "order_date": "TEXT", "amount": "REAL"},
+    "fact_sales": {"sale_id": "INTEGER PRIMARY KEY AUTOINCREMENT", "order_id": "INTEGER", "customer_key": "INTEGER", "product_id": "TEXT", "sale_date": "TEXT", "amount": "REAL"},
+    "dim_customer": {"customer_key": "INTEGER PRIMARY KEY AUTOINCREMENT", "customer_id": "INTEGER", "name": "TEXT", "email": "TEXT", "start_date": "TEXT", "end_date": "TEXT", "is_current": "BOOLEAN", "row_hash": "TEXT"},
+}
+
+_FIRST_NAMES = np.array(["Alice", "Bob", "Charlie", "Diana", "Ethan", "Fah", "Krit", "Mali", "Niran", "Ploy", "Somchai", "Wan"])
+_LAST_NAMES = np.array(["Smith", "Johnson", "Brown", "Lee", "Wong", "Srisuk", "Chaiyo", "Boonma", "Tanaka", "Garcia"])
+_SCALE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+def parse_scale(value) -> int:
+    """
+    แปลงขนาดเช่น "10k", "1m", "250000" เป็นจำนวนแถว
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([km]?)\s*", str(value).lower())
+    if not match:
+        raise ValueError(f"ขนาดไม่ถูกต้อง: {value!r} (ตัวอย่าง: 10k, 1m, 10m)")
+    return int(float(match.group(1)) * _SCALE_SUFFIXES.get(match.group(2), 1))
+
+def _random_dates(rng, size: int, start: str, days: int) -> np.ndarray:
+    return (np.datetime64(start) + rng.integers(0, days, size=size)).astype(str)
+
+def generate_customers(count: int, seed: int = 42, start_id: int = 1, chunk_size: int = None):
+    """
+    สร้างข้อมูลลูกค้าจำลองสำหรับ stg_customers เป็น DataFrame ทีละ chunk (ไม่สร้างทั้งหมดในหน่วยความจำ)
+    """
+    chunk_size = chunk_size or config.BULK_LOAD_BATCH_SIZE
+    rng = np.random.default_rng(seed)
+    for offset in range(0, count, chunk_size):
+        size = min(chunk_size, count - offset)
+        ids = np.arange(start_id + offset, start_id + offset + size)
+        first = _FIRST_NAMES[rng.integers(0, len(_FIRST_NAMES), size=size)]
+        last = _LAST_NAMES[rng.integers(0, len(_LAST_NAMES), size=size)]
+        id_text = ids.astype(str)
+        yield pd.DataFrame({
+            "customer_id": ids,
+            "name": np.char.add(np.char.add(first, " "), last),
+            "email": np.char.add(np.char.add(np.char.lower(first), id_text), "@example.com"),
+            "registration_date": _random_dates(rng, size, "2020-01-01", 5 * 365),
+            "is_active": rng.random(size) < 0.9,
+        })
+
+def generate_sales(count: int, customer_count: int, seed: int = 42, start_id: int = 1, products: int = 500, chunk_size: int = None):
+    """
+    สร้างข้อมูลยอดขายจำลองสำหรับ stg_sales เป็น DataFrame ทีละ chunk
+    customer_id อยู่ในช่วง 1..customer_count และยอดขายมีการกระจายแบบ log-normal
+    """
+    chunk_size = chunk_size or config.BULK_LOAD_BATCH_SIZE
+    rng = np.random.default_rng(seed + 1)
+    product_ids = np.char.add("P", np.char.zfill(np.arange(1, products + 1).astype(str), 4))
+    for offset in range(0, count, chunk_size):
+        size = min(chunk_size, count - offset)
+        yield pd.DataFrame({
+            "order_id": np.arange(start_id + offset, start_id + offset + size),
+            "customer_id": rng.integers(1, customer_count + 1, size=size),
+            "product_id": product_ids[rng.integers(0, products, size=size)],
+            "order_date": _random_dates(rng, size, "2023-01-01", 2 * 365),
+            "amount": np.round(rng.lognormal(mean=4.0, sigma=1.0, size=size), 2),
+        })
+
+def reset_database(database_url: str):
+    """
+    ลบทุกตารางในฐานข้อมูล benchmark และล้าง cache ของ process ที่อ้างถึงฐานข้อมูลนี้
+    ไม่อนุญาตให้ใช้กับ DATABASE_URL หลักของแอป
+    """
+    if database_url == config.DATABASE_URL:
+        raise ValueError("ไม่อนุญาตให้ล้างฐานข้อมูลหลักของแอป โปรดใช้ฐานข้อมูลแยกสำหรับ benchmark")
+    with db_connection(database_url) as connection:
+        tables = [row[0] for row in connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ))]
+        for table_name in tables:
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+        connection.commit()
+    query_cache.invalidate_tables(database_url)
+    schema_catalog.invalidate(database_url)
+    mart_catalog.invalidate(database_url)
+
+def build_warehouse(database_url: str, customers: int, sales: int, seed: int = 42) -> dict:
+    """
+    สร้างตาราง staging/warehouse ตาม schema ของแอป และโหลดข้อมูลจำลองเข้า stg_customers และ stg_sales
+
+    Returns:
+        dict: สถิติการโหลดของแต่ละตาราง (จาก bulk_load)
+    """
+    reset_database(database_url)
+    for table_name, schema in WAREHOUSE_SCHEMAS.items():
+        result = create_table_ddl(database_url, table_name, json.dumps(schema))
+        if result.startswith("Error"):
+            raise RuntimeError(result)
+    return {
+        "stg_customers": bulk_load(database_url, "stg_customers", generate_customers(customers, seed)),
+        "stg_sales": bulk_load(database_url, "stg_sales", generate_sales(sales, customers, seed)),
+    }
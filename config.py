@@ -11,6 +11,130 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY_HERE")
 # You can change this to PostgreSQL, MySQL, etc., if needed
 DATABASE_URL = "sqlite:///data/prototype.db"
 
+# Connection pool settings for the shared engines in tools/db_tools.py
+# (ใช้ engine เดียวต่อ DATABASE_URL ตลอดอายุของ process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+# SQLite tuning applied on every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # ค่าติดลบ = หน่วย KiB (64 MiB)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Number of rows fetched per round-trip when streaming query results
+QUERY_STREAM_CHUNK_SIZE = int(os.getenv("QUERY_STREAM_CHUNK_SIZE", "5000"))
+
+# Rows per executemany batch for bulk loads (insert_data_into_table / bulk_load)
+BULK_LOAD_BATCH_SIZE = int(os.getenv("BULK_LOAD_BATCH_SIZE", "50000"))
+
+# Result cache for read-only queries in execute_sql_query (tools/query_cache.py)
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "256"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "300"))  # 0 = ไม่หมดอายุตามเวลา
+
+# Rows per chunk when streaming CSV files into staging tables (tools/file_tools.py)
+CSV_INGEST_CHUNK_SIZE = int(os.getenv("CSV_INGEST_CHUNK_SIZE", "100000"))
+
+# Parquet/Arrow export (tools/file_tools.py): rows per row group / record batch and Parquet codec
+ARROW_EXPORT_CHUNK_SIZE = int(os.getenv("ARROW_EXPORT_CHUNK_SIZE", "100000"))
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+# Agent tool-calling loop: worker threads for read-only tool calls and max tool rounds per prompt
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "4"))
+AGENT_MAX_TOOL_ROUNDS = int(os.getenv("AGENT_MAX_TOOL_ROUNDS", "5"))
+
+# Tool outputs larger than this are summarised before being sent to the model (agents/tool_output.py)
+TOOL_OUTPUT_MAX_CHARS = int(os.getenv("TOOL_OUTPUT_MAX_CHARS", "4000"))
+TOOL_OUTPUT_SAMPLE_ROWS = int(os.getenv("TOOL_OUTPUT_SAMPLE_ROWS", "5"))
+TOOL_OUTPUT_PAGE_MAX_ROWS = int(os.getenv("TOOL_OUTPUT_PAGE_MAX_ROWS", "200"))
+TOOL_RESULT_STORE_MAX_ENTRIES = int(os.getenv("TOOL_RESULT_STORE_MAX_ENTRIES", "64"))
+TOOL_SQL_MAX_ROWS = int(os.getenv("TOOL_SQL_MAX_ROWS", "10000"))  # max_rows ของ execute_sql_query ที่ model เรียกโดยไม่ระบุ (0 = ไม่จำกัด)
+
+# Conversation history budget per agent chat session (agents/history.py)
+AGENT_HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "8000"))
+AGENT_HISTORY_TOOL_OUTPUT_CHARS = int(os.getenv("AGENT_HISTORY_TOOL_OUTPUT_CHARS", "2000"))
+AGENT_HISTORY_SUMMARY_CHARS = int(os.getenv("AGENT_HISTORY_SUMMARY_CHARS", "2000"))
+
+# Response rendering (token streaming and throttled incremental UI updates)
+AGENT_STREAM_RESPONSES = os.getenv("AGENT_STREAM_RESPONSES", "1") == "1"
+AGENT_MODEL_REQUEST_TIMEOUT_S = float(os.getenv("AGENT_MODEL_REQUEST_TIMEOUT_S", "60"))  # timeout ต่อการเรียก model หนึ่งครั้ง (0 = ไม่จำกัด)
+RENDER_MIN_INTERVAL_S = float(os.getenv("RENDER_MIN_INTERVAL_S", "0.1"))
+RENDER_MIN_CHARS = int(os.getenv("RENDER_MIN_CHARS", "400"))
+RENDER_SEGMENT_CHARS = int(os.getenv("RENDER_SEGMENT_CHARS", "4000"))
+RENDER_TOOL_OUTPUT_INLINE_CHARS = int(os.getenv("RENDER_TOOL_OUTPUT_INLINE_CHARS", "2000"))
+RENDER_TOOL_OUTPUT_PAGE_ROWS = int(os.getenv("RENDER_TOOL_OUTPUT_PAGE_ROWS", "50"))
+
+# Chat history replay (bounded session state, full results spilled to disk)
+CHAT_HISTORY_RENDER_WINDOW = int(os.getenv("CHAT_HISTORY_RENDER_WINDOW", "20"))
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "200"))
+CHAT_PREVIEW_MAX_ROWS = int(os.getenv("CHAT_PREVIEW_MAX_ROWS", "100"))
+CHAT_FULL_RESULT_MAX_ROWS = int(os.getenv("CHAT_FULL_RESULT_MAX_ROWS", "10000"))
+RESULT_SPILL_DATABASE_URL = os.getenv("RESULT_SPILL_DATABASE_URL", "sqlite:///data/result_spill.db")
+RESULT_SPILL_MAX_RESULTS = int(os.getenv("RESULT_SPILL_MAX_RESULTS", "200"))
+
+# Incremental fact loading: order_ids below the high-water mark re-checked for late-arriving rows
+FACT_LOAD_LOOKBACK = int(os.getenv("FACT_LOAD_LOOKBACK", "10000"))
+
+# Route aggregate queries in execute_sql_query to matching materialised data marts (tools/mart_catalog.py)
+MART_ROUTING_ENABLED = os.getenv("MART_ROUTING_ENABLED", "1") == "1"
+# Refresh a stale mart in a background thread when routing skips it (otherwise only refresh_mart/refresh_data_mart refresh it)
+MART_BACKGROUND_REFRESH = os.getenv("MART_BACKGROUND_REFRESH", "1") == "1"
+
+# Query log and index advisor (tools/query_log.py, tools/index_advisor.py)
+QUERY_LOG_MAX_ENTRIES = int(os.getenv("QUERY_LOG_MAX_ENTRIES", "1000"))
+INDEX_ADVISOR_MAX_COLUMNS = int(os.getenv("INDEX_ADVISOR_MAX_COLUMNS", "6"))
+INDEX_ADVISOR_TIMING_RUNS = int(os.getenv("INDEX_ADVISOR_TIMING_RUNS", "3"))
+
+# Optional analytical engine for read-only aggregate queries: "sqlite" (default) or "duckdb" (requires the duckdb package)
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sqlite").lower()
+ANALYTICS_THREADS = int(os.getenv("ANALYTICS_THREADS", str(os.cpu_count() or 4)))
+ANALYTICS_MEMORY_LIMIT = os.getenv("ANALYTICS_MEMORY_LIMIT", "")  # เช่น "2GB" (ว่าง = ค่าเริ่มต้นของ DuckDB)
+
+# Benchmark suite (python -m benchmarks.run_benchmarks): separate database, rebuilt on every run
+BENCHMARK_DATABASE_URL = os.getenv("BENCHMARK_DATABASE_URL", "sqlite:///data/benchmark.db")
+BENCHMARK_REPEATS = int(os.getenv("BENCHMARK_REPEATS", "5"))
+
+# Tracing of agent prompts, LLM calls, tool calls, SQL and rendering (tools/tracing.py)
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "data/traces.jsonl")  # ว่าง = ไม่เขียนไฟล์ (ยังเก็บ percentile)
+TRACE_STATS_WINDOW = int(os.getenv("TRACE_STATS_WINDOW", "1000"))  # จำนวน span ล่าสุดต่อ (agent, kind) ที่ใช้คำนวณ percentile
+TRACE_FLUSH_SPANS = int(os.getenv("TRACE_FLUSH_SPANS", "200"))
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))  # ขนาดก่อนหมุนไฟล์เป็น .1 (0 = ไม่หมุน)
+
+# Headless agent runtime (agents/runtime.py): prompts running at once and per-prompt timeout in seconds (0 = none)
+AGENT_RUNTIME_CONCURRENCY = int(os.getenv("AGENT_RUNTIME_CONCURRENCY", "8"))
+AGENT_RUNTIME_TIMEOUT_S = float(os.getenv("AGENT_RUNTIME_TIMEOUT_S", "120"))
+AGENT_RUNTIME_SESSION_IDLE_S = float(os.getenv("AGENT_RUNTIME_SESSION_IDLE_S", "1800"))  # session ที่ว่างนานกว่านี้ถูกปิด (0 = ไม่ปิด)
+AGENT_RUNTIME_MAX_SESSIONS = int(os.getenv("AGENT_RUNTIME_MAX_SESSIONS", "1000"))  # เกินแล้วปิด session ที่ใช้ล่าสุดนานที่สุด (0 = ไม่จำกัด)
+
+# Declarative pipeline scheduler (tools/pipeline.py): stages run at once, retries per failed stage and base backoff in seconds
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "4"))
+PIPELINE_MAX_RETRIES = int(os.getenv("PIPELINE_MAX_RETRIES", "2"))
+PIPELINE_RETRY_BACKOFF_S = float(os.getenv("PIPELINE_RETRY_BACKOFF_S", "0.5"))
+
+# Single-writer queue for SQLite writes (tools/write_queue.py): queued writes are group-committed in one transaction
+WRITE_QUEUE_ENABLED = os.getenv("WRITE_QUEUE_ENABLED", "1") == "1"
+WRITE_QUEUE_MAX_GROUP = int(os.getenv("WRITE_QUEUE_MAX_GROUP", "64"))  # งานสูงสุดต่อหนึ่ง commit
+WRITE_QUEUE_GROUP_WINDOW_MS = float(os.getenv("WRITE_QUEUE_GROUP_WINDOW_MS", "0"))  # เวลารองานเพิ่มก่อน commit (0 = รวมเฉพาะงานที่รออยู่แล้ว)
+WRITE_QUEUE_LOCK_RETRY_S = float(os.getenv("WRITE_QUEUE_LOCK_RETRY_S", "60"))  # เวลารวมที่ลอง BEGIN ใหม่เมื่อ process อื่นถือ lock
+WRITE_QUEUE_IDLE_S = float(os.getenv("WRITE_QUEUE_IDLE_S", "30"))  # writer thread คืน connection เมื่อว่างนานเท่านี้
+
+# Deterministic fast path for recognised Data Pipeline Agent commands (agents/intent_router.py)
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "1") == "1"
+INTENT_ROUTER_PREVIEW_ROWS = int(os.getenv("INTENT_ROUTER_PREVIEW_ROWS", "10"))
+
+# Table profiling (tools/table_profiler.py): rows per chunk, HyperLogLog precision, top-k values and histogram bins
+PROFILE_CHUNK_SIZE = int(os.getenv("PROFILE_CHUNK_SIZE", "100000"))
+PROFILE_HLL_PRECISION = int(os.getenv("PROFILE_HLL_PRECISION", "14"))  # 2^14 register ≈ 0.8% error
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "10"))
+PROFILE_TOP_K_CAPACITY = int(os.getenv("PROFILE_TOP_K_CAPACITY", "200"))  # ค่าที่ติดตามต่อคอลัมน์ใน frequent-items sketch
+PROFILE_HISTOGRAM_BINS = int(os.getenv("PROFILE_HISTOGRAM_BINS", "32"))
+
 # Ensure data directory exists
 if not os.path.exists("data"):
     os.makedirs("data")
@@ -0,0 +1,77 @@
+# tests/test_agent_tool_loop.py
+"""
+ทดสอบ loop ของ Tool calls ใน process_prompt ด้วย StubGenerativeModel (ไม่เรียก Gemini API)
+
+รันด้วย: python -m pytest tests หรือ python -m unittest discover tests
+"""
+from unittest import mock
+import tempfile
+import unittest
+import os
+
+from agents.stub_model import StubFunctionCall, StubGenerativeModel, StubResponse
+from agents.data_mart_agent import DataMartAgent
+from tools.db_tools import execute_sql_query
+from tools.tracing import tracer
+import config
+
+class ToolLoopTest(unittest.TestCase):
+    def setUp(self):
+        # ใช้ฐานข้อมูลชั่วคราวและไม่เขียนไฟล์ trace ลง data/
+        self.work_dir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(self.work_dir.name, 'warehouse.db')}"
+        for patcher in (
+            mock.patch.object(config, "DATABASE_URL", database_url),
+            mock.patch.object(config, "AGENT_STREAM_RESPONSES", False),
+            mock.patch.object(tracer, "export_path", ""),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.work_dir.cleanup)
+        execute_sql_query(database_url, "CREATE TABLE sales (order_id INTEGER PRIMARY KEY, amount REAL)")
+        execute_sql_query(database_url, "INSERT INTO sales VALUES (1, 10.0), (2, 20.0)")
+
+    def _agent(self, script):
+        model = StubGenerativeModel(script)
+        return DataMartAgent(api_key=None, model=model), model
+
+    def test_one_round_trip_per_tool_round(self):
+        agent, model = self._agent([
+            StubResponse("", [("get_table_schema", {"table_name": "sales"})]),
+            StubResponse("ตาราง sales มีสองคอลัมน์"),
+        ])
+        text, _, _ = agent.process_prompt("schema ของ sales")
+        self.assertEqual(model.round_trips, 2)
+        self.assertIn("ตาราง sales มีสองคอลัมน์", text)
+
+    def test_parallel_read_only_calls_answered_in_one_message(self):
+        agent, model = self._agent([
+            StubResponse("", [
+                ("get_table_schema", {"table_name": "sales"}),
+                ("execute_sql_query", {"query": "SELECT SUM(amount) AS total FROM sales"}),
+                ("describe_all_tables", {}),
+            ]),
+            StubResponse("ยอดขายรวม 30"),
+        ])
+        _, _, query_results = agent.process_prompt("ยอดขายรวม")
+        self.assertEqual(model.round_trips, 2)
+        parts = model.sent_messages[1]
+        self.assertEqual([part.function_response.name for part in parts],
+                         ["get_table_schema", "execute_sql_query", "describe_all_tables"])
+        self.assertIn('"total":30.0', query_results)
+
+    def test_unanswered_calls_closed_when_round_budget_runs_out(self):
+        loop_forever = [StubResponse("", [StubFunctionCall("list_data_marts", {})])]
+        with mock.patch.object(config, "AGENT_MAX_TOOL_ROUNDS", 2):
+            agent, model = self._agent(loop_forever)
+            text, _, _ = agent.process_prompt("วนเรียก Tool ไปเรื่อยๆ")
+        # prompt แรก + หนึ่งครั้งต่อรอบ Tool และไม่เรียก model เพิ่มหลังใช้รอบครบ
+        self.assertEqual(model.round_trips, 3)
+        self.assertIn("Tool budget exhausted", text)
+        closing_call, closing_reply = agent.chat_session.history[-2:]
+        self.assertEqual(closing_call["role"], "user")
+        self.assertEqual([part.function_response.name for part in closing_call["parts"]], ["list_data_marts"])
+        self.assertEqual(closing_reply["role"], "model")
+
+if __name__ == "__main__":
+    unittest.main()
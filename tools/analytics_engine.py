@@ -0,0 +1,157 @@
+# tools/analytics_engine.py
+from sqlalchemy.engine import make_url
+import pandas as pd
+import threading
+import re
+
+from tools.query_cache import is_read_only_query, query_cache
+import config
+
+try:
+    import duckdb
+except ImportError: # DuckDB เป็น dependency เสริม ถ้าไม่ได้ติดตั้งจะรันทุก query บน SQLite ตามเดิม
+    duckdb = None
+
+_ANALYTICAL_PATTERN = re.compile(r"\bgroup\s+by\b|\b(sum|avg|count|min|max|median|stddev\w*|variance)\s*\(", re.IGNORECASE)
+
+def is_analytical_query(query: str) -> bool:
+    """
+    ตรวจสอบว่าเป็น aggregate query แบบอ่านอย่างเดียวที่เหมาะกับ engine แบบ columnar หรือไม่
+    """
+    return is_read_only_query(query) and bool(_ANALYTICAL_PATTERN.search(query))
+
+class AnalyticsEngine:
+    """
+    รัน aggregate query แบบอ่านอย่างเดียวบน DuckDB (columnar, หลาย thread) แทน SQLite
+    ส่วนการเขียนข้อมูลทั้งหมดยังคงไปที่ SQLite ผ่าน db_tools
+
+    - โหมด attach: ใช้ sqlite extension ของ DuckDB ที่ติดตั้งไว้ในเครื่องแล้ว อ่านไฟล์ SQLite โดยตรง
+    - โหมด mirror: ถ้าไม่มี extension จะคัดลอกตารางที่ query อ้างถึงเข้า DuckDB เมื่อ data version เปลี่ยน
+      ถ้าตารางได้รับเฉพาะ INSERT จาก process นี้ จะคัดลอกเฉพาะแถวที่ rowid มากกว่าที่คัดลอกไว้
+      ส่วน UPDATE/DELETE/DDL หรือการเขียนจาก process อื่น (ตรวจผ่าน PRAGMA data_version ใน query cache) จะคัดลอกใหม่ทั้งตาราง
+
+    ไม่มีการดาวน์โหลด extension จาก network (autoinstall ถูกปิด)
+    """
+
+    def __init__(self, threads: int = None, memory_limit: str = None):
+        self.threads = threads or config.ANALYTICS_THREADS
+        self.memory_limit = memory_limit or config.ANALYTICS_MEMORY_LIMIT
+        self._connections = {} # database_url -> (duckdb connection, mode)
+        self._mirrored = {}    # (database_url, table_name) -> (data version, rowid สูงสุดที่คัดลอกไว้ หรือ None, จำนวนแถว)
+        self._dirty = set()    # (database_url, table_name) ที่ถูก UPDATE/DELETE/DDL หลังคัดลอก (ต้องคัดลอกใหม่ทั้งตาราง)
+        self._lock = threading.RLock()
+        self._stats = {"queries": 0, "fallbacks": 0, "tables_mirrored": 0, "incremental_mirrors": 0, "rows_mirrored": 0}
+
+    @staticmethod
+    def available() -> bool:
+        return duckdb is not None
+
+    def _connection(self, database_url: str):
+        with self._lock:
+            if database_url in self._connections:
+                return self._connections[database_url]
+            url = make_url(database_url)
+            if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+                raise ValueError("Analytics engine รองรับเฉพาะฐานข้อมูล SQLite แบบไฟล์")
+            settings = {"threads": self.threads, "autoinstall_known_extensions": False}
+            if self.memory_limit:
+                settings["memory_limit"] = self.memory_limit
+            connection = duckdb.connect(database=":memory:", config=settings)
+            try:
+                connection.execute("LOAD sqlite")
+                connection.execute(f"ATTACH '{url.database}' AS warehouse (TYPE sqlite, READ_ONLY)")
+                connection.execute("USE warehouse")
+                mode = "attach"
+            except Exception:
+                mode = "mirror"
+            self._connections[database_url] = (connection, mode)
+            return connection, mode
+
+    def _sync_tables(self, database_url: str, connect, duck, tables: set):
+        """
+        คัดลอกตารางที่ล้าสมัยจาก SQLite เข้า DuckDB (เฉพาะโหมด mirror)
+        """
+        for table_name in sorted(tables):
+            key = (database_url, table_name)
+            version = query_cache.table_version(database_url, table_name)
+            mirrored = self._mirrored.get(key)
+            if key not in self._dirty and mirrored is not None and mirrored[0] == version:
+                continue
+            # version = (generation ของฐานข้อมูล, version ของตาราง): generation เปลี่ยนเมื่อมีการเขียนที่ไม่รู้ว่ากระทบอะไร
+            append_from = None
+            if key not in self._dirty and mirrored is not None and mirrored[0][0] == version[0] and mirrored[1] is not None:
+                append_from = mirrored[1]
+            self._dirty.discard(key)
+            with connect() as connection:
+                try:
+                    high_water_mark = connection.exec_driver_sql(f'SELECT MAX(rowid) FROM "{table_name}"').scalar() or 0
+                except Exception:
+                    high_water_mark = None # ตาราง WITHOUT ROWID คัดลอกทั้งตารางทุกครั้ง
+                if append_from is not None and (high_water_mark is None or connection.exec_driver_sql(
+                    f'SELECT COUNT(*) FROM "{table_name}" WHERE rowid <= {append_from}'
+                ).scalar() != mirrored[2]):
+                    append_from = None # มีแถวใหม่ที่ rowid ไม่เกินที่คัดลอกไว้ (เช่นระบุ id เอง) จึงคัดลอกใหม่ทั้งตาราง
+                if high_water_mark is None:
+                    frame = pd.read_sql(f'SELECT * FROM "{table_name}"', connection)
+                else:
+                    # จำกัดด้วย rowid ที่อ่านไว้ แถวที่ถูกเพิ่มระหว่างอ่านจึงถูกคัดลอกในรอบถัดไปพอดี
+                    lower = "" if append_from is None else f"rowid > {append_from} AND "
+                    frame = pd.read_sql(f'SELECT * FROM "{table_name}" WHERE {lower}rowid <= {high_water_mark}', connection)
+            duck.register("_mirror_frame", frame)
+            try:
+                if append_from is None:
+                    duck.execute(f'CREATE OR REPLACE TABLE "{table_name}" AS SELECT * FROM _mirror_frame')
+                    self._stats["tables_mirrored"] += 1
+                elif len(frame):
+                    column_list = ", ".join(f'"{column}"' for column in frame.columns)
+                    duck.execute(f'INSERT INTO "{table_name}" ({column_list}) SELECT {column_list} FROM _mirror_frame')
+                    self._stats["incremental_mirrors"] += 1
+            finally:
+                duck.unregister("_mirror_frame")
+            rows = len(frame) if append_from is None else mirrored[2] + len(frame)
+            self._mirrored[key] = (version, high_water_mark, rows)
+            self._stats["rows_mirrored"] += len(frame)
+
+    def notify_write(self, database_url: str, table_names=None, inserts_only: bool = False):
+        """
+        แจ้งว่าตารางถูกเขียนโดย process นี้ (เรียกจาก db_tools หลัง commit)
+        การเขียนที่ไม่ใช่ INSERT อย่างเดียวทำให้สำเนาใน DuckDB ต้องคัดลอกใหม่ทั้งตาราง
+        table_names เป็น None หรือว่าง = ไม่รู้ว่ากระทบตารางใด
+        """
+        if inserts_only and table_names:
+            return
+        with self._lock:
+            for key in self._mirrored:
+                if key[0] == database_url and (not table_names or key[1] in table_names):
+                    self._dirty.add(key)
+
+    def execute(self, database_url: str, connect, query: str, tables: set, max_rows: int = 0) -> list:
+        """
+        รัน query บน DuckDB และคืนค่าเป็น List of Dictionaries (รูปแบบเดียวกับ execute_sql_query)
+        """
+        with self._lock:
+            duck, mode = self._connection(database_url)
+            if mode == "mirror":
+                self._sync_tables(database_url, connect, duck, tables)
+            cursor = duck.cursor()
+        try:
+            result = cursor.execute(query)
+            columns = [column[0] for column in result.description]
+            rows = result.fetchmany(max_rows) if max_rows and max_rows > 0 else result.fetchall()
+        finally:
+            cursor.close()
+        with self._lock:
+            self._stats["queries"] += 1
+        return [dict(zip(columns, row)) for row in rows]
+
+    def record_fallback(self):
+        with self._lock:
+            self._stats["fallbacks"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            modes = {url: mode for url, (_, mode) in self._connections.items()}
+            return {**self._stats, "available": self.available(), "modes": modes}
+
+# Engine ที่ใช้ร่วมกันทั้ง process
+analytics_engine = AnalyticsEngine()
@@ -1,49 +1,505 @@
 # tools/db_tools.py
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
 import pandas as pd
+import threading
+import hashlib
+import sqlite3
+import decimal
+import base64
+import time
 import json
+import re
+
+import config
+from tools.schema_catalog import ddl_target_tables, schema_catalog
+from tools.query_cache import is_cacheable_query, is_read_only_query, query_cache, referenced_tables
+from tools.mart_catalog import mart_catalog
+from tools.query_log import query_log
+from tools.tracing import tracer
+from tools.analytics_engine import analytics_engine, is_analytical_query
+from tools.write_queue import requires_own_transaction, write_queue
+from tools.table_profiler import table_profiler
+
+# ค่าแทน NULL ใน row_hash (ต้องต่างจากสตริงว่าง)
+ROW_HASH_NULL = "\\N"
+
+_INSERT_ONLY = re.compile(r"^\s*insert\s+into\b", re.IGNORECASE)
+_SCHEMA_SOURCE = re.compile(r"\b(sqlite_\w+|pragma_\w+)\b", re.IGNORECASE)
+
+# Engine ที่สร้างแล้วจะถูกเก็บไว้ใช้ซ้ำตาม database_url (หนึ่ง engine ต่อ URL ต่อ process)
+_engine_registry = {}
+_engine_stats = {}
+_engine_registry_lock = threading.Lock()
+
+def _is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+def _apply_sqlite_pragmas(dbapi_connection, is_memory: bool):
+    """
+    ตั้งค่า PRAGMA สำหรับ SQLite ทุกครั้งที่มีการเปิด connection ใหม่
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        if not is_memory:
+            cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+    finally:
+        cursor.close()
+
+def _sqlite_row_hash(*values) -> str:
+    """
+    ฟังก์ชัน SQL row_hash(...) สำหรับ SQLite: md5 ของค่าทุกคอลัมน์ที่ส่งเข้ามา (ใช้ตรวจจับแถวที่เปลี่ยนแปลง)
+    """
+    # NULL ใช้ค่าแทนที่ต่างจากสตริงว่าง เพื่อให้การเปลี่ยน NULL <-> '' นับเป็นเวอร์ชันใหม่
+    joined = "|".join(ROW_HASH_NULL if value is None else str(value) for value in values)
+    return hashlib.md5(joined.encode("utf-8")).hexdigest()
+
+def _new_engine_stats() -> dict:
+    return {
+        "engine_hits": 0,
+        "engine_misses": 0,
+        "checkouts": 0,
+        "pool_hits": 0,
+        "pool_misses": 0,
+        "checkout_wait_total_ms": 0.0,
+        "checkout_wait_max_ms": 0.0,
+    }
+
+def _create_pooled_engine(database_url: str, stats: dict):
+    url = make_url(database_url)
+    engine_kwargs = {}
+    is_sqlite = url.get_backend_name() == "sqlite"
+    is_memory = _is_sqlite_memory(url)
+
+    if is_sqlite:
+        # Connection ใน pool ถูกใช้ข้าม thread ได้ (Streamlit รันแต่ละ session คนละ thread)
+        engine_kwargs["connect_args"] = {"check_same_thread": False}
+    if not is_memory:
+        # In-memory SQLite ใช้ pool เฉพาะของ SQLAlchemy เพื่อให้เห็นข้อมูลชุดเดียวกัน
+        engine_kwargs.update(
+            poolclass=QueuePool,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            pool_pre_ping=not is_sqlite,
+        )
+
+    engine = create_engine(url, **engine_kwargs)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        connection_record.info["fresh"] = True
+        if is_sqlite:
+            _apply_sqlite_pragmas(dbapi_connection, is_memory)
+            dbapi_connection.create_function("row_hash", -1, _sqlite_row_hash, deterministic=True)
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with _engine_registry_lock:
+            stats["checkouts"] += 1
+            if connection_record.info.pop("fresh", False):
+                stats["pool_misses"] += 1
+            else:
+                stats["pool_hits"] += 1
+
+    return engine
 
 def get_db_engine(database_url: str):
     """
-    สร้างและคืนค่า SQLAlchemy engine สำหรับเชื่อมต่อฐานข้อมูล
+    คืนค่า SQLAlchemy engine สำหรับเชื่อมต่อฐานข้อมูล
+    Engine จะถูกสร้างเพียงครั้งเดียวต่อ database_url และใช้ connection pool ร่วมกันทั้ง process
+    """
+    engine = _engine_registry.get(database_url)
+    if engine is not None:
+        with _engine_registry_lock:
+            _engine_stats[database_url]["engine_hits"] += 1
+        return engine
+
+    with _engine_registry_lock:
+        engine = _engine_registry.get(database_url)
+        if engine is None:
+            stats = _engine_stats.setdefault(database_url, _new_engine_stats())
+            engine = _create_pooled_engine(database_url, stats)
+            _engine_registry[database_url] = engine
+            stats["engine_misses"] += 1
+        else:
+            _engine_stats[database_url]["engine_hits"] += 1
+        return engine
+
+@contextmanager
+def db_connection(database_url: str):
+    """
+    ยืม connection จาก pool ของ engine ที่ cache ไว้ และบันทึกเวลาที่ต้องรอ checkout
+    """
+    engine = get_db_engine(database_url)
+    started = time.perf_counter()
+    connection = engine.connect()
+    wait_ms = (time.perf_counter() - started) * 1000
+    with _engine_registry_lock:
+        stats = _engine_stats[database_url]
+        stats["checkout_wait_total_ms"] += wait_ms
+        stats["checkout_wait_max_ms"] = max(stats["checkout_wait_max_ms"], wait_ms)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def get_engine_stats(database_url: str = None) -> dict:
+    """
+    คืนค่าสถิติของ engine registry และ connection pool (hit/miss, เวลารอ checkout)
+    ถ้าไม่ระบุ database_url จะคืนค่าของทุก URL
     """
-    return create_engine(database_url)
+    with _engine_registry_lock:
+        urls = [database_url] if database_url else list(_engine_stats)
+        report = {}
+        for url in urls:
+            if url not in _engine_stats:
+                continue
+            stats = dict(_engine_stats[url])
+            stats["checkout_wait_avg_ms"] = (
+                stats["checkout_wait_total_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0
+            )
+            engine = _engine_registry.get(url)
+            if engine is not None:
+                stats["pool_status"] = engine.pool.status()
+            report[url] = stats
+    for url, stats in write_queue.stats(database_url).items():
+        if url in report:
+            report[url]["write_queue"] = stats
+    return report
 
-def execute_sql_query(database_url: str, query: str):
+def dispose_db_engines():
+    """
+    ปิด connection pool ทั้งหมดและล้าง engine registry (ใช้ตอนปิดโปรแกรมหรือเปลี่ยน config)
+    """
+    write_queue.close()
+    with _engine_registry_lock:
+        for engine in _engine_registry.values():
+            engine.dispose()
+        _engine_registry.clear()
+        _engine_stats.clear()
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+def _dump_json(value) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+def _is_pageable_query(query: str) -> bool:
+    return re.match(r"^\s*(select|with)\b", query, re.IGNORECASE) is not None
+
+def _query_fingerprint(query: str) -> str:
+    return hashlib.sha1(" ".join(query.split()).encode("utf-8")).hexdigest()[:12]
+
+def _encode_page_token(query: str, offset: int) -> str:
+    payload = _dump_json({"q": _query_fingerprint(query), "o": offset})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def _decode_page_token(query: str, page_token: str) -> int:
+    if not page_token:
+        return 0
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(page_token.encode("ascii")))
+        offset = int(payload["o"])
+    except Exception:
+        raise ValueError("page_token ไม่ถูกต้อง")
+    if payload.get("q") != _query_fingerprint(query) or offset < 0:
+        raise ValueError("page_token ไม่ตรงกับ query นี้")
+    return offset
+
+def iter_query_batches(database_url: str, query: str, chunk_size: int = None, max_rows: int = None, params: dict = None):
+    """
+    รัน Query แบบ Streaming และ yield ผลลัพธ์ทีละชุด (List of Dictionaries) ขนาดไม่เกิน chunk_size แถว
+    ผลลัพธ์ทั้งหมดจะไม่ถูกโหลดเข้าหน่วยความจำพร้อมกัน และหยุดเมื่อครบ max_rows (ถ้ากำหนด)
+    """
+    chunk_size = chunk_size or config.QUERY_STREAM_CHUNK_SIZE
+    with db_connection(database_url) as connection:
+        streaming = connection.execution_options(stream_results=True, yield_per=chunk_size)
+        result = streaming.execute(text(query), params or {})
+        try:
+            if not result.returns_rows:
+                return
+            columns = list(result.keys())
+            emitted = 0
+            while True:
+                size = chunk_size if not max_rows else min(chunk_size, max_rows - emitted)
+                if size <= 0:
+                    break
+                rows = result.fetchmany(size)
+                if not rows:
+                    break
+                emitted += len(rows)
+                yield [dict(zip(columns, row)) for row in rows]
+        finally:
+            result.close()
+
+def iter_query_ndjson(database_url: str, query: str, chunk_size: int = None, max_rows: int = None, params: dict = None):
+    """
+    รัน Query แบบ Streaming และ yield ผลลัพธ์เป็น NDJSON (หนึ่งบรรทัดต่อหนึ่งแถว)
+    """
+    for batch in iter_query_batches(database_url, query, chunk_size=chunk_size, max_rows=max_rows, params=params):
+        yield "".join(_dump_json(record) + "\n" for record in batch)
+
+def fetch_query_page(database_url: str, query: str, page_size: int, page_token: str = ""):
+    """
+    ดึงผลลัพธ์ของ SELECT Query ทีละหน้า คืนค่า (rows, next_page_token)
+    next_page_token เป็น None เมื่อไม่มีหน้าถัดไป
+    """
+    if not _is_pageable_query(query):
+        raise ValueError("การแบ่งหน้ารองรับเฉพาะคำสั่ง SELECT/WITH")
+    offset = _decode_page_token(query, page_token)
+    paged_query = f"SELECT * FROM ({query.strip().rstrip(';')}) LIMIT :_limit OFFSET :_offset"
+    rows = []
+    for batch in iter_query_batches(database_url, paged_query, chunk_size=page_size + 1,
+                                    params={"_limit": page_size + 1, "_offset": offset}):
+        rows.extend(batch)
+    next_page_token = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_page_token = _encode_page_token(query, offset + page_size)
+    return rows, next_page_token
+
+def execute_sql_query(database_url: str, query: str, max_rows: int = 0, page_size: int = 0, page_token: str = ""):
     """
     รันคำสั่ง SQL ที่กำหนดกับฐานข้อมูลและส่งคืนผลลัพธ์ (ถ้ามี)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        query (str): คำสั่ง SQL
+        max_rows (int): จำนวนแถวสูงสุดที่จะคืนค่า (0 = ไม่จำกัด แต่ Tool call จาก Agent ใช้ config.TOOL_SQL_MAX_ROWS)
+        page_size (int): ถ้ามากกว่า 0 จะคืนผลลัพธ์ทีละหน้าในรูปแบบ {"rows": [...], "next_page_token": ...}
+        page_token (str): token จากหน้าก่อนหน้า สำหรับดึงหน้าถัดไป
     """
+    started = time.perf_counter()
+    span = tracer.start_span("execute_sql_query", "sql", activate=True, query_chars=len(query))
+    run_query, cached = query, None
     try:
-        engine = get_db_engine(database_url)
-        with engine.connect() as connection:
-            result = connection.execute(text(query))
-            connection.commit() # Commit changes for DML operations
-
-            if result.returns_rows:
-                df = pd.DataFrame(result.fetchall(), columns=result.keys())
-                return df.to_json(orient='records')
-            else:
-                return f"Query executed successfully with no rows returned. Rows affected: {result.rowcount}"
+        cacheable = config.QUERY_CACHE_ENABLED and is_cacheable_query(query)
+        if cacheable:
+            tables = _cache_tables(database_url, query)
+            cacheable = tables is not None
+        if cacheable:
+            variant = (max_rows, page_size, page_token)
+            cache_key, cached = query_cache.lookup(database_url, query, tables, variant)
+        if cached is not None:
+            output = cached
+        else:
+            output, run_query = _run_query(database_url, query, max_rows, page_size, page_token)
     except Exception as e:
+        _finish_query(database_url, query, run_query, started, span, "", error=e)
         return f"Error executing SQL query: {str(e)}"
+    # ปิด span นอก try: งานเขียนที่ commit แล้วต้องไม่ถูกรายงานว่าล้มเหลวเพราะขั้นตอนหลังจากนั้น
+    _finish_query(database_url, query, run_query, started, span, output, cached=cached is not None)
+    if cacheable and cached is None:
+        query_cache.store(cache_key, tables, output)
+    return output
+
+def _run_query(database_url: str, query: str, max_rows: int, page_size: int, page_token: str) -> tuple:
+    """
+    รัน query ผ่าน data mart, analytics engine หรือฐานข้อมูลโดยตรง คืนค่า (ผลลัพธ์, SQL ที่รันจริง)
+    """
+    run_query = query
+    if config.MART_ROUTING_ENABLED and not page_size and not page_token and is_read_only_query(query):
+        # Aggregate query ที่ data mart ตอบได้จะอ่านจาก mart แทนการ scan ตาราง fact
+        run_query = _route_to_mart(database_url, query) or query
+    output = None
+    if run_query == query and config.ANALYTICS_ENGINE == "duckdb" and not page_size and not page_token and is_analytical_query(query):
+        output = _execute_analytical(database_url, query, max_rows)
+    if output is None:
+        try:
+            output = _execute_sql_query_uncached(database_url, run_query, max_rows, page_size, page_token)
+        except Exception:
+            if run_query == query:
+                raise
+            # query ที่เขียนใหม่ให้อ่านจาก mart ล้มเหลว: รัน query เดิมบนตารางต้นทางแทน
+            run_query = query
+            output = _execute_sql_query_uncached(database_url, query, max_rows, page_size, page_token)
+    return output, run_query
+
+def _finish_query(database_url: str, query: str, run_query: str, started: float, span, output: str, cached: bool = False, error: Exception = None):
+    """
+    บันทึกการรัน query ลง query log และปิด span ของ SQL
+    """
+    query_log.record(database_url, query, run_query, (time.perf_counter() - started) * 1000, cached=cached, error=error is not None)
+    span.set(cached=cached, routed=run_query != query, output_bytes=len(output))
+    tracer.end_span(span, error=error)
+
+def _tables_in_query(database_url: str, query: str) -> set:
+    known_tables = schema_catalog.describe_all(database_url, lambda: db_connection(database_url))
+    return referenced_tables(query, known_tables)
+
+def _cache_tables(database_url: str, query: str):
+    """
+    ตารางที่ผลลัพธ์ของ query ขึ้นอยู่กับ สำหรับใช้เป็น key ของ query cache หรือ None ถ้าไม่ควร cache
+    บน SQLite ใช้ตารางจริงที่ authorizer รายงานขณะ compile คำสั่ง (ไม่รัน query) จึงรวมตารางที่อยู่ใต้ view
+    และ query ที่อ้างถึงตารางที่ไม่รู้จักจะ compile ไม่ผ่าน (ไม่ cache)
+    """
+    with db_connection(database_url) as connection:
+        if connection.dialect.name != "sqlite":
+            return _tables_in_query(database_url, query)
+        if _SCHEMA_SOURCE.search(query):
+            return None # อ่าน schema (sqlite_master, pragma_*) ซึ่งไม่มี data version
+        raw = connection.connection.driver_connection
+        tables = set()
+
+        def authorize(action, arg1, arg2, database, source):
+            if action == sqlite3.SQLITE_READ and arg1 and not arg1.startswith("sqlite_"):
+                tables.add(arg1 if database != "temp" else None)
+            return sqlite3.SQLITE_OK
+
+        raw.set_authorizer(authorize)
+        try:
+            raw.execute(f"EXPLAIN {query.strip().rstrip(';')}").close()
+        except sqlite3.Error:
+            return None
+        finally:
+            raw.set_authorizer(None)
+    return None if None in tables else tables
+
+def _route_to_mart(database_url: str, query: str):
+    try:
+        return mart_catalog.route(database_url, lambda: db_connection(database_url), query)
+    except Exception:
+        return None # ถ้า route ไม่สำเร็จให้รัน query เดิม
+
+def _execute_analytical(database_url: str, query: str, max_rows: int):
+    """
+    รัน aggregate query บน analytics engine (DuckDB) คืนค่า None ถ้าใช้ไม่ได้ เพื่อให้รันบน SQLite แทน
+    """
+    if not analytics_engine.available():
+        return None
+    try:
+        tables = _tables_in_query(database_url, query)
+        rows = analytics_engine.execute(database_url, lambda: db_connection(database_url), query, tables, max_rows)
+        tracer.annotate(engine="duckdb", rows=len(rows))
+        return _dump_json(rows)
+    except Exception:
+        # เช่น SQL ที่ใช้ฟังก์ชันเฉพาะของ SQLite
+        analytics_engine.record_fallback()
+        return None
+
+def _invalidate_written_tables(database_url: str, query: str = None, tables=None, inserts_only: bool = False, schema_changed=None):
+    """
+    แจ้ง schema catalog (รวมจำนวนแถวโดยประมาณ), analytics engine, query cache, mart catalog และ table profiler เมื่อมีการเขียนข้อมูล
+    ทุกเส้นทางที่เขียนข้อมูลต้องเรียกฟังก์ชันนี้หลัง commit
+
+    Args:
+        query (str): คำสั่ง SQL ที่รัน (หาตารางที่ถูกเขียนและประเภทคำสั่งจาก SQL)
+        tables: ตารางที่ถูกเขียน สำหรับงานที่ไม่ได้มาจาก SQL คำสั่งเดียว (เช่น bulk load, merge)
+        inserts_only (bool): งานที่มีเฉพาะ INSERT (mart/profile ทำ incremental ต่อได้) ใช้คู่กับ tables
+        schema_changed: ตารางที่ schema เปลี่ยน ใช้คู่กับ tables
+    """
+    if query is None:
+        ddl_tables = set(schema_changed) if schema_changed else None
+        written = set(tables or ()) | (ddl_tables or set())
+    else:
+        ddl_tables = ddl_target_tables(query)
+        try:
+            written = _tables_in_query(database_url, query) | (ddl_tables or set())
+        except Exception:
+            written = set()
+        inserts_only = bool(_INSERT_ONLY.match(query)) and "on conflict" not in query.lower()
+    if ddl_tables is not None:
+        schema_catalog.invalidate(database_url, ddl_tables)
+    schema_catalog.notify_write(database_url, written)
+    analytics_engine.notify_write(database_url, written if ddl_tables != set() else None, inserts_only=inserts_only and not ddl_tables)
+    # ถ้าระบุตารางไม่ได้ (เช่น DROP INDEX) จะล้าง cache ของฐานข้อมูลนี้ทั้งหมด
+    query_cache.invalidate_tables(database_url, written if ddl_tables != set() else None)
+    table_profiler.notify_write(database_url, written, inserts_only=inserts_only)
+    if ddl_tables == set():
+        mart_catalog.invalidate(database_url)
+    else:
+        mart_catalog.notify_write(database_url, written, inserts_only=inserts_only)
+
+def _execute_sql_query_uncached(database_url: str, query: str, max_rows: int, page_size: int, page_token: str) -> str:
+    if page_size and page_size > 0:
+        rows, next_page_token = fetch_query_page(database_url, query, page_size, page_token)
+        return _dump_json({"rows": rows, "next_page_token": next_page_token})
+
+    if not is_read_only_query(query):
+        # คำสั่งเขียน (DML/DDL) รันผ่าน single writer และ commit แบบกลุ่ม แล้วจึงแจ้ง cache หลัง commit
+        output = write_queue.submit(database_url, lambda: db_connection(database_url),
+                                    lambda connection: _run_statement(connection, query, max_rows),
+                                    transactional=not requires_own_transaction(query))
+        _invalidate_written_tables(database_url, query)
+        return output
+
+    with db_connection(database_url) as connection:
+        output = _run_statement(connection, query, max_rows)
+        connection.commit()
+        return output
+
+def _run_statement(connection, query: str, max_rows: int) -> str:
+    """
+    รันคำสั่งบน connection ที่กำหนด (ไม่ commit) และคืนผลลัพธ์เป็น JSON หรือข้อความจำนวนแถวที่ได้รับผลกระทบ
+    """
+    chunk_size = config.QUERY_STREAM_CHUNK_SIZE
+    streaming = connection.execution_options(stream_results=True, yield_per=chunk_size)
+    result = streaming.execute(text(query))
+
+    if result.returns_rows:
+        # ต่อ JSON ทีละ chunk โดยไม่สร้าง DataFrame ของผลลัพธ์ทั้งหมด (รวมถึง INSERT ... RETURNING)
+        columns = list(result.keys())
+        json_chunks = []
+        emitted = 0
+        while True:
+            size = chunk_size if not max_rows else min(chunk_size, max_rows - emitted)
+            if size <= 0:
+                break
+            rows = result.fetchmany(size)
+            if not rows:
+                break
+            emitted += len(rows)
+            json_chunks.append(",".join(_dump_json(dict(zip(columns, row))) for row in rows))
+        result.close()
+        tracer.annotate(rows=emitted)
+        return "[" + ",".join(json_chunks) + "]"
+    tracer.annotate(rows_affected=result.rowcount)
+    return f"Query executed successfully with no rows returned. Rows affected: {result.rowcount}"
 
 def get_table_schema(database_url: str, table_name: str):
     """
     ส่งคืน Schema ของตารางที่กำหนดในรูปแบบ Dictionary (column_name: data_type)
     """
     try:
-        engine = get_db_engine(database_url)
-        with engine.connect() as connection:
-            query = f"PRAGMA table_info({table_name});"
-            result = connection.execute(text(query)).fetchall()
-            schema = {row[1]: row[2] for row in result}
-            return json.dumps(schema)
+        # อ่านจาก schema catalog ที่ cache ไว้ (ไม่ต้อง query ฐานข้อมูลทุกครั้ง)
+        description = schema_catalog.describe(database_url, lambda: db_connection(database_url), table_name)
+        schema = description["columns"] if description else {}
+        return json.dumps(schema)
     except Exception as e:
         return f"Error getting table schema for '{table_name}': {str(e)}"
 
-def create_table_ddl(database_url: str, table_name: str, schema_json: str):
+def describe_all_tables(database_url: str):
+    """
+    ส่งคืน Schema ของทุกตารางในฐานข้อมูลในครั้งเดียว (columns, primary_key, indexes, row_count_estimate)
+    """
+    try:
+        tables = schema_catalog.describe_all(database_url, lambda: db_connection(database_url))
+        return json.dumps(tables)
+    except Exception as e:
+        return f"Error describing tables: {str(e)}"
+
+def table_exists(database_url: str, table_name: str) -> bool:
+    """
+    ตรวจสอบว่ามีตารางที่กำหนดอยู่ในฐานข้อมูลหรือไม่
+    """
+    return schema_catalog.describe(database_url, lambda: db_connection(database_url), table_name) is not None
+
+def create_table_ddl(database_url: str, table_name: str, schema_json: str, indexes_json: str = ""):
     """
     สร้างและรันคำสั่ง SQL DDL (Data Definition Language) สำหรับการสร้างตาราง
+    indexes_json (ถ้าระบุ) คือ JSON list ของรายการคอลัมน์ที่ต้องการสร้าง index เช่น '[["customer_id"], ["sale_date", "product_id"]]'
     """
     try:
         schema = json.loads(schema_json)
@@ -51,16 +507,158 @@ def create_table_ddl(database_url: str, table_name: str, schema_json: str):
         for col_name, col_type in schema.items():
             columns_ddl.append(f"{col_name} {col_type}")
         ddl = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns_ddl)});"
+        for index_columns in (json.loads(indexes_json) if indexes_json else []):
+            index_columns = [index_columns] if isinstance(index_columns, str) else list(index_columns)
+            ddl += f"\nCREATE INDEX IF NOT EXISTS ix_{table_name}_{'_'.join(index_columns)} ON {table_name} ({', '.join(index_columns)});"
 
-        engine = get_db_engine(database_url)
-        with engine.connect() as connection:
-            connection.execute(text(ddl))
-            connection.commit()
+        def run_ddl(connection):
+            for statement in ddl.split("\n"):
+                connection.execute(text(statement))
+        write_queue.submit(database_url, lambda: db_connection(database_url), run_ddl)
+        schema_catalog.invalidate(database_url, [table_name])
+        query_cache.invalidate_tables(database_url, [table_name])
         return f"Table '{table_name}' created or already exists. DDL: {ddl}"
     except Exception as e:
         return f"Error creating table DDL for '{table_name}': {str(e)}"
 
-def insert_data_into_table(database_url: str, table_name: str, data_json: str): # <--- ฟังก์ชันนี้ต้องมีอยู่และสะกดถูกต้อง
+def _placeholder(paramstyle: str, position: int, name: str) -> str:
+    if paramstyle == "qmark":
+        return "?"
+    if paramstyle in ("format", "pyformat"):
+        return "%s"
+    if paramstyle == "numeric":
+        return f":{position + 1}"
+    return f":{name}"
+
+def _frame_to_rows(df: pd.DataFrame):
+    """
+    แปลง DataFrame เป็น List of tuples ที่ DBAPI bind ได้ (NaN -> None, datetime -> ISO string)
+    """
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+def _iter_bulk_frames(data, batch_size: int):
+    """
+    แปลงข้อมูลนำเข้า (records, DataFrame, iterable ของ DataFrame หรือ path ของไฟล์) เป็น DataFrame ทีละชุด
+    """
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), batch_size):
+            yield data.iloc[start:start + batch_size]
+    elif isinstance(data, str):
+        lowered = data.lower()
+        if lowered.endswith(".csv"):
+            yield from pd.read_csv(data, chunksize=batch_size)
+        elif lowered.endswith((".ndjson", ".jsonl")):
+            yield from pd.read_json(data, lines=True, chunksize=batch_size)
+        elif lowered.endswith(".json"):
+            yield from _iter_bulk_frames(pd.read_json(data, orient="records"), batch_size)
+        elif lowered.endswith(".parquet"):
+            yield from _iter_bulk_frames(pd.read_parquet(data), batch_size)
+        else:
+            raise ValueError(f"ไม่รองรับไฟล์ประเภทนี้สำหรับ bulk load: {data}")
+    elif isinstance(data, dict):
+        yield pd.DataFrame([data])
+    elif isinstance(data, list):
+        for start in range(0, len(data), batch_size):
+            yield pd.DataFrame.from_records(data[start:start + batch_size])
+    else:
+        # Iterable ของ DataFrame เช่นผลลัพธ์จาก pd.read_csv(..., chunksize=...)
+        for frame in data:
+            yield from _iter_bulk_frames(frame, batch_size)
+
+def _build_insert_sql(connection, table_name: str, columns: list, upsert_keys: list = None) -> str:
+    paramstyle = connection.dialect.paramstyle
+    placeholders = ", ".join(_placeholder(paramstyle, i, c) for i, c in enumerate(columns))
+    column_list = ", ".join(columns)
+    sql = f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
+    if upsert_keys:
+        if connection.dialect.name not in ("sqlite", "postgresql"):
+            raise ValueError(f"Upsert ยังไม่รองรับฐานข้อมูล {connection.dialect.name}")
+        updates = [c for c in columns if c not in upsert_keys]
+        conflict_target = ", ".join(upsert_keys)
+        if updates:
+            assignments = ", ".join(f"{c} = excluded.{c}" for c in updates)
+            sql += f" ON CONFLICT ({conflict_target}) DO UPDATE SET {assignments}"
+        else:
+            sql += f" ON CONFLICT ({conflict_target}) DO NOTHING"
+    return sql
+
+def bulk_load(database_url: str, table_name: str, data, batch_size: int = None, upsert: bool = False, key_columns: list = None) -> dict:
+    """
+    โหลดข้อมูลจำนวนมากเข้าตารางด้วย executemany ทีละ batch ภายใน transaction เดียว
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        table_name (str): ชื่อตารางปลายทาง (ถ้ายังไม่มีจะสร้างจากคอลัมน์ของข้อมูลชุดแรก)
+        data: List of Dictionaries, DataFrame, iterable ของ DataFrame หรือ path ของไฟล์ (.csv/.json/.ndjson/.parquet)
+        batch_size (int): จำนวนแถวต่อการเรียก executemany หนึ่งครั้ง
+        upsert (bool): ถ้าเป็น True จะอัปเดตแถวที่ Primary Key ซ้ำแทนการ insert ใหม่
+        key_columns (list): คอลัมน์ที่ใช้ตรวจสอบการซ้ำสำหรับ upsert (ค่าเริ่มต้นคือ Primary Key ของตาราง)
+
+    Returns:
+        dict: สถิติการโหลด (rows, batches, seconds, rows_per_second)
+    """
+    batch_size = batch_size or config.BULK_LOAD_BATCH_SIZE
+    started = time.perf_counter()
+    # ทั้งการโหลดเป็นงานเดียวของ writer (อยู่ใน transaction เดียวกัน ล้มเหลวแล้ว rollback ทั้งหมด)
+    total_rows, batches, created_table = write_queue.submit(
+        database_url, lambda: db_connection(database_url),
+        lambda connection: _bulk_insert(connection, table_name, data, batch_size, upsert, key_columns),
+    )
+
+    _invalidate_written_tables(database_url, tables=[table_name], inserts_only=not upsert,
+                               schema_changed=[table_name] if created_table else None)
+    seconds = time.perf_counter() - started
+    tracer.record("bulk_load", "sql", seconds * 1000, table=table_name, rows=total_rows, batches=batches)
+    return {
+        "table": table_name,
+        "mode": "upsert" if upsert else "insert",
+        "rows": total_rows,
+        "batches": batches,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(total_rows / seconds, 1) if seconds > 0 else float(total_rows),
+    }
+
+def _bulk_insert(connection, table_name: str, data, batch_size: int, upsert: bool, key_columns: list) -> tuple:
+    """
+    เขียนข้อมูลทีละ batch บน connection ที่กำหนด (ไม่ commit) คืนค่า (rows, batches, created_table)
+    """
+    total_rows = 0
+    batches = 0
+    insert_sql = None
+    insert_columns = None
+    created_table = False
+    for frame in _iter_bulk_frames(data, batch_size):
+        if frame.empty:
+            continue
+        columns = [str(c) for c in frame.columns]
+        if insert_sql is None or columns != insert_columns:
+            if not inspect(connection).has_table(table_name):
+                connection.exec_driver_sql(pd.io.sql.get_schema(frame, table_name, con=connection))
+                if upsert and key_columns:
+                    # ตารางที่สร้างจากข้อมูลไม่มี Primary Key: ON CONFLICT ต้องมี unique index บน key_columns
+                    connection.exec_driver_sql(
+                        f'CREATE UNIQUE INDEX "ux_{table_name}_{"_".join(key_columns)}" ON "{table_name}" ({", ".join(key_columns)})'
+                    )
+                created_table = True
+            upsert_keys = None
+            if upsert:
+                upsert_keys = key_columns or inspect(connection).get_pk_constraint(table_name).get("constrained_columns")
+                if not upsert_keys:
+                    raise ValueError(f"ตาราง '{table_name}' ไม่มี Primary Key สำหรับ upsert โปรดระบุ key_columns")
+            insert_sql = _build_insert_sql(connection, table_name, columns, upsert_keys)
+            insert_columns = columns
+        rows = _frame_to_rows(frame)
+        connection.exec_driver_sql(insert_sql, rows)
+        total_rows += len(rows)
+        batches += 1
+    return total_rows, batches, created_table
+
+def insert_data_into_table(database_url: str, table_name: str, data_json: str, upsert: bool = False): # <--- ฟังก์ชันนี้ต้องมีอยู่และสะกดถูกต้อง
     """
     แทรกข้อมูล JSON ลงในตารางที่กำหนด
 
@@ -68,18 +666,17 @@ def insert_data_into_table(database_url: str, table_name: str, data_json: str):
         database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
         table_name (str): ชื่อตารางที่จะแทรกข้อมูล
         data_json (str): ข้อมูลที่จะแทรกในรูปแบบ JSON string ของ List of Dictionaries
+        upsert (bool): ถ้าเป็น True จะอัปเดตแถวที่ Primary Key ซ้ำแทนการ insert ใหม่
 
     Returns:
         str: ข้อความยืนยันการแทรกข้อมูลหรือข้อผิดพลาด
     """
     try:
-        # ใช้ StringIO เพื่อแปลง JSON string เป็นไฟล์เหมือนในหน่วยความจำ
-        df = pd.read_json(json.dumps(json.loads(data_json)), orient='records') # ต้องแน่ใจว่า data_json เป็น JSON string ที่ถูกต้อง
-        engine = get_db_engine(database_url)
-        with engine.connect() as connection:
-            # ใช้ to_sql เพื่อแทรกข้อมูล
-            df.to_sql(table_name, con=connection, if_exists='append', index=False)
-            connection.commit() # Commit transaction for data insertion
-        return f"Successfully inserted {len(df)} rows into '{table_name}'."
+        # Parse JSON เพียงครั้งเดียว แล้วส่ง records ไปยัง bulk loader โดยตรง
+        records = json.loads(data_json)
+        stats = bulk_load(database_url, table_name, records, upsert=upsert)
+        action = "upserted" if upsert else "inserted"
+        return (f"Successfully {action} {stats['rows']} rows into '{table_name}' "
+                f"in {stats['seconds']}s ({stats['rows_per_second']} rows/s).")
     except Exception as e:
         return f"Error inserting data into '{table_name}': {str(e)}"
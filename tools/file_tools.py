@@ -2,6 +2,20 @@
 import pandas as pd
 from io import StringIO
 import json
+import time
+import uuid
+import os
+
+from tools.db_tools import bulk_load, db_connection, get_table_schema, table_exists
+from tools.query_cache import is_read_only_query
+import config
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow เป็น dependency เสริม ใช้เฉพาะฟังก์ชัน Parquet/Arrow
+    pa = None
 
 def create_dataframe_from_csv_content(csv_content: str):
     """Creates a pandas DataFrame from a CSV content string."""
@@ -18,4 +32,261 @@ def save_dataframe_to_csv(df_json: str, file_path: str):
         df.to_csv(file_path, index=False)
         return f"DataFrame successfully saved to {file_path}"
     except Exception as e:
-        return f"Error saving DataFrame to CSV: {str(e)}"
\ No newline at end of file
+        return f"Error saving DataFrame to CSV: {str(e)}"
+
+# dtype ของ pandas ที่ใช้อ่าน CSV ทีละ chunk ตามชนิด SQL ของคอลัมน์ในตารางปลายทาง
+_SQL_TO_PANDAS_DTYPE = [
+    ("BOOL", "boolean"),
+    ("INT", "Int64"),
+    ("REAL", "float64"),
+    ("FLOA", "float64"),
+    ("DOUB", "float64"),
+    ("NUMERIC", "float64"),
+    ("DECIMAL", "float64"),
+    ("CHAR", "string"),
+    ("CLOB", "string"),
+    ("TEXT", "string"),
+    ("DATE", "string"),
+    ("TIME", "string"),
+]
+
+def _dtypes_for_table(database_url: str, table_name: str) -> dict:
+    """หา dtype ของ pandas สำหรับอ่าน CSV จากชนิดคอลัมน์ที่ประกาศไว้ในตารางปลายทาง"""
+    schema = json.loads(get_table_schema(database_url, table_name)) if table_exists(database_url, table_name) else {}
+    dtypes = {}
+    for column, sql_type in schema.items():
+        sql_type = (sql_type or "").upper()
+        for prefix, dtype in _SQL_TO_PANDAS_DTYPE:
+            if prefix in sql_type:
+                dtypes[column] = dtype
+                break
+    return dtypes
+
+def ingest_csv(database_url: str, table_name: str, source, dtypes: dict = None, chunk_size: int = None, upsert: bool = False,
+               key_columns: list = None) -> dict:
+    """
+    โหลด CSV (path หรือ file-like object) เข้าตารางทีละ chunk
+
+    แต่ละ chunk ถูกอ่านด้วย dtype ที่กำหนด (ระบุเอง หรือหาจาก schema ของตารางปลายทาง)
+    แล้วส่งให้ bulk loader โดยตรง ไม่มีการแปลงข้อมูลเป็น JSON
+    """
+    chunk_size = chunk_size or config.CSV_INGEST_CHUNK_SIZE
+    if dtypes is None:
+        dtypes = _dtypes_for_table(database_url, table_name)
+    reader = pd.read_csv(source, chunksize=chunk_size, dtype=dtypes or None, skipinitialspace=True)
+    with reader:
+        return bulk_load(database_url, table_name, reader, batch_size=chunk_size, upsert=upsert, key_columns=key_columns)
+
+def load_csv_into_table(database_url: str, table_name: str, file_path: str, dtypes_json: str = "", upsert: bool = False):
+    """โหลดไฟล์ CSV เข้าตารางในฐานข้อมูลทีละ chunk โดยไม่สร้าง DataFrame หรือ JSON ของทั้งไฟล์ในหน่วยความจำ"""
+    try:
+        dtypes = json.loads(dtypes_json) if dtypes_json else None
+        stats = ingest_csv(database_url, table_name, file_path, dtypes=dtypes, upsert=upsert)
+        return (f"Successfully loaded {stats['rows']} rows from '{file_path}' into '{table_name}' "
+                f"in {stats['batches']} chunks, {stats['seconds']}s ({stats['rows_per_second']} rows/s).")
+    except Exception as e:
+        return f"Error loading CSV '{file_path}' into '{table_name}': {str(e)}"
+
+# ชนิดของ Arrow ตามชนิด SQL ที่ประกาศไว้ (ใช้ตารางเดียวกับ dtype ของ CSV)
+_PANDAS_TO_ARROW_TYPE = {
+    "boolean": "bool_",
+    "Int64": "int64",
+    "float64": "float64",
+    "string": "string",
+}
+
+_ARROW_IPC_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+# จำนวน chunk สูงสุดที่พักไว้เพื่อรอค่าที่ไม่ใช่ null ของทุกคอลัมน์ก่อนกำหนด schema (จำกัดหน่วยความจำ)
+_SCHEMA_PROBE_CHUNKS = 4
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("การใช้ Parquet/Arrow ต้องติดตั้ง package เสริม 'pyarrow' (pip install pyarrow)")
+
+def _is_arrow_ipc(file_path: str) -> bool:
+    return str(file_path).lower().endswith(_ARROW_IPC_SUFFIXES)
+
+def _declared_arrow_types(database_url: str, table_name: str) -> dict:
+    """แปลงชนิดคอลัมน์ที่ประกาศไว้ของตารางเป็นชนิดของ Arrow เพื่อให้ทุก chunk เขียนด้วย schema เดียวกัน"""
+    return {column: getattr(pa, _PANDAS_TO_ARROW_TYPE[dtype])() for column, dtype in _dtypes_for_table(database_url, table_name).items()}
+
+def _rows_to_arrays(columns: list, rows: list, types: dict) -> list:
+    """แปลง tuple ของแถวจาก DBAPI เป็น Arrow array ทีละคอลัมน์ คอลัมน์ที่มีค่าไม่ตรงกับชนิดจะถูกแปลงเป็น string"""
+    arrays = []
+    for index, values in enumerate(zip(*rows) if rows else [()] * len(columns)):
+        arrow_type = types.get(columns[index])
+        try:
+            arrays.append(pa.array(values, type=arrow_type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # SQLite ไม่บังคับชนิดข้อมูล คอลัมน์เดียวจึงมีค่าหลายชนิดปนกันได้
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    return arrays
+
+def export_query_to_arrow(database_url: str, query: str, file_path: str, chunk_size: int = None,
+                          compression: str = None, column_types: dict = None) -> dict:
+    """
+    เขียนผลลัพธ์ของ query จาก cursor ของฐานข้อมูลลงไฟล์ Parquet (หรือ Arrow IPC สำหรับไฟล์ .arrow/.feather/.ipc)
+    ทีละ chunk โดยหนึ่ง chunk เป็นหนึ่ง row group / record batch
+
+    - ไม่สร้าง DataFrame หรือ JSON ของผลลัพธ์ทั้งหมด
+    - ชนิดของคอลัมน์มาจาก column_types ถ้าระบุ มิฉะนั้นใช้ chunk แรกที่คอลัมน์มีค่าที่ไม่ใช่ null
+      (พัก chunk ไว้ไม่เกิน _SCHEMA_PROBE_CHUNKS chunk)
+    - รับเฉพาะคำสั่งอ่าน และเขียนลงไฟล์ชั่วคราวที่แทนที่ file_path เมื่อ export สำเร็จเท่านั้น
+    """
+    _require_pyarrow()
+    if not is_read_only_query(query):
+        raise ValueError("export รับเฉพาะคำสั่งอ่าน (SELECT/WITH)")
+    chunk_size = chunk_size or config.ARROW_EXPORT_CHUNK_SIZE
+    compression = compression or config.PARQUET_COMPRESSION
+    started = time.perf_counter()
+    writer, schema, types = None, None, dict(column_types or {})
+    pending, pending_chunks, total_rows, batches = [], 0, 0, 0
+    # เขียนลงไฟล์ชั่วคราวในโฟลเดอร์เดียวกัน แล้วแทนที่ไฟล์ปลายทางเมื่อสำเร็จเท่านั้น (ไม่ทิ้งไฟล์ที่เขียนไม่ครบ)
+    directory, name = os.path.split(os.path.abspath(file_path))
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:12]}.tmp")
+
+    def write(rows):
+        nonlocal writer, schema
+        arrays = _rows_to_arrays(columns, rows, types)
+        if schema is None:
+            schema = pa.schema([pa.field(c, a.type if a.type != pa.null() else pa.string()) for c, a in zip(columns, arrays)])
+            types.update({field.name: field.type for field in schema})
+            arrays = _rows_to_arrays(columns, rows, types)
+            if _is_arrow_ipc(file_path):
+                writer = pa.ipc.new_file(temp_path, schema)
+            else:
+                writer = pq.ParquetWriter(temp_path, schema, compression=compression)
+        cast = []
+        for array, field in zip(arrays, schema):
+            try:
+                cast.append(array.cast(field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+                raise ValueError(
+                    f"คอลัมน์ '{field.name}' มีค่าที่ไม่ตรงกับชนิด {field.type} ที่กำหนดจากแถวก่อนหน้า "
+                    f"(ระบุ column_types เช่น string สำหรับคอลัมน์นี้): {e}"
+                ) from e
+        batch = pa.RecordBatch.from_arrays(cast, schema=schema)
+        if isinstance(writer, pq.ParquetWriter):
+            writer.write_batch(batch, row_group_size=chunk_size)
+        else:
+            writer.write_batch(batch)
+
+    try:
+        try:
+            with db_connection(database_url) as connection:
+                # ใช้ cursor ของ DBAPI โดยตรง: ได้ tuple ธรรมดา ไม่ต้องสร้าง Row ของ SQLAlchemy ทุกแถว
+                cursor = connection.connection.cursor()
+                cursor.execute(query)
+                columns = [column[0] for column in cursor.description]
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    total_rows += len(rows)
+                    batches += 1
+                    if schema is None:
+                        # พัก chunk ไว้จนทุกคอลัมน์มีค่าที่ไม่ใช่ null (ไม่เกิน _SCHEMA_PROBE_CHUNKS chunk
+                        # คอลัมน์ที่ยังเป็น null ทั้งหมดหลังจากนั้นจะเป็น string)
+                        pending.extend(rows)
+                        pending_chunks += 1
+                        if pending_chunks < _SCHEMA_PROBE_CHUNKS and not all(
+                            c in types or any(r[i] is not None for r in pending) for i, c in enumerate(columns)
+                        ):
+                            continue
+                        rows, pending = pending, []
+                    write(rows)
+                if schema is None:
+                    write(pending)
+                cursor.close()
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    seconds = time.perf_counter() - started
+    return {
+        "rows": total_rows,
+        "batches": batches,
+        "columns": columns,
+        "bytes": os.path.getsize(file_path),
+        "seconds": round(seconds, 3),
+        "rows_per_second": int(total_rows / seconds) if seconds > 0 else total_rows,
+    }
+
+def export_table_to_arrow(database_url: str, table_name: str, file_path: str, columns: list = None, **kwargs) -> dict:
+    """export ตาราง (หรือเฉพาะบางคอลัมน์) เป็น Parquet/Arrow ตามชนิดคอลัมน์ที่ประกาศไว้ของตาราง"""
+    column_list = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+    types = _declared_arrow_types(database_url, table_name)
+    return export_query_to_arrow(database_url, f'SELECT {column_list} FROM "{table_name}"', file_path, column_types=types, **kwargs)
+
+def _arrow_dataset(file_path: str):
+    return ds.dataset(file_path, format="ipc" if _is_arrow_ipc(file_path) else "parquet")
+
+def read_arrow_frame(file_path: str, columns: list = None, filters: list = None, memory_map: bool = True) -> pd.DataFrame:
+    """
+    อ่านไฟล์ Parquet หรือ Arrow IPC เป็น DataFrame
+
+    อ่านเฉพาะคอลัมน์ที่ระบุ และส่ง filters (รูปแบบของ pandas/pyarrow เช่น [("region", "=", "North")])
+    ลงไปถึงการอ่านไฟล์ row group ที่สถิติบอกว่าไม่มีแถวที่ตรงจะถูกข้าม
+    ไฟล์ Arrow IPC ถูก memory-map จึงอ่านจาก page cache ได้โดยไม่คัดลอกข้อมูล
+    """
+    _require_pyarrow()
+    if _is_arrow_ipc(file_path):
+        with pa.memory_map(file_path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns:
+            table = table.select(columns)
+        if filters:
+            table = ds.dataset(table).to_table(filter=pq.filters_to_expression(filters))
+    else:
+        table = pq.read_table(file_path, columns=columns, filters=filters or None, memory_map=memory_map)
+    return table.to_pandas()
+
+def ingest_arrow(database_url: str, table_name: str, file_path: str, columns: list = None, filters: list = None,
+                 chunk_size: int = None, upsert: bool = False, key_columns: list = None) -> dict:
+    """โหลดไฟล์ Parquet/Arrow เข้าตารางทีละ record batch โดยอ่านเฉพาะคอลัมน์และแถวที่ตรงกับ filters"""
+    _require_pyarrow()
+    chunk_size = chunk_size or config.CSV_INGEST_CHUNK_SIZE
+    scanner = _arrow_dataset(file_path).scanner(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None,
+        batch_size=chunk_size,
+    )
+    frames = (batch.to_pandas() for batch in scanner.to_batches())
+    return bulk_load(database_url, table_name, frames, batch_size=chunk_size, upsert=upsert, key_columns=key_columns)
+
+def _parse_json_list(value: str):
+    """แปลง argument ที่เป็น JSON list (ว่างได้) filters ที่ส่งมาเป็น list จะถูกแปลงเป็น tuple สำหรับ pyarrow"""
+    if not value:
+        return None
+    parsed = json.loads(value)
+    return [tuple(item) if isinstance(item, list) else item for item in parsed]
+
+def export_to_parquet(database_url: str, file_path: str, table_name: str = "", query: str = "", columns_json: str = ""):
+    """export ตารางหรือผลลัพธ์ของ query เป็นไฟล์ Parquet (หรือ Arrow IPC สำหรับไฟล์ .arrow/.feather) ทีละ chunk จาก cursor ของฐานข้อมูล"""
+    try:
+        if table_name:
+            stats = export_table_to_arrow(database_url, table_name, file_path, columns=_parse_json_list(columns_json))
+        elif query:
+            stats = export_query_to_arrow(database_url, query, file_path)
+        else:
+            return "Error exporting to Parquet: provide either table_name or query."
+        return (f"Successfully exported {stats['rows']} rows ({len(stats['columns'])} columns) to '{file_path}' "
+                f"in {stats['batches']} chunks, {stats['bytes']} bytes, {stats['seconds']}s.")
+    except Exception as e:
+        return f"Error exporting to Parquet '{file_path}': {str(e)}"
+
+def load_parquet_into_table(database_url: str, table_name: str, file_path: str, columns_json: str = "",
+                            filters_json: str = "", upsert: bool = False):
+    """โหลดไฟล์ Parquet/Arrow เข้าตารางทีละ chunk โดยอ่านเฉพาะคอลัมน์ที่ระบุและแถวที่ตรงกับ filters (เช่น [["region", "=", "North"]])"""
+    try:
+        stats = ingest_arrow(database_url, table_name, file_path, columns=_parse_json_list(columns_json),
+                             filters=_parse_json_list(filters_json), upsert=upsert)
+        return (f"Successfully loaded {stats['rows']} rows from '{file_path}' into '{table_name}' "
+                f"in {stats['batches']} chunks, {stats['seconds']}s ({stats['rows_per_second']} rows/s).")
+    except Exception as e:
+        return f"Error loading Parquet '{file_path}' into '{table_name}': {str(e)}"
@@ -0,0 +1,223 @@
+# tools/index_advisor.py
+import statistics
+import time
+import json
+import re
+
+from tools.db_tools import db_connection
+from tools.schema_catalog import schema_catalog
+from tools.query_cache import query_cache, is_read_only_query
+from tools.query_log import query_log
+from tools.write_queue import write_queue
+import config
+
+_TABLE_REF = re.compile(
+    r"\b(?:from|join)\s+([a-z_]\w*)(?:\s+(?:as\s+)?(?!(?:where|join|on|group|order|limit|inner|left|right|cross|natural|using|having)\b)([a-z_]\w*))?",
+    re.IGNORECASE,
+)
+_COLUMN_REF = r"([a-z_]\w*(?:\.[a-z_]\w*)?)"
+_EQUALITY = re.compile(_COLUMN_REF + r"\s*(?:==?|\bin\b|\bis\b)", re.IGNORECASE)
+_EQUALITY_RIGHT = re.compile(r"=\s*" + _COLUMN_REF + r"(?!\s*\()", re.IGNORECASE)
+_RANGE = re.compile(_COLUMN_REF + r"\s*(?:<=?|>=?|\bbetween\b|\blike\b)", re.IGNORECASE)
+_IDENTIFIER = re.compile(r"\b[a-z_]\w*(?:\.[a-z_]\w*)?\b(?!\s*\()", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_CLAUSE_END = r"(?=\b(?:group\s+by|order\s+by|limit|having|join|inner|left|where)\b|$)"
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?", re.IGNORECASE)
+_TEMP_BTREE = re.compile(r"USE TEMP B-TREE FOR (GROUP BY|ORDER BY|DISTINCT|RIGHT PART OF ORDER BY)", re.IGNORECASE)
+
+def explain_query_plan(connection, query: str) -> list:
+    """
+    คืนค่าแผนการรัน query (รายการ detail ของ EXPLAIN QUERY PLAN) สำหรับ SQLite
+    """
+    if connection.dialect.name != "sqlite":
+        raise ValueError(f"EXPLAIN QUERY PLAN รองรับเฉพาะ SQLite (ฐานข้อมูลนี้คือ {connection.dialect.name})")
+    return [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}").fetchall()]
+
+def analyse_plan(plan: list) -> dict:
+    """
+    หา full table scan และการ sort ด้วย temp B-tree จากแผนการรัน
+    """
+    full_scans, temp_sorts = [], []
+    for detail in plan:
+        scan = _SCAN.match(detail.strip())
+        if scan and "INDEX" not in detail.upper():
+            full_scans.append(scan.group(2) or scan.group(1))
+        sort = _TEMP_BTREE.search(detail)
+        if sort:
+            temp_sorts.append(sort.group(1).upper())
+    return {"full_scans": full_scans, "temp_sorts": temp_sorts}
+
+def _clause(query: str, keyword: str) -> str:
+    match = re.search(rf"\b{keyword}\s+(.+?){_CLAUSE_END}", query, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else ""
+
+def _select_list(query: str) -> str:
+    match = re.search(r"\bselect\s+(.+?)\s+from\b", query, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else ""
+
+def _all_clauses(query: str, keyword: str) -> str:
+    return " ".join(m.group(1) for m in re.finditer(rf"\b{keyword}\s+(.+?){_CLAUSE_END}", query, re.IGNORECASE | re.DOTALL))
+
+def _propose_indexes(database_url: str, query: str, plan_findings: dict) -> list:
+    """
+    เสนอ index สำหรับตารางที่ถูก scan ทั้งตาราง หรือถูก sort ด้วย temp B-tree
+    ลำดับคอลัมน์: equality -> group by -> order by -> range แล้วเติมคอลัมน์ที่ query ใช้เพื่อให้เป็น covering index
+    """
+    connect = lambda: db_connection(database_url)
+    stripped = _STRING_LITERAL.sub("''", query)
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(stripped):
+        aliases[(alias or table).lower()] = table
+        aliases[table.lower()] = table
+    tables = {t: schema_catalog.describe(database_url, connect, t) for t in set(aliases.values())}
+    tables = {t: d for t, d in tables.items() if d is not None}
+
+    def resolve(ref: str):
+        if "." in ref:
+            alias, column = ref.split(".", 1)
+            table = aliases.get(alias.lower())
+            return (table, column) if table in tables and column in tables[table]["columns"] else None
+        owners = [t for t, d in tables.items() if ref in d["columns"]]
+        return (owners[0], ref) if len(owners) == 1 else None
+
+    def columns_of(pattern, clause: str) -> list:
+        return [r for r in (resolve(ref) for ref in pattern.findall(clause)) if r is not None]
+
+    predicates = _all_clauses(stripped, "where") + " " + _all_clauses(stripped, "on")
+    equality = columns_of(_EQUALITY, predicates) + columns_of(_EQUALITY_RIGHT, predicates)
+    ranges = columns_of(_RANGE, predicates)
+    group_by = columns_of(_IDENTIFIER, _clause(stripped, r"group\s+by"))
+    order_by = columns_of(_IDENTIFIER, _clause(stripped, r"order\s+by"))
+    referenced = columns_of(_IDENTIFIER, _select_list(stripped)) + columns_of(_IDENTIFIER, predicates) + group_by + order_by
+
+    flagged = {aliases.get(name.lower(), name) for name in plan_findings["full_scans"]}
+    if plan_findings["temp_sorts"]:
+        flagged |= {table for table, _ in group_by + order_by}
+
+    proposals = []
+    for table in sorted(flagged & set(tables)):
+        key_columns = []
+        for group in (equality, group_by, order_by, ranges[:1]):
+            for owner, column in group:
+                if owner == table and column not in key_columns:
+                    key_columns.append(column)
+        if not key_columns:
+            continue
+        covering = list(key_columns)
+        for owner, column in referenced:
+            if owner == table and column not in covering:
+                covering.append(column)
+        columns = covering if len(covering) <= config.INDEX_ADVISOR_MAX_COLUMNS else key_columns
+        existing = [idx for idx in tables[table]["indexes"] if idx["columns"][:len(columns)] == columns]
+        if existing or tables[table]["primary_key"][:len(columns)] == columns:
+            continue
+        name = f"ix_{table}_{'_'.join(columns)}"[:60]
+        proposals.append({
+            "table": table,
+            "columns": columns,
+            "covering": columns == covering,
+            "ddl": f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})",
+            "index_name": name,
+        })
+    return proposals
+
+def _time_query(database_url: str, query: str, runs: int = None) -> float:
+    """
+    วัดเวลารัน query โดยตรง (ไม่ผ่าน query cache / mart routing) คืนค่า median เป็นมิลลิวินาที
+    """
+    runs = runs or config.INDEX_ADVISOR_TIMING_RUNS
+    timings = []
+    with db_connection(database_url) as connection:
+        for _ in range(runs):
+            started = time.perf_counter()
+            connection.exec_driver_sql(query).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+def advise_indexes(database_url: str, query: str = None, limit: int = 5, create: bool = False) -> list:
+    """
+    วิเคราะห์ query (หรือ query ที่ช้าที่สุดจาก query log) ด้วย EXPLAIN QUERY PLAN และเสนอ index
+
+    ถ้า create เป็น True จะสร้าง index ที่เสนอ วัดเวลาก่อน/หลัง และลบ index ทิ้งถ้าแผนการรันใหม่ไม่ได้ใช้ index นั้น
+
+    Returns:
+        list: รายงานต่อ query (plan, findings, proposals และผลการสร้าง index)
+    """
+    if query:
+        candidates = [query]
+    else:
+        candidates = [g["query"] for g in query_log.slowest(database_url, limit) if is_read_only_query(g["query"])]
+
+    reports = []
+    for candidate in candidates:
+        with db_connection(database_url) as connection:
+            plan = explain_query_plan(connection, candidate)
+        findings = analyse_plan(plan)
+        proposals = _propose_indexes(database_url, candidate, findings) if findings["full_scans"] or findings["temp_sorts"] else []
+        report = {"query": candidate, "plan": plan, "findings": findings, "proposals": proposals}
+
+        if create and proposals and is_read_only_query(candidate):
+            before_ms = _time_query(database_url, candidate)
+
+            def create_indexes(connection):
+                for proposal in proposals:
+                    connection.exec_driver_sql(proposal["ddl"])
+                    connection.exec_driver_sql(f"ANALYZE {proposal['table']}")
+
+            # สร้าง/ลบ index ผ่าน single writer ส่วน EXPLAIN ใช้ connection อ่านตามปกติ
+            write_queue.submit(database_url, lambda: db_connection(database_url), create_indexes)
+            with db_connection(database_url) as connection:
+                new_plan = explain_query_plan(connection, candidate)
+            created = [p["index_name"] for p in proposals if any(p["index_name"] in detail for detail in new_plan)]
+            unused = [p["index_name"] for p in proposals if p["index_name"] not in created]
+            if unused:
+                write_queue.submit(database_url, lambda: db_connection(database_url), lambda connection: [
+                    connection.exec_driver_sql(f"DROP INDEX IF EXISTS {name}") for name in unused
+                ])
+            touched = [p["table"] for p in proposals]
+            schema_catalog.invalidate(database_url, touched)
+            query_cache.invalidate_tables(database_url, touched)
+            after_ms = _time_query(database_url, candidate)
+            report.update(
+                plan_after=new_plan,
+                created_indexes=created,
+                before_ms=before_ms,
+                after_ms=after_ms,
+                speedup=round(before_ms / after_ms, 2) if after_ms else None,
+            )
+        reports.append(report)
+    return reports
+
+def recommend_indexes(database_url: str, query: str = "", create: bool = False):
+    """
+    วิเคราะห์แผนการรันของ query (หรือ query ที่ช้าที่สุดที่เคยรันผ่าน execute_sql_query ถ้าไม่ระบุ)
+    หา full table scan และการ sort ด้วย temp B-tree แล้วเสนอ covering index
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        query (str): SQL ที่ต้องการวิเคราะห์ (ว่าง = ใช้ query ที่ช้าที่สุดจาก query log)
+        create (bool): ถ้าเป็น True จะสร้าง index ที่เสนอ และรายงานเวลาก่อน/หลัง
+
+    Returns:
+        str: รายงานในรูปแบบ JSON หรือข้อผิดพลาด
+    """
+    try:
+        reports = advise_indexes(database_url, query or None, create=create)
+        if not reports:
+            return "No queries to analyse yet. Run some queries with execute_sql_query first, or pass a query."
+        return json.dumps(reports, ensure_ascii=False, default=str)
+    except Exception as e:
+        return f"Error recommending indexes: {str(e)}"
+
+def get_slow_queries(database_url: str, limit: int = 10):
+    """
+    แสดง query ที่ใช้เวลารวมมากที่สุดจาก query log (จำนวนครั้ง, เวลาเฉลี่ย, เวลาสูงสุด)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        limit (int): จำนวน query สูงสุดที่ต้องการ
+
+    Returns:
+        str: JSON ของ query ที่ช้าที่สุด
+    """
+    return json.dumps(query_log.slowest(database_url, limit), ensure_ascii=False)
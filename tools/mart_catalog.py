@@ -0,0 +1,415 @@
+# tools/mart_catalog.py
+from sqlalchemy import inspect, text
+from datetime import datetime
+import threading
+import json
+import re
+
+from tools.schema_catalog import schema_catalog
+from tools.query_cache import query_cache
+from tools.write_queue import write_queue
+import config
+
+_IDENTIFIER = re.compile(r"^[a-z_]\w*$", re.IGNORECASE)
+_MEASURE = re.compile(r"^\s*(sum|count|min|max)\s*\(\s*(\*|[a-z_]\w*)\s*\)\s*$", re.IGNORECASE)
+_AGGREGATE_CALL = re.compile(r"\b(sum|count|min|max|avg)\s*\(\s*(\*|[a-z_]\w*)\s*\)", re.IGNORECASE)
+_AGGREGATE_QUERY = re.compile(
+    r"^\s*select\s+(?P<select>.+?)\s+from\s+(?P<table>[a-z_]\w*)"
+    r"(?:\s+where\s+(?P<where>.+?))?"
+    r"(?:\s+group\s+by\s+(?P<group>.+?))?"
+    r"(?:\s+having\s+(?P<having>.+?))?"
+    r"(?:\s+order\s+by\s+(?P<order>.+?))?"
+    r"(?:\s+limit\s+(?P<limit>\d+(?:\s+offset\s+\d+)?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+# ส่วนของ query ที่ไม่ route ไปยัง mart (join, subquery, set operation, window function)
+_UNSUPPORTED = re.compile(r"\b(join|union|intersect|except|distinct|over|select)\b", re.IGNORECASE)
+_ALIAS = re.compile(r"^(?P<expr>.+?)\s+as\s+(?P<alias>\"[^\"]*\"|[a-z_]\w*)\s*$", re.IGNORECASE | re.DOTALL)
+_WORD = re.compile(r"\b[a-z_]\w*\b(?!\s*\()", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_SQL_KEYWORDS = {
+    "and", "or", "not", "in", "is", "null", "like", "glob", "between", "true", "false", "case", "when", "then",
+    "else", "end", "asc", "desc", "as", "escape", "collate", "nocase", "nulls", "first", "last",
+}
+
+def measure_column(measure: str) -> str:
+    """
+    ชื่อคอลัมน์ใน mart ของ measure เช่น 'sum(amount)' -> 'sum_amount', 'count(*)' -> 'count_all'
+    """
+    match = _MEASURE.match(measure)
+    if not match:
+        raise ValueError(f"measure ไม่รองรับ: '{measure}' (รองรับ sum/count/min/max ของคอลัมน์เดียว)")
+    func, arg = match.group(1).lower(), match.group(2).lower()
+    return f"{func}_{'all' if arg == '*' else arg}"
+
+def _split_top_level(clause: str) -> list:
+    items, depth, current = [], 0, []
+    for char in clause:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            items.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    items.append("".join(current).strip())
+    return items
+
+def _null_safe_equal(dialect_name: str, left: str, right: str) -> str:
+    if dialect_name == "sqlite":
+        return f"{left} IS {right}"
+    return f"{left} IS NOT DISTINCT FROM {right}"
+
+def _merge_expression(dialect_name: str, mart_table: str, column: str) -> str:
+    """
+    วิธีรวมค่า measure เดิมใน mart กับค่าจาก delta (sum/count บวกกัน, min/max เลือกค่าที่น้อย/มากกว่า)
+    """
+    current, delta = f"{mart_table}.{column}", f"d.{column}"
+    func = column.split("_", 1)[0]
+    if func in ("sum", "count"):
+        return f"COALESCE({current}, 0) + COALESCE({delta}, 0)"
+    scalar = {"sqlite": func, "postgresql": "LEAST" if func == "min" else "GREATEST"}.get(dialect_name, func)
+    return f"{scalar}(COALESCE({current}, {delta}), COALESCE({delta}, {current}))"
+
+def _literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _after_first_select(query: str) -> str:
+    match = re.search(r"\bselect\b", query, re.IGNORECASE)
+    return query[match.end():] if match else query
+
+def _remove_aliases(query: str) -> str:
+    return re.sub(r"\bas\s+\"[^\"]*\"", "", query, flags=re.IGNORECASE)
+
+class MartCatalog:
+    """
+    Catalog ของ data mart แบบ materialised (เก็บในตาราง mart_catalog ของฐานข้อมูลเดียวกัน)
+
+    - mart คือผลรวม (sum/count/min/max) ของตาราง fact ตามชุดคอลัมน์ dimension
+    - refresh แบบ incremental จากแถวใหม่ของตารางต้นทาง (change_column มากกว่า high-water mark)
+    - route() เขียน aggregate query บนตารางต้นทางใหม่ให้อ่านจาก mart ที่ตอบได้และเป็นปัจจุบัน (ถ้ามี)
+
+    การ UPDATE/DELETE ตารางต้นทางทำให้ mart ที่เกี่ยวข้องต้อง refresh แบบเต็มก่อนจะถูก route อีกครั้ง
+    """
+
+    def __init__(self):
+        self._marts = {}    # database_url -> {mart_name: definition}
+        self._dirty = set() # (database_url, mart_name) ที่ต้อง refresh แบบเต็ม
+        self._refreshing = set() # (database_url, mart_name) ที่กำลัง refresh ใน background
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock() # ให้ refresh รันทีละงาน (ลำดับ: _refresh_lock แล้วจึง _lock)
+        self._stats = {"routed": 0, "not_routed": 0, "stale_skips": 0, "incremental_refreshes": 0, "full_refreshes": 0,
+                       "refresh_failures": 0, "last_refresh_error": None}
+
+    def _ensure_table(self, connection):
+        connection.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS mart_catalog ("
+            "mart_name TEXT PRIMARY KEY, source_table TEXT NOT NULL, change_column TEXT NOT NULL, "
+            "dimensions TEXT NOT NULL, measures TEXT NOT NULL, high_water_mark INTEGER, row_count INTEGER, refreshed_at TEXT)"
+        )
+
+    def marts(self, database_url: str, connect) -> dict:
+        """
+        คืนค่านิยามของทุก mart ในฐานข้อมูล (โหลดจากตาราง mart_catalog ครั้งแรกแล้ว cache ไว้)
+        """
+        with self._lock:
+            if database_url not in self._marts:
+                with connect() as connection:
+                    rows = []
+                    if inspect(connection).has_table("mart_catalog"):
+                        rows = connection.exec_driver_sql("SELECT * FROM mart_catalog").mappings().all()
+                self._marts[database_url] = {
+                    row["mart_name"]: {
+                        **row,
+                        "dimensions": json.loads(row["dimensions"]),
+                        "measures": json.loads(row["measures"]),
+                    }
+                    for row in rows
+                }
+            return dict(self._marts[database_url])
+
+    def create(self, database_url: str, connect, mart_name: str, source_table: str, dimensions: list,
+               measures: list, change_column: str) -> dict:
+        """
+        ประกาศ mart ใหม่ (หรือแทนที่นิยามเดิม) และ materialise ข้อมูลทั้งหมดทันที
+        """
+        for name in [mart_name, source_table, change_column] + list(dimensions):
+            if not _IDENTIFIER.match(name):
+                raise ValueError(f"ชื่อไม่ถูกต้อง: '{name}'")
+        if not dimensions or not measures:
+            raise ValueError("ต้องระบุ dimensions และ measures อย่างน้อยอย่างละหนึ่งรายการ")
+        measures = [m.strip().lower() for m in measures]
+        for measure in measures:
+            measure_column(measure) # ตรวจสอบรูปแบบ measure
+
+        def save(connection):
+            self._ensure_table(connection)
+            connection.execute(
+                text("INSERT INTO mart_catalog (mart_name, source_table, change_column, dimensions, measures) "
+                     "VALUES (:mart_name, :source_table, :change_column, :dimensions, :measures) "
+                     "ON CONFLICT (mart_name) DO UPDATE SET source_table = excluded.source_table, "
+                     "change_column = excluded.change_column, dimensions = excluded.dimensions, "
+                     "measures = excluded.measures, high_water_mark = NULL"),
+                {"mart_name": mart_name, "source_table": source_table, "change_column": change_column,
+                 "dimensions": json.dumps(list(dimensions)), "measures": json.dumps(measures)},
+            )
+
+        write_queue.submit(database_url, connect, save)
+        self.invalidate(database_url)
+        schema_catalog.invalidate(database_url, ["mart_catalog"])
+        return self.refresh(database_url, connect, mart_name, full=True)
+
+    def refresh(self, database_url: str, connect, mart_name: str, full: bool = False) -> dict:
+        """
+        Refresh mart: แบบ incremental (รวมเฉพาะแถวใหม่ของตารางต้นทางเข้ากับ mart) หรือแบบเต็ม (สร้างใหม่ทั้งตาราง)
+
+        งานเขียนรันผ่าน single writer โดยไม่ถือ lock ของ catalog (route() ของ query อื่นยังทำงานได้ระหว่าง refresh)
+        การ refresh แบบเต็มสร้างตารางใหม่ก่อนแล้วจึงสลับชื่อแทนการลบ mart เดิมก่อน
+        """
+        key = (database_url, mart_name)
+        with self._refresh_lock:
+            with self._lock:
+                mart = self.marts(database_url, connect).get(mart_name)
+                if mart is None:
+                    raise ValueError(f"ไม่พบ data mart '{mart_name}'")
+                mart = dict(mart)
+                full = full or key in self._dirty
+                # นำ dirty flag ออกก่อนเริ่ม การเขียนที่เกิดระหว่าง refresh จะตั้ง flag ใหม่ให้ refresh รอบถัดไป
+                self._dirty.discard(key)
+            source, change_column = mart["source_table"], mart["change_column"]
+            dimensions = mart["dimensions"]
+            columns = [measure_column(m) for m in mart["measures"]]
+            select_list = ", ".join(dimensions + [f"{m} AS {c}" for m, c in zip(mart["measures"], columns)])
+            group_list = ", ".join(dimensions)
+
+            def build(connection):
+                dialect = connection.dialect.name
+                # high-water mark จาก catalog ในฐานข้อมูล (ไม่ใช้ค่าใน memory ที่อาจเก่ากว่า)
+                previous = connection.execute(
+                    text("SELECT high_water_mark FROM mart_catalog WHERE mart_name = :mart_name"), {"mart_name": mart_name}
+                ).scalar()
+                rebuild = full or previous is None
+                high_water_mark = connection.exec_driver_sql(f"SELECT MAX({change_column}) FROM {source}").scalar()
+                if rebuild:
+                    staging = f"_{mart_name}_build"
+                    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {staging}")
+                    connection.exec_driver_sql(
+                        f"CREATE TABLE {staging} AS SELECT {select_list} FROM {source} "
+                        f"WHERE {change_column} <= {_literal(high_water_mark)} GROUP BY {group_list}"
+                    )
+                    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {mart_name}")
+                    connection.exec_driver_sql(f"ALTER TABLE {staging} RENAME TO {mart_name}")
+                    connection.exec_driver_sql(f"CREATE INDEX ix_{mart_name}_dims ON {mart_name} ({group_list})")
+                    changed_groups = None
+                elif high_water_mark is None or high_water_mark <= previous:
+                    changed_groups = 0
+                    high_water_mark = previous
+                else:
+                    connection.exec_driver_sql("DROP TABLE IF EXISTS _mart_delta")
+                    connection.exec_driver_sql(
+                        f"CREATE TEMP TABLE _mart_delta AS SELECT {select_list} FROM {source} "
+                        f"WHERE {change_column} > {_literal(previous)} "
+                        f"AND {change_column} <= {_literal(high_water_mark)} GROUP BY {group_list}"
+                    )
+                    match = " AND ".join(_null_safe_equal(dialect, f"{mart_name}.{d}", f"d.{d}") for d in dimensions)
+                    assignments = ", ".join(f"{c} = {_merge_expression(dialect, mart_name, c)}" for c in columns)
+                    connection.exec_driver_sql(f"UPDATE {mart_name} SET {assignments} FROM _mart_delta d WHERE {match}")
+                    new_match = " AND ".join(_null_safe_equal(dialect, f"m.{d}", f"d.{d}") for d in dimensions)
+                    connection.exec_driver_sql(
+                        f"INSERT INTO {mart_name} ({', '.join(dimensions + columns)}) "
+                        f"SELECT {', '.join('d.' + c for c in dimensions + columns)} FROM _mart_delta d "
+                        f"WHERE NOT EXISTS (SELECT 1 FROM {mart_name} m WHERE {new_match})"
+                    )
+                    changed_groups = connection.exec_driver_sql("SELECT COUNT(*) FROM _mart_delta").scalar()
+                    connection.exec_driver_sql("DROP TABLE IF EXISTS _mart_delta")
+
+                row_count = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {mart_name}").scalar()
+                refreshed_at = datetime.now().isoformat(timespec="seconds")
+                connection.execute(
+                    text("UPDATE mart_catalog SET high_water_mark = :hwm, row_count = :row_count, refreshed_at = :refreshed_at "
+                         "WHERE mart_name = :mart_name"),
+                    {"hwm": high_water_mark, "row_count": row_count, "refreshed_at": refreshed_at, "mart_name": mart_name},
+                )
+                return rebuild, high_water_mark, changed_groups, row_count, refreshed_at
+
+            try:
+                full, high_water_mark, changed_groups, row_count, refreshed_at = write_queue.submit(database_url, connect, build)
+            except Exception:
+                with self._lock:
+                    if full:
+                        self._dirty.add(key)
+                raise
+
+            with self._lock:
+                mart.update(high_water_mark=high_water_mark, row_count=row_count, refreshed_at=refreshed_at)
+                self._marts.setdefault(database_url, {})[mart_name] = mart
+                self._stats["full_refreshes" if full else "incremental_refreshes"] += 1
+            if full:
+                schema_catalog.invalidate(database_url, [mart_name])
+            query_cache.invalidate_tables(database_url, [mart_name, "mart_catalog"])
+            return {"mart": mart_name, "mode": "full" if full else "incremental", "changed_groups": changed_groups,
+                    "row_count": row_count, "high_water_mark": high_water_mark}
+
+    def _rewrite(self, query: str, mart: dict) -> str:
+        """
+        เขียน aggregate query ใหม่ให้อ่านจาก mart หรือคืนค่า None ถ้า mart นี้ตอบ query ไม่ได้
+        """
+        match = _AGGREGATE_QUERY.match(query)
+        if not match or match.group("table").lower() != mart["source_table"].lower():
+            return None
+        dimensions = {d.lower() for d in mart["dimensions"]}
+        columns = {measure_column(m) for m in mart["measures"]}
+        unsupported = []
+
+        def substitute(text_part: str) -> str:
+            def replace(agg):
+                func, arg = agg.group(1).lower(), agg.group(2).lower()
+                suffix = "all" if arg == "*" else arg
+                if func == "avg":
+                    if f"sum_{suffix}" in columns and f"count_{suffix}" in columns:
+                        return f"(SUM(sum_{suffix}) * 1.0 / SUM(count_{suffix}))"
+                elif f"{func}_{suffix}" in columns:
+                    if func == "count":
+                        return f"COALESCE(SUM(count_{suffix}), 0)"
+                    return f"{'SUM' if func == 'sum' else func.upper()}({func}_{suffix})"
+                unsupported.append(agg.group(0))
+                return agg.group(0)
+            return _AGGREGATE_CALL.sub(replace, text_part)
+
+        aliases, select_items, has_aggregate = set(), [], False
+        for item in _split_top_level(match.group("select")):
+            alias_match = _ALIAS.match(item)
+            expr, alias = (alias_match.group("expr").strip(), alias_match.group("alias")) if alias_match else (item, None)
+            if alias:
+                aliases.add(alias.strip('"').lower())
+            if _AGGREGATE_CALL.search(expr):
+                has_aggregate = True
+                output_name = alias or '"' + expr.replace('"', '""') + '"' # คงชื่อคอลัมน์ผลลัพธ์ให้เหมือนเดิม
+                select_items.append(f"{substitute(expr)} AS {output_name}")
+            elif expr.lower() in dimensions:
+                select_items.append(item)
+            else:
+                return None
+        if not has_aggregate:
+            return None
+
+        parts = {key: match.group(key) for key in ("where", "group", "having", "order", "limit")}
+        for key in ("having", "order"):
+            if parts[key]:
+                parts[key] = substitute(parts[key])
+        if unsupported:
+            return None
+        # WHERE/GROUP BY อ้างถึงได้เฉพาะ dimension (alias ของผลลัพธ์ใช้ได้แค่ใน HAVING/ORDER BY)
+        allowed = {
+            "where": dimensions | _SQL_KEYWORDS,
+            "group": dimensions | _SQL_KEYWORDS,
+            "having": dimensions | columns | aliases | _SQL_KEYWORDS,
+            "order": dimensions | columns | aliases | _SQL_KEYWORDS,
+        }
+        for key, names in allowed.items():
+            if parts[key] and any(word.lower() not in names for word in _WORD.findall(_STRING_LITERAL.sub("''", parts[key]))):
+                return None
+        if parts["group"] and any(g.lower() not in dimensions for g in _split_top_level(parts["group"])):
+            return None
+
+        rewritten = f"SELECT {', '.join(select_items)} FROM {mart['mart_name']}"
+        for key, keyword in (("where", "WHERE"), ("group", "GROUP BY"), ("having", "HAVING"), ("order", "ORDER BY"), ("limit", "LIMIT")):
+            if parts[key]:
+                rewritten += f" {keyword} {parts[key]}"
+        return rewritten
+
+    def _is_stale(self, connect, mart: dict) -> bool:
+        with connect() as connection:
+            latest = connection.exec_driver_sql(f"SELECT MAX({mart['change_column']}) FROM {mart['source_table']}").scalar()
+        return latest is not None and (mart.get("high_water_mark") is None or latest > mart["high_water_mark"])
+
+    def _schedule_refresh(self, database_url: str, connect, mart_name: str):
+        """
+        refresh mart ใน background thread (ครั้งละหนึ่งงานต่อ mart) เพื่อให้ query ถัดไปกลับมาอ่านจาก mart ได้
+        """
+        key = (database_url, mart_name)
+        with self._lock:
+            if not config.MART_BACKGROUND_REFRESH or key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(database_url, connect, mart_name)
+            except Exception as e:
+                # mart ยังไม่ถูกใช้จนกว่าจะ refresh สำเร็จ (stage refresh_mart หรือ query ถัดไปจะลองใหม่แบบเต็ม)
+                with self._lock:
+                    self._dirty.add(key)
+                    self._stats["refresh_failures"] += 1
+                    self._stats["last_refresh_error"] = f"{mart_name}: {e}"
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        threading.Thread(target=run, name=f"mart-refresh-{mart_name}", daemon=True).start()
+
+    def route(self, database_url: str, connect, query: str):
+        """
+        คืนค่า query ที่เขียนใหม่ให้อ่านจาก mart ที่เล็กที่สุดที่ตอบได้ หรือ None ถ้าไม่มี mart ที่ตรง
+
+        route() อยู่บนเส้นทางอ่านจึงไม่ refresh เอง: mart ที่ต้อง refresh แบบเต็ม (dirty) หรือตารางต้นทางมีแถวใหม่
+        กว่า high-water mark จะไม่ถูกใช้ (query รันบนตารางต้นทางแทน) และถูกส่งไป refresh ใน background
+        """
+        stripped = _STRING_LITERAL.sub("''", query)
+        if _UNSUPPORTED.search(_after_first_select(stripped)) or '"' in _remove_aliases(stripped):
+            return None
+        with self._lock:
+            marts = self.marts(database_url, connect)
+            candidates = []
+            for mart in marts.values():
+                rewritten = self._rewrite(query, mart)
+                if rewritten is not None:
+                    dirty = (database_url, mart["mart_name"]) in self._dirty
+                    candidates.append((mart.get("row_count") or 0, mart["mart_name"], rewritten, dirty, mart))
+
+        for _, mart_name, rewritten, dirty, mart in sorted(candidates, key=lambda c: c[:2]):
+            if dirty or self._is_stale(connect, mart):
+                self._schedule_refresh(database_url, connect, mart_name)
+                continue
+            with self._lock:
+                self._stats["routed"] += 1
+            return rewritten
+        with self._lock:
+            self._stats["not_routed"] += 1
+            if candidates:
+                self._stats["stale_skips"] += 1
+        return None
+
+    def notify_write(self, database_url: str, tables, inserts_only: bool = False):
+        """
+        แจ้งว่ามีการเขียนตาราง: การ UPDATE/DELETE ตารางต้นทางทำให้ mart ต้อง refresh แบบเต็ม
+        การเขียนตาราง mart หรือ mart_catalog โดยตรงทำให้ต้องโหลด catalog ใหม่
+        """
+        tables = {t.lower() for t in (tables or ())}
+        with self._lock:
+            marts = self._marts.get(database_url)
+            if marts is None:
+                return
+            if "mart_catalog" in tables:
+                self._marts.pop(database_url, None)
+                return
+            for mart in marts.values():
+                if mart["mart_name"].lower() in tables or (mart["source_table"].lower() in tables and not inserts_only):
+                    self._dirty.add((database_url, mart["mart_name"]))
+
+    def invalidate(self, database_url: str):
+        with self._lock:
+            self._marts.pop(database_url, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            routed = self._stats["routed"] + self._stats["not_routed"]
+            return {**self._stats, "route_rate": round(self._stats["routed"] / routed, 4) if routed else 0.0}
+
+# Catalog ที่ใช้ร่วมกันทั้ง process
+mart_catalog = MartCatalog()
@@ -0,0 +1,66 @@
+# tools/mart_tools.py
+import json
+
+from tools.db_tools import db_connection
+from tools.mart_catalog import mart_catalog
+
+def create_data_mart(database_url: str, mart_name: str, dimensions_json: str, measures_json: str,
+                     source_table: str = "fact_sales", change_column: str = "sale_id"):
+    """
+    สร้าง data mart แบบ materialised (ตารางสรุปยอดล่วงหน้า) และบันทึกลง mart catalog
+    aggregate query บน source_table ที่ mart ตอบได้จะถูกส่งไปอ่านจาก mart โดยอัตโนมัติ
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        mart_name (str): ชื่อตาราง mart เช่น 'mart_daily_sales'
+        dimensions_json (str): JSON list ของคอลัมน์ที่ใช้ group by เช่น '["sale_date", "customer_key", "product_id"]'
+        measures_json (str): JSON list ของ aggregate เช่น '["sum(amount)", "count(*)", "count(amount)"]'
+        source_table (str): ตาราง fact ต้นทาง
+        change_column (str): คอลัมน์ที่เพิ่มขึ้นเสมอเมื่อมีแถวใหม่ (ใช้ refresh แบบ incremental)
+
+    Returns:
+        str: สรุปผลการสร้าง mart หรือข้อผิดพลาด
+    """
+    try:
+        stats = mart_catalog.create(
+            database_url, lambda: db_connection(database_url), mart_name, source_table,
+            json.loads(dimensions_json), json.loads(measures_json), change_column,
+        )
+        return f"Data mart '{mart_name}' created from '{source_table}' with {stats['row_count']} rows."
+    except Exception as e:
+        return f"Error creating data mart '{mart_name}': {str(e)}"
+
+def refresh_data_mart(database_url: str, mart_name: str, full_refresh: bool = False):
+    """
+    Refresh data mart จากแถวใหม่ของตารางต้นทาง (หรือสร้างใหม่ทั้งหมดถ้า full_refresh เป็น True)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        mart_name (str): ชื่อ mart
+        full_refresh (bool): สร้าง mart ใหม่ทั้งตารางแทนการ refresh แบบ incremental
+
+    Returns:
+        str: สรุปผลการ refresh หรือข้อผิดพลาด
+    """
+    try:
+        stats = mart_catalog.refresh(database_url, lambda: db_connection(database_url), mart_name, full=full_refresh)
+        return (f"Data mart '{mart_name}' refreshed ({stats['mode']}): {stats['row_count']} rows, "
+                f"high-water mark {stats['high_water_mark']}.")
+    except Exception as e:
+        return f"Error refreshing data mart '{mart_name}': {str(e)}"
+
+def list_data_marts(database_url: str):
+    """
+    แสดงรายการ data mart ทั้งหมดใน catalog (ตารางต้นทาง, dimensions, measures, จำนวนแถว, เวลาที่ refresh ล่าสุด)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+
+    Returns:
+        str: JSON ของ mart ทั้งหมด หรือข้อผิดพลาด
+    """
+    try:
+        marts = mart_catalog.marts(database_url, lambda: db_connection(database_url))
+        return json.dumps(list(marts.values()), ensure_ascii=False, default=str)
+    except Exception as e:
+        return f"Error listing data marts: {str(e)}"
@@ -0,0 +1,390 @@
+# tools/pipeline.py
+"""
+Pipeline แบบ DAG ที่ประกาศเป็นข้อมูล (JSON) และตัว scheduler สำหรับรัน pipeline
+
+ตัวอย่างนิยาม:
+    {"name": "daily_sales", "stages": [
+        {"name": "load_customers", "type": "load_csv", "file_path": "data/customers.csv", "target": "stg_customers",
+         "upsert": true, "key_columns": ["customer_id"]},
+        {"name": "load_sales", "type": "load_csv", "file_path": "data/sales.csv", "target": "stg_sales",
+         "upsert": true, "key_columns": ["order_id"]},
+        {"name": "dim_customer", "type": "scd2", "depends_on": ["load_customers"]},
+        {"name": "fact_sales", "type": "load_fact", "depends_on": ["load_sales", "dim_customer"]},
+        {"name": "daily_mart", "type": "refresh_mart", "mart": "mart_daily_sales", "depends_on": ["fact_sales"]}
+    ]}
+
+- stage ที่ไม่ขึ้นต่อกันรันพร้อมกันบน thread pool (งานส่วนใหญ่อยู่ใน SQLite/pandas จึงไม่ติด GIL)
+- stage ที่ input (ไฟล์/ตาราง) และนิยามไม่เปลี่ยนตั้งแต่รันสำเร็จครั้งล่าสุดจะถูกข้าม
+- stage ที่ล้มเหลวจะถูกรันซ้ำตามจำนวน retries (หน่วงเวลาเพิ่มขึ้นแบบ exponential) stage ที่ขึ้นกับมันจะถูก block
+  ยกเว้นข้อผิดพลาดที่รันซ้ำก็ไม่หาย (นิยาม/ข้อมูลไม่ถูกต้อง เช่น ValueError, ไม่พบไฟล์) ซึ่งล้มเหลวทันที
+- stage load_csv/load_parquet ที่ upsert ใช้ key_columns (ค่าเริ่มต้นคือ Primary Key ของตารางปลายทาง)
+- นิยาม, สถานะของแต่ละ stage และประวัติการรันเก็บในตาราง pipelines, pipeline_stage_state, pipeline_runs
+"""
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from sqlalchemy import inspect, text
+from datetime import datetime
+import contextvars
+import hashlib
+import time
+import json
+import uuid
+import os
+import re
+
+from tools.db_tools import db_connection, execute_sql_query
+from tools.file_tools import ingest_csv, ingest_arrow, export_table_to_arrow
+from tools.warehouse_tools import merge_scd2, load_fact_incremental
+from tools.mart_catalog import mart_catalog
+from tools.table_profiler import table_profiler
+from tools.query_cache import query_cache
+from tools.tracing import tracer
+from tools.write_queue import write_queue
+import config
+
+_NAME = re.compile(r"^[a-z_][\w\-]*$", re.IGNORECASE)
+# data version ของตารางใน query_cache นับเฉพาะภายใน process นี้ จึงใส่ token ของ process ไว้ใน fingerprint ด้วย
+# (หลังเริ่ม process ใหม่ stage ที่อ่านตารางจะรันใหม่หนึ่งครั้งเสมอ ส่วน stage ที่อ่านไฟล์ข้ามได้ตามปกติ)
+_PROCESS_TOKEN = os.urandom(6).hex()
+_storage_ready = set()
+# ข้อผิดพลาดที่เกิดซ้ำทุกครั้งกับ input เดิม จึงไม่ retry
+_PERMANENT_ERRORS = (ValueError, TypeError, KeyError, FileNotFoundError, ImportError)
+
+def _connect(database_url: str):
+    return lambda: db_connection(database_url)
+
+def _run_load_csv(database_url: str, stage: dict) -> dict:
+    return ingest_csv(database_url, stage["target"], stage["file_path"], upsert=stage.get("upsert", False),
+                      key_columns=stage.get("key_columns"))
+
+def _run_load_parquet(database_url: str, stage: dict) -> dict:
+    return ingest_arrow(database_url, stage["target"], stage["file_path"], columns=stage.get("columns"),
+                        filters=[tuple(f) for f in stage["filters"]] if stage.get("filters") else None,
+                        upsert=stage.get("upsert", False), key_columns=stage.get("key_columns"))
+
+def _run_scd2(database_url: str, stage: dict) -> dict:
+    return merge_scd2(database_url, stage.get("source", "stg_customers"), stage.get("target", "dim_customer"),
+                      stage.get("business_key", "customer_id"), stage.get("tracked_columns"),
+                      close_missing=stage.get("close_missing", False))
+
+def _run_load_fact(database_url: str, stage: dict) -> dict:
+    return load_fact_incremental(database_url, stage.get("source", "stg_sales"), stage.get("target", "fact_sales"),
+                                 stage.get("dimension", "dim_customer"), lookback=stage.get("lookback"), full_reload=stage.get("full_reload", False))
+
+def _run_refresh_mart(database_url: str, stage: dict) -> dict:
+    return mart_catalog.refresh(database_url, _connect(database_url), stage["mart"], full=stage.get("full", False))
+
+def _run_export_parquet(database_url: str, stage: dict) -> dict:
+    return export_table_to_arrow(database_url, stage["table"], stage["file_path"], columns=stage.get("columns"))
+
+def _run_sql(database_url: str, stage: dict) -> dict:
+    statements = stage["sql"] if isinstance(stage["sql"], list) else [stage["sql"]]
+    outputs = []
+    for statement in statements:
+        # ผ่าน execute_sql_query เพื่อให้ query cache / schema catalog / data mart รับรู้การเขียน
+        output = execute_sql_query(database_url, statement)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+        outputs.append(output[:200])
+    return {"statements": len(statements), "outputs": outputs}
+
+def _run_profile(database_url: str, stage: dict) -> dict:
+    profile = table_profiler.profile(database_url, _connect(database_url), stage["table"], full=stage.get("full", False))
+    return {key: profile[key] for key in ("mode", "row_count", "rows_scanned", "seconds")}
+
+def _mart_source(database_url: str, stage: dict) -> list:
+    definition = mart_catalog.marts(database_url, _connect(database_url)).get(stage["mart"])
+    return [definition["source_table"]] if definition else []
+
+# type -> (คีย์ที่ต้องมี, ฟังก์ชันที่รัน, ฟังก์ชันที่คืน input เริ่มต้น: ตารางหรือ "file:<path>")
+STAGE_TYPES = {
+    "load_csv": (("file_path", "target"), _run_load_csv, lambda url, s: [f"file:{s['file_path']}"]),
+    "load_parquet": (("file_path", "target"), _run_load_parquet, lambda url, s: [f"file:{s['file_path']}"]),
+    "scd2": ((), _run_scd2, lambda url, s: [s.get("source", "stg_customers")]),
+    "load_fact": ((), _run_load_fact, lambda url, s: [s.get("source", "stg_sales"), s.get("dimension", "dim_customer")]),
+    "refresh_mart": (("mart",), _run_refresh_mart, _mart_source),
+    "export_parquet": (("table", "file_path"), _run_export_parquet, lambda url, s: [s["table"]]),
+    "profile": (("table",), _run_profile, lambda url, s: [s["table"]]),
+    "sql": (("sql",), _run_sql, lambda url, s: []),
+}
+
+def validate_pipeline(definition: dict) -> dict:
+    """
+    ตรวจสอบนิยาม pipeline (ชื่อ, type ของ stage, คีย์ที่จำเป็น, depends_on และ cycle)
+
+    Returns:
+        dict: นิยามที่ตรวจแล้ว โดย stage เรียงตามลำดับ topological
+    """
+    name = definition.get("name")
+    if not name or not _NAME.match(str(name)):
+        raise ValueError(f"ชื่อ pipeline ไม่ถูกต้อง: {name!r}")
+    stages = definition.get("stages")
+    if not isinstance(stages, list) or not stages:
+        raise ValueError("pipeline ต้องมี stages อย่างน้อยหนึ่ง stage")
+
+    by_name = {}
+    for stage in stages:
+        stage_name, stage_type = stage.get("name"), stage.get("type")
+        if not stage_name or not _NAME.match(str(stage_name)):
+            raise ValueError(f"ชื่อ stage ไม่ถูกต้อง: {stage_name!r}")
+        if stage_name in by_name:
+            raise ValueError(f"ชื่อ stage ซ้ำ: '{stage_name}'")
+        if stage_type not in STAGE_TYPES:
+            raise ValueError(f"stage '{stage_name}': type '{stage_type}' ไม่รองรับ (รองรับ: {', '.join(STAGE_TYPES)})")
+        missing = [key for key in STAGE_TYPES[stage_type][0] if not stage.get(key)]
+        if missing:
+            raise ValueError(f"stage '{stage_name}' ({stage_type}) ต้องมี: {', '.join(missing)}")
+        by_name[stage_name] = {**stage, "depends_on": list(stage.get("depends_on") or [])}
+
+    for stage in by_name.values():
+        unknown = [d for d in stage["depends_on"] if d not in by_name]
+        if unknown:
+            raise ValueError(f"stage '{stage['name']}' ขึ้นกับ stage ที่ไม่มีอยู่: {', '.join(unknown)}")
+
+    # Kahn's algorithm: เรียงลำดับและตรวจ cycle
+    pending = {n: len(s["depends_on"]) for n, s in by_name.items()}
+    ordered = []
+    ready = [n for n in by_name if pending[n] == 0]
+    while ready:
+        current = ready.pop(0)
+        ordered.append(by_name[current])
+        for other in by_name.values():
+            if current in other["depends_on"]:
+                pending[other["name"]] -= 1
+                if pending[other["name"]] == 0:
+                    ready.append(other["name"])
+    if len(ordered) != len(by_name):
+        cyclic = sorted(n for n, count in pending.items() if count > 0)
+        raise ValueError(f"pipeline มี dependency แบบวน (cycle): {', '.join(cyclic)}")
+    return {**definition, "stages": ordered}
+
+def _input_state(connection, database_url: str, ref: str):
+    if ref.startswith("file:"):
+        try:
+            stat = os.stat(ref[5:])
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+    if not inspect(connection).has_table(ref):
+        return None
+    max_rowid = connection.exec_driver_sql(f'SELECT max(rowid) FROM "{ref}"').scalar() if connection.dialect.name == "sqlite" else None
+    return [_PROCESS_TOKEN, list(query_cache.table_version(database_url, ref)), max_rowid]
+
+def stage_fingerprint(database_url: str, stage: dict) -> tuple:
+    """
+    คำนวณ fingerprint ของ stage จากนิยามของ stage และสถานะปัจจุบันของ input ทุกตัว
+    คืนค่า (fingerprint, inputs) โดย fingerprint เป็น None ถ้า stage ไม่มี input ที่ตรวจได้ (ต้องรันทุกครั้ง)
+    """
+    inputs = STAGE_TYPES[stage["type"]][2](database_url, stage) + list(stage.get("inputs") or [])
+    if not inputs:
+        return None, []
+    with db_connection(database_url) as connection:
+        states = {ref: _input_state(connection, database_url, ref) for ref in inputs}
+    definition = {k: v for k, v in stage.items() if k not in ("depends_on", "retries")}
+    payload = json.dumps({"stage": definition, "inputs": states}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest(), inputs
+
+def _ensure_tables(connection):
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS pipelines (name TEXT PRIMARY KEY, definition TEXT NOT NULL, updated_at TEXT)"
+    )
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS pipeline_stage_state ("
+        "pipeline TEXT NOT NULL, stage TEXT NOT NULL, fingerprint TEXT, status TEXT, duration_ms REAL, finished_at TEXT, "
+        "PRIMARY KEY (pipeline, stage))"
+    )
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS pipeline_runs ("
+        "run_id TEXT PRIMARY KEY, pipeline TEXT NOT NULL, status TEXT, started_at TEXT, duration_ms REAL, report TEXT)"
+    )
+
+def _ensure_storage(database_url: str):
+    # สร้างตารางของ pipeline ผ่าน writer ครั้งเดียวต่อฐานข้อมูลต่อ process (การอ่านหลังจากนั้นไม่ต้องเขียน)
+    if database_url not in _storage_ready:
+        write_queue.submit(database_url, _connect(database_url), _ensure_tables)
+        _storage_ready.add(database_url)
+
+def save_pipeline(database_url: str, definition: dict) -> dict:
+    """
+    ตรวจสอบและบันทึกนิยาม pipeline (แทนที่นิยามเดิมที่ชื่อเดียวกัน)
+    """
+    definition = validate_pipeline(definition)
+
+    def save(connection):
+        _ensure_tables(connection)
+        connection.execute(text(
+            "INSERT INTO pipelines (name, definition, updated_at) VALUES (:name, :definition, :updated_at) "
+            "ON CONFLICT (name) DO UPDATE SET definition = excluded.definition, updated_at = excluded.updated_at"
+        ), {"name": definition["name"], "definition": json.dumps(definition, ensure_ascii=False),
+            "updated_at": datetime.now().isoformat(timespec="seconds")})
+    write_queue.submit(database_url, _connect(database_url), save)
+    query_cache.invalidate_tables(database_url, ["pipelines"])
+    return definition
+
+def load_pipeline(database_url: str, name: str) -> dict:
+    _ensure_storage(database_url)
+    with db_connection(database_url) as connection:
+        row = connection.execute(text("SELECT definition FROM pipelines WHERE name = :name"), {"name": name}).fetchone()
+    if row is None:
+        raise ValueError(f"ไม่พบ pipeline '{name}'")
+    return json.loads(row[0])
+
+def list_pipeline_definitions(database_url: str) -> list:
+    _ensure_storage(database_url)
+    with db_connection(database_url) as connection:
+        rows = connection.execute(text(
+            "SELECT p.name, p.definition, p.updated_at, r.status AS last_status, r.started_at AS last_run_at, r.duration_ms AS last_duration_ms "
+            "FROM pipelines p LEFT JOIN pipeline_runs r ON r.run_id = ("
+            "  SELECT run_id FROM pipeline_runs WHERE pipeline = p.name ORDER BY started_at DESC LIMIT 1) "
+            "ORDER BY p.name"
+        )).mappings().all()
+    return [{**row, "definition": json.loads(row["definition"])} for row in rows]
+
+def pipeline_runs(database_url: str, name: str = None, limit: int = 5) -> list:
+    _ensure_storage(database_url)
+    with db_connection(database_url) as connection:
+        rows = connection.execute(text(
+            "SELECT run_id, pipeline, status, started_at, duration_ms, report FROM pipeline_runs "
+            "WHERE (:name IS NULL OR pipeline = :name) ORDER BY started_at DESC LIMIT :limit"
+        ), {"name": name, "limit": limit}).mappings().all()
+    return [{**row, "report": json.loads(row["report"])} for row in rows]
+
+def _stage_states(database_url: str, pipeline: str) -> dict:
+    _ensure_storage(database_url)
+    with db_connection(database_url) as connection:
+        rows = connection.execute(text(
+            "SELECT stage, fingerprint, status FROM pipeline_stage_state WHERE pipeline = :pipeline"
+        ), {"pipeline": pipeline}).mappings().all()
+    return {row["stage"]: row for row in rows}
+
+def _run_stage(database_url: str, pipeline: str, stage: dict, previous, force: bool) -> dict:
+    """
+    รัน stage หนึ่ง stage (ข้ามถ้า input ไม่เปลี่ยน, รันซ้ำเมื่อล้มเหลว) และคืนผลลัพธ์ของ stage
+    """
+    started = time.perf_counter()
+    result = {"stage": stage["name"], "type": stage["type"], "started_at": datetime.now().isoformat(timespec="milliseconds")}
+    with tracer.span(f"stage:{stage['name']}", "pipeline", pipeline=pipeline, stage_type=stage["type"]) as span:
+        fingerprint, inputs = stage_fingerprint(database_url, stage)
+        result["inputs"] = inputs
+        if not force and fingerprint is not None and previous is not None \
+                and previous["status"] == "success" and previous["fingerprint"] == fingerprint:
+            span.set(skipped=True)
+            result.update(status="skipped", reason="inputs unchanged", attempts=0, fingerprint=fingerprint,
+                          duration_ms=round((time.perf_counter() - started) * 1000, 3))
+            return result
+
+        retries = stage.get("retries", config.PIPELINE_MAX_RETRIES)
+        runner = STAGE_TYPES[stage["type"]][1]
+        for attempt in range(1, retries + 2):
+            try:
+                result.update(status="success", stats=runner(database_url, stage), attempts=attempt)
+                result.pop("error", None)
+                break
+            except Exception as e:
+                result.update(status="failed", error=f"{type(e).__name__}: {e}", attempts=attempt)
+                if isinstance(e, _PERMANENT_ERRORS):
+                    break
+                if attempt <= retries:
+                    time.sleep(config.PIPELINE_RETRY_BACKOFF_S * (2 ** (attempt - 1)))
+        span.set(status=result["status"], attempts=result["attempts"])
+    result["fingerprint"] = fingerprint
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+def run_pipeline(database_url: str, pipeline, force: bool = False, max_workers: int = None) -> dict:
+    """
+    รัน pipeline ตามลำดับ dependency โดย stage ที่พร้อมและไม่ขึ้นต่อกันรันพร้อมกัน
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        pipeline: ชื่อ pipeline ที่บันทึกไว้ หรือนิยาม pipeline (dict)
+        force (bool): รันทุก stage แม้ว่า input จะไม่เปลี่ยน
+        max_workers (int): จำนวน stage สูงสุดที่รันพร้อมกัน
+
+    Returns:
+        dict: รายงานการรัน (status, เวลา และผลลัพธ์ของแต่ละ stage)
+    """
+    definition = validate_pipeline(load_pipeline(database_url, pipeline) if isinstance(pipeline, str) else pipeline)
+    name = definition["name"]
+    stages = {stage["name"]: stage for stage in definition["stages"]}
+    dependents = {n: [s["name"] for s in stages.values() if n in s["depends_on"]] for n in stages}
+    waiting = {n: len(s["depends_on"]) for n, s in stages.items()}
+    previous = _stage_states(database_url, name)
+    max_workers = max_workers or config.PIPELINE_MAX_WORKERS
+    run_id = uuid.uuid4().hex[:12]
+    started_at = datetime.now().isoformat(timespec="seconds")
+    started = time.perf_counter()
+    results = {}
+    peak_parallel = 0
+
+    with tracer.span(f"pipeline:{name}", "pipeline", run_id=run_id, stages=len(stages)) as root_span, \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline") as pool:
+        running = {}
+        ready = [n for n, count in waiting.items() if count == 0]
+        while ready or running:
+            while ready:
+                stage_name = ready.pop(0)
+                failed_upstream = [d for d in stages[stage_name]["depends_on"] if results[d]["status"] in ("failed", "blocked")]
+                if failed_upstream:
+                    results[stage_name] = {"stage": stage_name, "type": stages[stage_name]["type"], "status": "blocked",
+                                           "reason": f"upstream failed: {', '.join(failed_upstream)}", "attempts": 0, "duration_ms": 0.0}
+                    for dependent in dependents[stage_name]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            ready.append(dependent)
+                    continue
+                future = pool.submit(contextvars.copy_context().run, _run_stage, database_url, name,
+                                     stages[stage_name], previous.get(stage_name), force)
+                running[future] = stage_name
+            peak_parallel = max(peak_parallel, len(running))
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage_name = running.pop(future)
+                results[stage_name] = future.result()
+                for dependent in dependents[stage_name]:
+                    waiting[dependent] -= 1
+                    if waiting[dependent] == 0:
+                        ready.append(dependent)
+
+        statuses = {r["status"] for r in results.values()}
+        status = "failed" if statuses & {"failed", "blocked"} else "success"
+        root_span.set(status=status)
+
+    report = {
+        "run_id": run_id,
+        "pipeline": name,
+        "status": status,
+        "started_at": started_at,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        "max_workers": max_workers,
+        "peak_parallel_stages": peak_parallel,
+        "stages": [results[n] for n in stages],
+        "summary": {s: sum(1 for r in results.values() if r["status"] == s) for s in ("success", "skipped", "failed", "blocked")},
+    }
+    _record_run(database_url, report)
+    return report
+
+def _record_run(database_url: str, report: dict):
+    finished_at = datetime.now().isoformat(timespec="seconds")
+
+    def record(connection):
+        _ensure_tables(connection)
+        for result in report["stages"]:
+            if result["status"] not in ("success", "failed"):
+                continue
+            connection.execute(text(
+                "INSERT INTO pipeline_stage_state (pipeline, stage, fingerprint, status, duration_ms, finished_at) "
+                "VALUES (:pipeline, :stage, :fingerprint, :status, :duration_ms, :finished_at) "
+                "ON CONFLICT (pipeline, stage) DO UPDATE SET fingerprint = excluded.fingerprint, status = excluded.status, "
+                "duration_ms = excluded.duration_ms, finished_at = excluded.finished_at"
+            ), {"pipeline": report["pipeline"], "stage": result["stage"], "fingerprint": result.get("fingerprint"),
+                "status": result["status"], "duration_ms": result["duration_ms"], "finished_at": finished_at})
+        connection.execute(text(
+            "INSERT INTO pipeline_runs (run_id, pipeline, status, started_at, duration_ms, report) "
+            "VALUES (:run_id, :pipeline, :status, :started_at, :duration_ms, :report)"
+        ), {"run_id": report["run_id"], "pipeline": report["pipeline"], "status": report["status"],
+            "started_at": report["started_at"], "duration_ms": report["duration_ms"],
+            "report": json.dumps(report, ensure_ascii=False, default=str)})
+    write_queue.submit(database_url, _connect(database_url), record)
+    query_cache.invalidate_tables(database_url, ["pipeline_stage_state", "pipeline_runs"])
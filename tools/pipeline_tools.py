@@ -0,0 +1,97 @@
+# tools/pipeline_tools.py
+import json
+
+from tools.pipeline import save_pipeline, run_pipeline, list_pipeline_definitions, pipeline_runs
+
+def _stage_line(result: dict) -> str:
+    line = f"- {result['stage']} ({result['type']}): {result['status']} in {result['duration_ms']} ms"
+    if result.get("attempts", 0) > 1:
+        line += f" after {result['attempts']} attempts"
+    if result.get("error"):
+        line += f" — {result['error']}"
+    elif result.get("reason"):
+        line += f" — {result['reason']}"
+    return line
+
+def create_pipeline(database_url: str, pipeline_name: str, stages_json: str):
+    """
+    สร้างหรือแก้ไข pipeline แบบ DAG (stage, dependency และตารางปลายทาง) แล้วบันทึกลงฐานข้อมูล
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        pipeline_name (str): ชื่อ pipeline เช่น 'daily_sales'
+        stages_json (str): JSON list ของ stage แต่ละ stage มี name, type, depends_on และคีย์ตาม type เช่น
+            '[{"name": "load_sales", "type": "load_csv", "file_path": "data/sales.csv", "target": "stg_sales"},
+              {"name": "fact", "type": "load_fact", "depends_on": ["load_sales"]}]'
+            type ที่รองรับ: load_csv, load_parquet, scd2, load_fact, refresh_mart, export_parquet, profile, sql
+
+    Returns:
+        str: สรุปนิยาม pipeline ที่บันทึก หรือข้อผิดพลาด
+    """
+    try:
+        definition = save_pipeline(database_url, {"name": pipeline_name, "stages": json.loads(stages_json)})
+        order = " -> ".join(stage["name"] for stage in definition["stages"])
+        return f"Pipeline '{pipeline_name}' saved with {len(definition['stages'])} stages (topological order: {order})."
+    except Exception as e:
+        return f"Error creating pipeline '{pipeline_name}': {str(e)}"
+
+def run_data_pipeline(database_url: str, pipeline_name: str, force: bool = False):
+    """
+    รัน pipeline ที่บันทึกไว้: stage ที่ไม่ขึ้นต่อกันรันพร้อมกัน, ข้าม stage ที่ input ไม่เปลี่ยน และรันซ้ำเมื่อล้มเหลว
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        pipeline_name (str): ชื่อ pipeline
+        force (bool): รันทุก stage แม้ว่า input จะไม่เปลี่ยน
+
+    Returns:
+        str: สถานะและเวลาของแต่ละ stage หรือข้อผิดพลาด
+    """
+    try:
+        report = run_pipeline(database_url, pipeline_name, force=force)
+        summary = ", ".join(f"{count} {status}" for status, count in report["summary"].items() if count)
+        lines = [f"Pipeline '{pipeline_name}' run {report['run_id']}: {report['status']} in {report['duration_ms']} ms "
+                 f"({summary}; up to {report['peak_parallel_stages']} stages in parallel)."]
+        lines.extend(_stage_line(result) for result in report["stages"])
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error running pipeline '{pipeline_name}': {str(e)}"
+
+def list_pipelines(database_url: str):
+    """
+    แสดงรายการ pipeline ทั้งหมด (stage, dependency และสถานะของการรันล่าสุด)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+
+    Returns:
+        str: JSON ของ pipeline ทั้งหมด หรือข้อผิดพลาด
+    """
+    try:
+        return json.dumps(list_pipeline_definitions(database_url), ensure_ascii=False, default=str)
+    except Exception as e:
+        return f"Error listing pipelines: {str(e)}"
+
+def get_pipeline_runs(database_url: str, pipeline_name: str = "", limit: int = 5):
+    """
+    แสดงประวัติการรัน pipeline ล่าสุดพร้อมเวลาของแต่ละ stage
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        pipeline_name (str): ชื่อ pipeline (ว่าง = ทุก pipeline)
+        limit (int): จำนวนการรันล่าสุดที่ต้องการ
+
+    Returns:
+        str: สรุปการรันแต่ละครั้ง หรือข้อผิดพลาด
+    """
+    try:
+        runs = pipeline_runs(database_url, pipeline_name or None, int(limit))
+        if not runs:
+            return "No pipeline runs recorded."
+        lines = []
+        for run in runs:
+            lines.append(f"Run {run['run_id']} of '{run['pipeline']}' at {run['started_at']}: {run['status']} in {run['duration_ms']} ms")
+            lines.extend(_stage_line(result) for result in run["report"]["stages"])
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error reading pipeline runs: {str(e)}"
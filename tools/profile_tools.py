@@ -0,0 +1,63 @@
+# tools/profile_tools.py
+import json
+
+from tools.db_tools import db_connection
+from tools.table_profiler import table_profiler
+
+def profile_table(database_url: str, table_name: str, full_refresh: bool = False):
+    """
+    คำนวณ profile ของตาราง (จำนวนแถว, null, min/max, distinct โดยประมาณ, ค่าที่พบบ่อย, histogram) และบันทึกลง catalog
+    ถ้ามีเพียงแถวใหม่ต่อท้ายจะอ่านเฉพาะแถวใหม่ (incremental)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        table_name (str): ชื่อตาราง
+        full_refresh (bool): อ่านทั้งตารางใหม่แทนการ refresh แบบ incremental
+            (ใช้หลัง UPDATE จาก process อื่นซึ่ง profiler ตรวจไม่พบ)
+
+    Returns:
+        str: สรุปผลการ profile หรือข้อผิดพลาด
+    """
+    try:
+        profile = table_profiler.profile(database_url, lambda: db_connection(database_url), table_name, full=full_refresh)
+        return (f"Table '{table_name}' profiled ({profile['mode']}): {profile['row_count']} rows, "
+                f"{profile['column_count']} columns, {profile['rows_scanned']} rows scanned in {profile['seconds']}s.")
+    except Exception as e:
+        return f"Error profiling table '{table_name}': {str(e)}"
+
+def get_table_profile(database_url: str, table_name: str, columns_json: str = ""):
+    """
+    อ่าน profile ของตารางจาก catalog แทนการ scan ด้วย COUNT(*)/COUNT(DISTINCT) (refresh ให้อัตโนมัติถ้ามีแถวใหม่)
+    ใช้ประเมินขนาดตาราง, ความเบ้ของข้อมูล, คอลัมน์ที่เหมาะเป็น key และตรวจคุณภาพข้อมูล (null, ค่าผิดปกติ)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        table_name (str): ชื่อตาราง
+        columns_json (str): JSON list ของคอลัมน์ที่ต้องการ (ว่าง = ทุกคอลัมน์)
+
+    Returns:
+        str: JSON ของ profile หรือข้อผิดพลาด
+    """
+    try:
+        profile = table_profiler.profile(database_url, lambda: db_connection(database_url), table_name)
+        if columns_json:
+            wanted = set(json.loads(columns_json))
+            profile = {**profile, "columns": {name: stats for name, stats in profile["columns"].items() if name in wanted}}
+        return json.dumps(profile, ensure_ascii=False, default=str)
+    except Exception as e:
+        return f"Error getting profile for '{table_name}': {str(e)}"
+
+def list_table_profiles(database_url: str):
+    """
+    แสดงรายการตารางที่มี profile ใน catalog (จำนวนแถวและเวลาที่ profile ล่าสุด)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+
+    Returns:
+        str: JSON ของรายการ profile หรือข้อผิดพลาด
+    """
+    try:
+        return json.dumps(table_profiler.profiles(database_url, lambda: db_connection(database_url)), ensure_ascii=False, default=str)
+    except Exception as e:
+        return f"Error listing table profiles: {str(e)}"
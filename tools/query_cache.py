@@ -0,0 +1,199 @@
+# tools/query_cache.py
+from collections import OrderedDict
+from sqlalchemy.engine import make_url
+import threading
+import sqlite3
+import time
+import re
+
+import config
+
+_READ_ONLY_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# คำสั่งเขียนจำแนกจาก keyword นำหน้าคำสั่งเท่านั้น (เช่น REPLACE INTO) ไม่ใช่ชื่อฟังก์ชันอย่าง replace(col, ...)
+# รวม DML หลัง CTE (WITH x AS (...) INSERT ...) ซึ่งตามหลังวงเล็บปิดของ CTE
+_CTE_WRITE = re.compile(r"\)\s*(insert|update|delete|replace)\b", re.IGNORECASE)
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]")
+# ฟังก์ชันที่ให้ผลลัพธ์ต่างกันในแต่ละครั้ง จึงไม่ควร cache
+_NON_DETERMINISTIC = re.compile(
+    r"\b(random|randomblob|now|current_timestamp|current_date|current_time|changes|total_changes|last_insert_rowid)\b"
+    r"|'now'",
+    re.IGNORECASE,
+)
+_SQL_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\S+")
+
+def normalize_sql(query: str) -> str:
+    """
+    ทำให้ SQL อยู่ในรูปแบบมาตรฐานสำหรับใช้เป็น key
+    (ยุบช่องว่างและแปลงเป็นตัวพิมพ์เล็กนอก string literal / quoted identifier และตัด ; ท้ายคำสั่ง)
+    """
+    tokens = _SQL_TOKENS.findall(query.strip().rstrip(";").strip())
+    return " ".join(token if token[0] in "'\"" else token.lower() for token in tokens)
+
+def is_read_only_query(query: str) -> bool:
+    """
+    ตรวจสอบว่าเป็นคำสั่งอ่านอย่างเดียว (SELECT/WITH ที่ไม่มีคำสั่งเขียนข้อมูลซ่อนอยู่)
+    """
+    statements = [part for part in _QUOTED.sub("''", query).split(";") if part.strip()]
+    return bool(statements) and all(
+        _READ_ONLY_PATTERN.match(statement) is not None and _CTE_WRITE.search(statement) is None
+        for statement in statements
+    )
+
+def is_cacheable_query(query: str) -> bool:
+    """
+    Query ที่ cache ได้คือคำสั่งอ่านอย่างเดียวที่ไม่มีฟังก์ชันแบบ non-deterministic
+    """
+    return is_read_only_query(query) and _NON_DETERMINISTIC.search(query) is None
+
+def referenced_tables(query: str, known_tables) -> set:
+    """
+    คืนค่าชื่อตารางที่ query อ้างถึง โดยเทียบ identifier ใน query กับรายชื่อตารางที่รู้จัก
+    (ประมาณค่าเกินได้ ซึ่งปลอดภัยสำหรับการ invalidate)
+    """
+    known = {name.lower(): name for name in known_tables}
+    tokens = set(re.findall(r"\w+", query.lower()))
+    return {known[token] for token in tokens if token in known}
+
+class QueryResultCache:
+    """
+    LRU cache ของผลลัพธ์ Query แบบอ่านอย่างเดียว จำกัดทั้งจำนวน entry และขนาด (bytes)
+    key ประกอบด้วย SQL ที่ normalise แล้ว และ data version ของทุกตารางที่ query อ้างถึง
+
+    การเขียนใน process นี้แจ้งผ่าน invalidate_tables ส่วนการเขียนจาก process อื่นตรวจจาก PRAGMA data_version
+    ของ connection เฉพาะต่อไฟล์ SQLite (ค่าเปลี่ยนเมื่อ connection อื่น commit) ซึ่งล้าง cache ของฐานข้อมูลนั้นทั้งหมด
+    TTL เป็นขอบเขตบนของความล้าสมัยในกรณีที่ตรวจไม่พบ (เช่นการเขียนจากภายนอกที่เกิดพร้อมกับการเขียนใน process นี้)
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl_seconds: float = None):
+        self.max_entries = max_entries if max_entries is not None else config.QUERY_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes if max_bytes is not None else config.QUERY_CACHE_MAX_BYTES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else config.QUERY_CACHE_TTL_SECONDS
+        self._entries = OrderedDict()  # key -> (value, size, tables, stored_at)
+        self._table_versions = {}      # (database_url, table_name) -> version
+        self._watchers = {}            # database_url -> [sqlite3 connection, data_version ล่าสุด]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0,
+                       "external_invalidations": 0}
+
+    def _data_version(self, database_url: str):
+        """
+        PRAGMA data_version ของ connection เฉพาะสำหรับตรวจการเขียนจากภายนอก (None ถ้าไม่ใช่ไฟล์ SQLite)
+        """
+        watcher = self._watchers.get(database_url)
+        if watcher is None:
+            url = make_url(database_url)
+            if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+                return None
+            try:
+                connection = sqlite3.connect(f"file:{url.database}?mode=rw", uri=True, check_same_thread=False)
+            except sqlite3.Error:
+                return None # ไฟล์ยังไม่ถูกสร้าง
+            watcher = self._watchers[database_url] = [connection, None]
+        try:
+            return watcher[0].execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _check_external_writes(self, database_url: str, own_write: bool = False):
+        # เรียกภายใต้ self._lock: data_version ที่เปลี่ยนหลังการตรวจครั้งก่อน = มีการเขียนที่ไม่ได้แจ้งผ่าน invalidate_tables
+        # own_write: ถูกเรียกหลัง commit ของ process นี้ (ค่าที่เปลี่ยนเป็นของการเขียนที่กำลังแจ้ง จึงบันทึกค่าใหม่เท่านั้น)
+        version = self._data_version(database_url)
+        if version is None:
+            return
+        watcher = self._watchers[database_url]
+        if not own_write and watcher[1] is not None and watcher[1] != version:
+            self._bump(database_url, None)
+            self._stats["external_invalidations"] += 1
+        watcher[1] = version
+
+    def _bump(self, database_url: str, tables):
+        for table in (tables or [None]):
+            version_key = (database_url, table)
+            self._table_versions[version_key] = self._table_versions.get(version_key, 0) + 1
+        stale = [
+            key for key, entry in self._entries.items()
+            if key[0] == database_url and (not tables or entry[2] & set(tables))
+        ]
+        for key in stale:
+            self._remove(key)
+
+    def _key(self, database_url: str, query: str, tables: set, variant):
+        versions = tuple(sorted((t, self._table_versions.get((database_url, t), 0)) for t in tables))
+        generation = self._table_versions.get((database_url, None), 0)
+        return (database_url, normalize_sql(query), variant, generation, versions)
+
+    def lookup(self, database_url: str, query: str, tables: set, variant=None):
+        """
+        คืนค่า (key, ผลลัพธ์ที่ cache ไว้ หรือ None)
+        key ถูกสร้างจาก data version ณ ตอนนี้ จึงต้องใช้ key เดิมกับ store() เพื่อไม่ให้เก็บผลลัพธ์ที่ล้าสมัย
+        """
+        with self._lock:
+            self._check_external_writes(database_url)
+            key = self._key(database_url, query, tables, variant)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[3] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return key, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return key, entry[0]
+
+    def store(self, key, tables: set, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, frozenset(tables), time.monotonic())
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        value, size, tables, stored_at = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate_tables(self, database_url: str, tables=None):
+        """
+        เพิ่ม data version ของตารางที่ถูกเขียน และลบผลลัพธ์ที่อ้างถึงตารางเหล่านั้น
+        ถ้าไม่ระบุตาราง จะล้างผลลัพธ์ทั้งหมดของ database_url นี้
+        """
+        with self._lock:
+            self._stats["invalidations"] += 1
+            # tables=None/ว่าง ใช้ version key (database_url, None) ซึ่งมีผลกับทุก query ของฐานข้อมูลนี้
+            self._bump(database_url, tables)
+            self._check_external_writes(database_url, own_write=True)
+
+    def table_version(self, database_url: str, table_name: str) -> tuple:
+        """
+        คืนค่า data version ปัจจุบันของตาราง (ใช้ตรวจว่าสำเนาของตารางที่อื่น เช่นใน analytics engine ยังใหม่อยู่หรือไม่)
+        """
+        with self._lock:
+            self._check_external_writes(database_url)
+            return (self._table_versions.get((database_url, None), 0), self._table_versions.get((database_url, table_name), 0))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes_cached": self._bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+# Cache ที่ใช้ร่วมกันทั้ง process
+query_cache = QueryResultCache()
@@ -0,0 +1,63 @@
+# tools/query_log.py
+from collections import deque
+import threading
+import time
+
+from tools.query_cache import normalize_sql
+import config
+
+class QueryLog:
+    """
+    บันทึกคำสั่ง SQL ที่รันผ่าน execute_sql_query พร้อมเวลาที่ใช้ (เก็บในหน่วยความจำแบบจำกัดจำนวน)
+    ใช้หา query ที่ช้าที่สุดสำหรับ index advisor
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries if max_entries is not None else config.QUERY_LOG_MAX_ENTRIES
+        self._entries = deque(maxlen=self.max_entries)
+        self._lock = threading.Lock()
+
+    def record(self, database_url: str, query: str, executed_query: str, elapsed_ms: float, cached: bool = False, error: bool = False):
+        """
+        บันทึกการรัน query หนึ่งครั้ง (executed_query คือ SQL ที่รันจริง เช่นหลัง route ไปยัง data mart)
+        """
+        with self._lock:
+            self._entries.append({
+                "database_url": database_url,
+                "query": query,
+                "executed_query": executed_query,
+                "elapsed_ms": round(elapsed_ms, 3),
+                "cached": cached,
+                "error": error,
+                "timestamp": time.time(),
+            })
+
+    def entries(self, database_url: str = None) -> list:
+        with self._lock:
+            return [e for e in self._entries if database_url is None or e["database_url"] == database_url]
+
+    def slowest(self, database_url: str, limit: int = 10) -> list:
+        """
+        รวมสถิติตาม SQL ที่รันจริง (normalise แล้ว) และคืนค่ากลุ่มที่ใช้เวลารวมมากที่สุด (ไม่นับ cache hit และ error)
+        """
+        groups = {}
+        for entry in self.entries(database_url):
+            if entry["cached"] or entry["error"]:
+                continue
+            key = normalize_sql(entry["executed_query"])
+            group = groups.setdefault(key, {"query": entry["executed_query"], "calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+            group["calls"] += 1
+            group["total_ms"] += entry["elapsed_ms"]
+            group["max_ms"] = max(group["max_ms"], entry["elapsed_ms"])
+        ranked = sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)[:limit]
+        for group in ranked:
+            group["avg_ms"] = round(group["total_ms"] / group["calls"], 3)
+            group["total_ms"] = round(group["total_ms"], 3)
+        return ranked
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Log ที่ใช้ร่วมกันทั้ง process
+query_log = QueryLog()
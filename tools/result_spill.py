@@ -0,0 +1,83 @@
+# tools/result_spill.py
+from sqlalchemy import text
+import pandas as pd
+import threading
+import time
+import uuid
+
+from tools.db_tools import bulk_load, db_connection
+from tools.write_queue import write_queue
+import config
+
+class ResultSpillStore:
+    """
+    เก็บผลลัพธ์ Query ฉบับเต็มไว้บนดิสก์ (SQLite แยกจากฐานข้อมูลหลัก) และอ้างอิงด้วย result_id
+    ใช้กับประวัติแชท เพื่อให้ session state เก็บเฉพาะตัวอย่างไม่กี่แถว แทนผลลัพธ์ทั้งหมด
+    ผลลัพธ์ที่เก่าที่สุดจะถูกลบเมื่อจำนวนเกิน max_results
+    """
+
+    def __init__(self, database_url: str = None, max_results: int = None):
+        self.database_url = database_url or config.RESULT_SPILL_DATABASE_URL
+        self.max_results = max_results if max_results is not None else config.RESULT_SPILL_MAX_RESULTS
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        return db_connection(self.database_url)
+
+    def _ensure_index(self):
+        if self._initialized:
+            return
+        write_queue.submit(self.database_url, self._connect, lambda connection: connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS spilled_results ("
+            "result_id TEXT PRIMARY KEY, table_name TEXT NOT NULL, row_count INTEGER, created_at REAL)"
+        )))
+        self._initialized = True
+
+    def spill(self, records: list) -> str:
+        """
+        เขียน records ลงดิสก์ และคืนค่า result_id
+        """
+        result_id = uuid.uuid4().hex[:16]
+        table_name = f"result_{result_id}"
+        with self._lock:
+            self._ensure_index()
+            bulk_load(self.database_url, table_name, pd.DataFrame.from_records(records))
+
+            def register(connection):
+                connection.execute(
+                    text("INSERT INTO spilled_results VALUES (:result_id, :table_name, :row_count, :created_at)"),
+                    {"result_id": result_id, "table_name": table_name, "row_count": len(records), "created_at": time.time()},
+                )
+                self._evict(connection)
+            write_queue.submit(self.database_url, self._connect, register)
+        return result_id
+
+    def _evict(self, connection):
+        stale = connection.execute(
+            text("SELECT result_id, table_name FROM spilled_results ORDER BY created_at DESC LIMIT -1 OFFSET :keep"),
+            {"keep": self.max_results},
+        ).fetchall()
+        for result_id, table_name in stale:
+            connection.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
+            connection.execute(text("DELETE FROM spilled_results WHERE result_id = :result_id"), {"result_id": result_id})
+
+    def load(self, result_id: str, offset: int = 0, limit: int = None):
+        """
+        อ่านผลลัพธ์ที่เก็บไว้เป็น DataFrame (เฉพาะช่วง offset/limit ถ้ากำหนด) หรือ None ถ้าไม่พบ
+        """
+        self._ensure_index()
+        with db_connection(self.database_url) as connection:
+            row = connection.execute(
+                text("SELECT table_name FROM spilled_results WHERE result_id = :result_id"), {"result_id": result_id}
+            ).fetchone()
+            if row is None:
+                return None
+            return pd.read_sql(
+                text(f'SELECT * FROM "{row[0]}" LIMIT :limit OFFSET :offset'),
+                connection,
+                params={"limit": -1 if limit is None else int(limit), "offset": int(offset)},
+            )
+
+# Store ที่ใช้ร่วมกันทั้ง process
+result_spill = ResultSpillStore()
@@ -0,0 +1,160 @@
+# tools/schema_catalog.py
+from sqlalchemy import inspect, text
+import threading
+import re
+
+# คำสั่ง DDL ที่ทำให้ schema ใน catalog ไม่เป็นปัจจุบัน
+_DDL_PATTERN = re.compile(r"^\s*(create|alter|drop)\b", re.IGNORECASE)
+_DDL_TABLE_PATTERN = re.compile(
+    r"^\s*(?:create\s+(?:temp\s+|temporary\s+)?table|alter\s+table|drop\s+table)\s+"
+    r"(?:if\s+(?:not\s+)?exists\s+)?[\"`\[]?(\w+)",
+    re.IGNORECASE,
+)
+_DDL_INDEX_TABLE_PATTERN = re.compile(r"^\s*create\s+(?:unique\s+)?index\b.*?\bon\s+[\"`\[]?(\w+)", re.IGNORECASE | re.DOTALL)
+
+def ddl_target_tables(query: str):
+    """
+    ตรวจสอบว่า query เป็นคำสั่ง DDL หรือไม่
+    คืนค่า None ถ้าไม่ใช่ DDL, คืนค่า set ของชื่อตารางที่ได้รับผลกระทบ หรือ set ว่างถ้าระบุตารางไม่ได้
+    """
+    if not _DDL_PATTERN.match(query):
+        return None
+    match = _DDL_TABLE_PATTERN.match(query) or _DDL_INDEX_TABLE_PATTERN.match(query)
+    return {match.group(1)} if match else set()
+
+def _estimate_row_count(connection, table_name: str):
+    """
+    ประมาณจำนวนแถวโดยไม่ scan ทั้งตาราง (ใช้ sqlite_stat1 หรือ MAX(rowid) สำหรับ SQLite)
+    """
+    if connection.dialect.name != "sqlite":
+        return None
+    try:
+        has_stats = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+        ).first()
+        if has_stats:
+            stat = connection.execute(
+                text("SELECT stat FROM sqlite_stat1 WHERE tbl = :tbl LIMIT 1"), {"tbl": table_name}
+            ).scalar()
+            if stat:
+                return int(str(stat).split()[0])
+        max_rowid = connection.execute(text(f'SELECT MAX(_rowid_) FROM "{table_name}"')).scalar()
+        return int(max_rowid or 0)
+    except Exception:
+        return None
+
+def _describe_table(connection, inspector, table_name: str) -> dict:
+    columns = {col["name"]: str(col["type"]) for col in inspector.get_columns(table_name)}
+    primary_key = inspector.get_pk_constraint(table_name).get("constrained_columns") or []
+    indexes = [
+        {"name": idx["name"], "columns": idx["column_names"], "unique": bool(idx.get("unique"))}
+        for idx in inspector.get_indexes(table_name)
+    ]
+    return {
+        "columns": columns,
+        "primary_key": primary_key,
+        "indexes": indexes,
+        "row_count_estimate": _estimate_row_count(connection, table_name),
+    }
+
+class SchemaCatalog:
+    """
+    Cache ของ schema ตาราง (columns, types, primary key, indexes, จำนวนแถวโดยประมาณ) ต่อ database_url
+    ข้อมูลถูกโหลดครั้งเดียวและล้างออกเมื่อมีคำสั่ง DDL ที่กระทบตารางนั้น
+    บน SQLite ตรวจ PRAGMA schema_version ก่อนใช้ cache ทุกครั้ง จึงเห็น DDL จาก connection/process อื่นด้วย
+    และตารางที่ไม่พบใน cache จะถูกตรวจกับฐานข้อมูลเสมอ
+    """
+
+    def __init__(self):
+        self._tables = {}      # database_url -> {table_name: description}
+        self._complete = set() # database_url ที่โหลดรายชื่อตารางครบแล้ว
+        self._schema_versions = {} # database_url -> PRAGMA schema_version ตอนที่ cache ยังตรงกับฐานข้อมูล
+        self._written = set()  # (database_url, table_name) ที่ต้องคำนวณจำนวนแถวโดยประมาณใหม่
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "external_changes": 0}
+
+    def _sync(self, database_url: str, connection):
+        """
+        เรียกภายใต้ self._lock: ล้าง cache ของฐานข้อมูลถ้า schema ถูกเปลี่ยนนอกการแจ้งผ่าน invalidate
+        และคำนวณจำนวนแถวโดยประมาณใหม่ให้ตารางที่ถูกเขียนหลังโหลด
+        """
+        if connection.dialect.name == "sqlite":
+            version = connection.exec_driver_sql("PRAGMA schema_version").scalar()
+            if self._schema_versions.get(database_url) != version:
+                if database_url in self._schema_versions:
+                    self._stats["external_changes"] += 1
+                self._schema_versions[database_url] = version
+                self._tables.pop(database_url, None)
+                self._complete.discard(database_url)
+        tables = self._tables.setdefault(database_url, {})
+        for key in [key for key in self._written if key[0] == database_url]:
+            self._written.discard(key)
+            if key[1] in tables:
+                tables[key[1]] = {**tables[key[1]], "row_count_estimate": _estimate_row_count(connection, key[1])}
+        return tables
+
+    def describe(self, database_url: str, connect, table_name: str):
+        """
+        คืนค่า description ของตาราง หรือ None ถ้าไม่มีตารางนี้
+        connect คือ callable ที่คืนค่า context manager ของ connection (ใช้ตรวจ schema_version และโหลดเมื่อ cache miss)
+        """
+        with self._lock, connect() as connection:
+            tables = self._sync(database_url, connection)
+            if table_name in tables:
+                self._stats["hits"] += 1
+                return tables[table_name]
+            # ไม่พบใน cache: ตรวจกับฐานข้อมูลเสมอ (ตารางอาจถูกสร้างโดย connection อื่น)
+            self._stats["misses"] += 1
+            inspector = inspect(connection)
+            if not inspector.has_table(table_name):
+                return None
+            tables[table_name] = _describe_table(connection, inspector, table_name)
+            return tables[table_name]
+
+    def describe_all(self, database_url: str, connect) -> dict:
+        """
+        คืนค่า description ของทุกตารางในฐานข้อมูลในครั้งเดียว
+        """
+        with self._lock, connect() as connection:
+            tables = self._sync(database_url, connection)
+            if database_url in self._complete:
+                self._stats["hits"] += 1
+                return dict(tables)
+            self._stats["misses"] += 1
+            inspector = inspect(connection)
+            table_names = inspector.get_table_names()
+            for stale in set(tables) - set(table_names):
+                del tables[stale]
+            for table_name in table_names:
+                if table_name not in tables:
+                    tables[table_name] = _describe_table(connection, inspector, table_name)
+            self._complete.add(database_url)
+            return dict(tables)
+
+    def invalidate(self, database_url: str, table_names=None):
+        """
+        ล้าง cache ของตารางที่กำหนด (หรือทั้งฐานข้อมูลถ้าไม่ระบุ) เพื่อให้โหลดใหม่ในครั้งถัดไป
+        """
+        with self._lock:
+            self._stats["invalidations"] += 1
+            self._complete.discard(database_url)
+            if not table_names:
+                self._tables.pop(database_url, None)
+                return
+            tables = self._tables.get(database_url, {})
+            for table_name in table_names:
+                tables.pop(table_name, None)
+
+    def notify_write(self, database_url: str, tables):
+        """
+        แจ้งว่ามีการเขียนข้อมูลในตาราง: จำนวนแถวโดยประมาณจะถูกคำนวณใหม่ในการเรียกครั้งถัดไป
+        """
+        with self._lock:
+            self._written.update((database_url, table) for table in tables or ())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+# Catalog ที่ใช้ร่วมกันทั้ง process
+schema_catalog = SchemaCatalog()
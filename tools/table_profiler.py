@@ -0,0 +1,423 @@
+# tools/table_profiler.py
+"""
+Profile ของตาราง (จำนวนแถว, สัดส่วน null, min/max, mean/std, distinct โดยประมาณ, ค่าที่พบบ่อย, histogram)
+คำนวณด้วยการอ่านตารางครั้งเดียวทีละ chunk และคำนวณแบบ vectorised ด้วย NumPy/pandas
+
+- distinct ใช้ HyperLogLog (ความคลาดเคลื่อนประมาณ 1.04 / sqrt(2^precision))
+- ค่าที่พบบ่อยใช้ frequent-items sketch ขนาดจำกัด (บอกขอบเขตความคลาดเคลื่อนของจำนวนนับด้วย)
+- histogram ของคอลัมน์ตัวเลขใช้ bin กว้างเท่ากัน (ความกว้างเป็นกำลังของ 2) ที่ขยายช่วงได้โดยรวม bin ที่ติดกัน
+
+sketch ทุกตัวรวมกันได้ (mergeable) จึงเก็บไว้ในตาราง table_profiles พร้อม high-water mark (rowid สูงสุด)
+เมื่อมีแถวใหม่ต่อท้าย จะอ่านเฉพาะแถวใหม่แล้วรวมเข้ากับ sketch เดิม (UPDATE/DELETE ทำให้ต้อง profile ใหม่ทั้งตาราง)
+
+การเปลี่ยนแปลงตรวจจาก rowid สูงสุด, จำนวนแถว (COUNT(*) ของแถวที่ rowid ไม่เกิน high-water mark ต้องเท่ากับค่าที่บันทึก)
+และ UPDATE/DELETE ที่ผ่าน Tool ใน process นี้ (notify_write) โดยไม่แก้ schema ของตารางผู้ใช้
+UPDATE จาก process อื่นที่ไม่เปลี่ยนจำนวนแถวตรวจไม่พบ: ใช้ full_refresh หลังการเขียนลักษณะนั้น
+"""
+from sqlalchemy import inspect, text
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import threading
+import base64
+import math
+import time
+import json
+import zlib
+
+from tools.query_cache import query_cache
+from tools.write_queue import write_queue
+import config
+
+_CATALOG_TABLE = "table_profiles"
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+def _display_number(value):
+    # min/max ของคอลัมน์ตัวเลขเก็บเป็น float: แสดงค่าจำนวนเต็มเป็น int
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return _json_value(value)
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    """
+    bit_length ของ uint64 ทีละ array (แยกเป็น 32 บิตบน/ล่าง เพื่อให้ log2 ของ float64 แม่นยำ)
+    """
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        high_bits = np.where(high > 0, np.floor(np.log2(np.maximum(high, 1))) + 33, 0)
+        low_bits = np.where(low > 0, np.floor(np.log2(np.maximum(low, 1))) + 1, 0)
+    return np.where(high > 0, high_bits, low_bits).astype(np.int64)
+
+class _HyperLogLog:
+    def __init__(self, precision: int, registers: np.ndarray = None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray):
+        remaining_bits = 64 - self.precision
+        index = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << remaining_bits) - 1)
+        rank = (remaining_bits - _bit_length(remainder) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros) # linear counting สำหรับ cardinality ต่ำ
+        return int(round(estimate))
+
+    def to_state(self) -> str:
+        return base64.b64encode(zlib.compress(self.registers.tobytes())).decode("ascii")
+
+    @classmethod
+    def from_state(cls, precision: int, state: str):
+        registers = np.frombuffer(zlib.decompress(base64.b64decode(state)), dtype=np.uint8).copy()
+        return cls(precision, registers)
+
+class _ColumnSketch:
+    """
+    สถิติและ sketch ของคอลัมน์หนึ่ง อัปเดตทีละ chunk (pandas Series) และรวมกับ state ที่บันทึกไว้ได้
+    """
+
+    def __init__(self, name: str, state: dict = None):
+        state = state or {}
+        self.name = name
+        self.kind = state.get("kind")               # numeric / text / mixed (None = ยังไม่พบค่าที่ไม่ใช่ null)
+        self.count = state.get("count", 0)          # ค่าที่ไม่ใช่ null
+        self.nulls = state.get("nulls", 0)
+        self.min = state.get("min")
+        self.max = state.get("max")
+        self.sum = state.get("sum", 0.0)
+        self.sum_squares = state.get("sum_squares", 0.0)
+        precision = state.get("hll_precision", config.PROFILE_HLL_PRECISION)
+        self.hll = _HyperLogLog.from_state(precision, state["hll"]) if state.get("hll") else _HyperLogLog(precision)
+        self.frequent = {_json_value(v): c for v, c in state.get("frequent", [])}
+        self.frequent_error = state.get("frequent_error", 0)
+        self.hist_low = state.get("hist_low")
+        self.hist_width = state.get("hist_width")
+        self.hist_counts = np.array(state["hist_counts"], dtype=np.int64) if state.get("hist_counts") else None
+
+    def update(self, series: pd.Series):
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        chunk_kind = "numeric" if pd.api.types.is_numeric_dtype(values) else "text"
+        if self.kind is None:
+            self.kind = chunk_kind
+        elif self.kind != chunk_kind:
+            # SQLite เก็บค่าต่างชนิดในคอลัมน์เดียวได้: เก็บเฉพาะสถิติที่ไม่ขึ้นกับชนิด
+            self.kind = "mixed"
+            self.min = self.max = self.hist_counts = None
+        self.count += len(values)
+
+        if chunk_kind == "numeric":
+            numbers = values.to_numpy(dtype=np.float64)
+            self.hll.add_hashes(pd.util.hash_array(numbers))
+            numbers = numbers[np.isfinite(numbers)]
+            if self.kind == "numeric" and numbers.size:
+                low, high = float(numbers.min()), float(numbers.max())
+                self.min = low if self.min is None else min(self.min, low)
+                self.max = high if self.max is None else max(self.max, high)
+                self.sum += float(numbers.sum())
+                self.sum_squares += float(np.square(numbers).sum())
+                self._update_histogram(numbers, integer=pd.api.types.is_integer_dtype(values))
+        else:
+            strings = values.astype(str)
+            self.hll.add_hashes(pd.util.hash_array(strings.to_numpy(dtype=object)))
+            if self.kind == "text":
+                low, high = strings.min(), strings.max()
+                self.min = low if self.min is None else min(self.min, low)
+                self.max = high if self.max is None else max(self.max, high)
+        self._update_frequent(values)
+
+    def _update_frequent(self, values: pd.Series):
+        capacity = config.PROFILE_TOP_K_CAPACITY
+        counts = values.value_counts(sort=True)
+        if len(counts) > capacity:
+            # ค่าที่ถูกตัดออกจาก chunk นี้นับได้ไม่เกินจำนวนของค่าลำดับถัดไป
+            self.frequent_error += int(counts.iloc[capacity])
+            counts = counts.iloc[:capacity]
+        for value, count in zip(counts.index.tolist(), counts.tolist()):
+            key = _json_value(value)
+            self.frequent[key] = self.frequent.get(key, 0) + int(count)
+        if len(self.frequent) > capacity:
+            ranked = sorted(self.frequent.items(), key=lambda item: item[1], reverse=True)
+            self.frequent_error += ranked[capacity][1]
+            self.frequent = dict(ranked[:capacity])
+
+    def _update_histogram(self, numbers: np.ndarray, integer: bool):
+        bins = config.PROFILE_HISTOGRAM_BINS
+        low, high = float(numbers.min()), float(numbers.max())
+        if self.hist_counts is None:
+            span = (high - low) / bins
+            width = 2.0 ** math.ceil(math.log2(span)) if span > 0 else 1.0
+            self.hist_width = max(width, 1.0) if integer else width
+            self.hist_low = math.floor(low / self.hist_width) * self.hist_width
+            self.hist_counts = np.zeros(bins, dtype=np.int64)
+        # ขยายช่วงด้วยการเพิ่มความกว้าง bin เป็นสองเท่า (รวม bin เดิมเข้าด้วยกัน) จนครอบคลุมค่าใหม่ทั้งหมด
+        while low < self.hist_low or high >= self.hist_low + bins * self.hist_width:
+            width = self.hist_width * 2
+            new_low = math.floor(min(self.hist_low, low) / width) * width
+            edges = self.hist_low + np.arange(bins) * self.hist_width
+            target = np.floor((edges - new_low) / width).astype(np.int64)
+            counts = np.zeros(bins, dtype=np.int64)
+            np.add.at(counts, np.clip(target, 0, bins - 1), self.hist_counts)
+            self.hist_low, self.hist_width, self.hist_counts = new_low, width, counts
+        index = np.clip(np.floor((numbers - self.hist_low) / self.hist_width).astype(np.int64), 0, bins - 1)
+        self.hist_counts += np.bincount(index, minlength=bins)
+
+    def to_state(self) -> dict:
+        return {
+            "kind": self.kind, "count": self.count, "nulls": self.nulls, "min": _json_value(self.min), "max": _json_value(self.max),
+            "sum": self.sum, "sum_squares": self.sum_squares, "hll_precision": self.hll.precision, "hll": self.hll.to_state(),
+            "frequent": [[v, c] for v, c in self.frequent.items()], "frequent_error": self.frequent_error,
+            "hist_low": self.hist_low, "hist_width": self.hist_width,
+            "hist_counts": self.hist_counts.tolist() if self.hist_counts is not None else None,
+        }
+
+    def summary(self, row_count: int) -> dict:
+        distinct = min(self.hll.estimate(), self.count)
+        summary = {
+            "kind": self.kind,
+            "non_null": self.count,
+            "nulls": self.nulls,
+            "null_fraction": round(self.nulls / row_count, 6) if row_count else 0.0,
+            "min": _display_number(self.min),
+            "max": _display_number(self.max),
+            "distinct_estimate": distinct,
+            "distinct_ratio": round(distinct / self.count, 6) if self.count else 0.0,
+        }
+        if self.kind == "numeric" and self.count:
+            mean = self.sum / self.count
+            summary["mean"] = round(mean, 6)
+            summary["std"] = round(math.sqrt(max(self.sum_squares / self.count - mean * mean, 0.0)), 6)
+        ranked = sorted(self.frequent.items(), key=lambda item: item[1], reverse=True)[:config.PROFILE_TOP_K]
+        summary["top_values"] = [{"value": v, "count": c} for v, c in ranked]
+        summary["top_values_max_error"] = self.frequent_error
+        if self.hist_counts is not None and self.count:
+            nonzero = np.flatnonzero(self.hist_counts)
+            summary["histogram"] = [
+                {"lower": self.hist_low + i * self.hist_width, "upper": self.hist_low + (i + 1) * self.hist_width,
+                 "count": int(self.hist_counts[i])}
+                for i in range(int(nonzero[0]), int(nonzero[-1]) + 1)
+            ]
+        return summary
+
+class TableProfiler:
+    """
+    คำนวณ, เก็บ และ refresh profile ของตาราง (ใช้ร่วมกันทั้ง process)
+    connect คือ callable ที่คืนค่า context manager ของ connection (เช่น lambda: db_connection(url))
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._table_locks = {}
+        self._dirty = set()  # (database_url, table) ที่มี UPDATE/DELETE หลัง profile ล่าสุด
+        self._stats = {"full": 0, "incremental": 0, "cached": 0, "rows_scanned": 0}
+
+    def _table_lock(self, database_url: str, table_name: str):
+        with self._lock:
+            return self._table_locks.setdefault((database_url, table_name.lower()), threading.Lock())
+
+    def _load(self, connection, table_name: str):
+        if not inspect(connection).has_table(_CATALOG_TABLE):
+            return None
+        row = connection.execute(text(
+            f"SELECT row_count, high_water_mark, profiled_at, profile, sketches FROM {_CATALOG_TABLE} WHERE table_name = :table_name"
+        ), {"table_name": table_name}).mappings().fetchone()
+        if row is None:
+            return None
+        return {**row, "profile": json.loads(row["profile"]), "sketches": json.loads(row["sketches"])}
+
+    def _rows_match(self, connection, table_name: str, stored: dict) -> bool:
+        """
+        จำนวนแถวที่ rowid ไม่เกิน high-water mark ยังเท่ากับตอน profile หรือไม่
+        (ค่าที่ต่างหมายถึง DELETE หรือ INSERT ที่ใช้ rowid เก่า เช่นจาก process อื่น)
+        """
+        if stored["high_water_mark"] is None:
+            count = connection.exec_driver_sql(f'SELECT COUNT(*) FROM "{table_name}"').scalar()
+        else:
+            count = connection.exec_driver_sql(
+                f'SELECT COUNT(*) FROM "{table_name}" WHERE rowid <= ?', (stored["high_water_mark"],)
+            ).scalar()
+        return count == stored["row_count"]
+
+    def _high_water_mark(self, connection, table_name: str):
+        if connection.dialect.name != "sqlite":
+            return None
+        try:
+            return connection.exec_driver_sql(f'SELECT max(rowid) FROM "{table_name}"').scalar() or 0
+        except Exception:
+            return None # เช่นตาราง WITHOUT ROWID
+
+    def _scan(self, connection, table_name: str, sketches: dict, with_rowid: bool, after_rowid=None):
+        """
+        อ่านตาราง (หรือเฉพาะแถวที่ rowid > after_rowid) ทีละ chunk และอัปเดต sketch ของทุกคอลัมน์
+        คืนค่า (จำนวนแถวที่อ่าน, ชื่อคอลัมน์, rowid สูงสุดที่อ่าน)
+        """
+        query = f'SELECT rowid, * FROM "{table_name}"' if with_rowid else f'SELECT * FROM "{table_name}"'
+        if after_rowid is not None:
+            query += " WHERE rowid > ?"
+        if with_rowid:
+            query += " ORDER BY rowid"
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute(query, (after_rowid,) if after_rowid is not None else ())
+            names = [d[0] for d in cursor.description][1 if with_rowid else 0:]
+            for name in names:
+                sketches.setdefault(name, _ColumnSketch(name))
+            scanned, last_rowid = 0, after_rowid
+            while True:
+                rows = cursor.fetchmany(config.PROFILE_CHUNK_SIZE)
+                if not rows:
+                    break
+                frame = pd.DataFrame.from_records(rows)
+                if with_rowid:
+                    last_rowid = int(frame.iloc[-1, 0])
+                    frame = frame.iloc[:, 1:]
+                for position, name in enumerate(names):
+                    sketches[name].update(frame.iloc[:, position])
+                scanned += len(rows)
+            return scanned, names, last_rowid
+        finally:
+            cursor.close()
+
+    def profile(self, database_url: str, connect, table_name: str, full: bool = False) -> dict:
+        """
+        สร้างหรือ refresh profile ของตาราง: ถ้ามีเพียงแถวใหม่ต่อท้ายจะอ่านเฉพาะแถวใหม่ (incremental)
+        ถ้าไม่มีการเปลี่ยนแปลงจะคืน profile ที่เก็บไว้ทันที
+
+        Returns:
+            dict: profile ของตาราง (row_count, columns, mode, seconds, ...)
+        """
+        started = time.perf_counter()
+        key = (database_url, table_name.lower())
+        with self._table_lock(database_url, table_name):
+            with connect() as connection:
+                if not inspect(connection).has_table(table_name):
+                    raise ValueError(f"ไม่พบตาราง '{table_name}'")
+                stored = None if full else self._load(connection, table_name)
+                current_hwm = self._high_water_mark(connection, table_name)
+                if (stored is not None and connection.dialect.name == "sqlite"
+                        and (current_hwm is None) == (stored["high_water_mark"] is None)
+                        and not self._rows_match(connection, table_name, stored)):
+                    stored = None
+                with self._lock:
+                    dirty = key in self._dirty
+                    # ล้างสถานะก่อนอ่าน: การเขียนที่เกิดระหว่างอ่านจะทำให้ profile ครั้งถัดไปเป็นแบบเต็มอีกครั้ง
+                    self._dirty.discard(key)
+
+                if stored is None or dirty:
+                    mode = "full"
+                elif current_hwm is None or stored["high_water_mark"] is None:
+                    # ไม่มี rowid (เช่น WITHOUT ROWID หรือฐานข้อมูลอื่น): ใช้ profile เดิมจนกว่าจะมีการเขียนที่ทราบ
+                    mode = "cached" if current_hwm is None and stored["high_water_mark"] is None else "full"
+                elif current_hwm == stored["high_water_mark"]:
+                    mode = "cached"
+                else:
+                    mode = "incremental" if current_hwm > stored["high_water_mark"] else "full"
+
+                if mode == "cached":
+                    with self._lock:
+                        self._stats["cached"] += 1
+                    return {**stored["profile"], "mode": "cached"}
+
+                with_rowid = current_hwm is not None
+                if mode == "incremental":
+                    sketches = {name: _ColumnSketch(name, state) for name, state in stored["sketches"].items()}
+                    scanned, names, last_rowid = self._scan(connection, table_name, sketches, True, stored["high_water_mark"])
+                    row_count = stored["row_count"] + scanned
+                    if names != list(stored["sketches"]):
+                        mode = "full" # schema เปลี่ยนหลัง profile ครั้งก่อน
+                if mode == "full":
+                    sketches = {}
+                    scanned, names, last_rowid = self._scan(connection, table_name, sketches, with_rowid)
+                    row_count = scanned
+                sketches = {name: sketches[name] for name in names}
+
+        if not with_rowid:
+            high_water_mark = None
+        else:
+            high_water_mark = last_rowid if last_rowid is not None else current_hwm
+        profile = {
+            "table": table_name,
+            "row_count": row_count,
+            "column_count": len(names),
+            "high_water_mark": high_water_mark,
+            "profiled_at": datetime.now().isoformat(timespec="seconds"),
+            "rows_scanned": scanned,
+            "seconds": round(time.perf_counter() - started, 4),
+            "columns": {name: sketch.summary(row_count) for name, sketch in sketches.items()},
+        }
+        self._save(database_url, connect, profile, {name: sketch.to_state() for name, sketch in sketches.items()})
+        with self._lock:
+            self._stats[mode] += 1
+            self._stats["rows_scanned"] += scanned
+        return {**profile, "mode": mode}
+
+    def _save(self, database_url: str, connect, profile: dict, sketches: dict):
+        def save(connection):
+            connection.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {_CATALOG_TABLE} ("
+                "table_name TEXT PRIMARY KEY, row_count INTEGER, high_water_mark INTEGER, profiled_at TEXT, "
+                "profile TEXT NOT NULL, sketches TEXT NOT NULL)"
+            )
+            connection.execute(text(
+                f"INSERT INTO {_CATALOG_TABLE} (table_name, row_count, high_water_mark, profiled_at, profile, sketches) "
+                "VALUES (:table_name, :row_count, :high_water_mark, :profiled_at, :profile, :sketches) "
+                "ON CONFLICT (table_name) DO UPDATE SET row_count = excluded.row_count, high_water_mark = excluded.high_water_mark, "
+                "profiled_at = excluded.profiled_at, profile = excluded.profile, sketches = excluded.sketches"
+            ), {"table_name": profile["table"], "row_count": profile["row_count"], "high_water_mark": profile["high_water_mark"],
+                "profiled_at": profile["profiled_at"], "profile": json.dumps(profile, ensure_ascii=False),
+                "sketches": json.dumps(sketches, ensure_ascii=False)})
+            if connection.dialect.name == "sqlite":
+                # ลบ trigger นับการเปลี่ยนแปลงที่ profiler รุ่นก่อนติดตั้งไว้บนตารางผู้ใช้
+                for event in ("insert", "update", "delete"):
+                    connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS "{_CATALOG_TABLE}_{profile["table"]}_{event}"')
+        write_queue.submit(database_url, connect, save)
+        query_cache.invalidate_tables(database_url, [_CATALOG_TABLE])
+
+    def profiles(self, database_url: str, connect) -> list:
+        """
+        สรุป profile ที่เก็บไว้ทั้งหมด (ไม่ refresh)
+        """
+        with connect() as connection:
+            if not inspect(connection).has_table(_CATALOG_TABLE):
+                return []
+            rows = connection.execute(text(
+                f"SELECT table_name, row_count, high_water_mark, profiled_at FROM {_CATALOG_TABLE} ORDER BY table_name"
+            )).mappings().all()
+        return [dict(row) for row in rows]
+
+    def notify_write(self, database_url: str, tables, inserts_only: bool = False):
+        """
+        แจ้งว่ามีการเขียนตาราง: การ insert ต่อท้ายตรวจพบได้จาก rowid อยู่แล้ว ส่วน UPDATE/DELETE ทำให้ต้อง profile ใหม่ทั้งตาราง
+        """
+        if inserts_only:
+            return
+        with self._lock:
+            for table in tables or ():
+                if table.lower() != _CATALOG_TABLE:
+                    self._dirty.add((database_url, table.lower()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+# Profiler ที่ใช้ร่วมกันทั้ง process
+table_profiler = TableProfiler()
@@ -0,0 +1,212 @@
+# tools/tracing.py
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import contextvars
+import functools
+import threading
+import atexit
+import json
+import math
+import time
+import os
+
+import config
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """
+    ช่วงเวลาการทำงานหนึ่งช่วง (เช่น process_prompt, send_message, Tool call, SQL, render)
+    span ลูกสืบ trace_id และ agent จาก span แม่ที่ active อยู่ใน context เดียวกัน
+    """
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "agent", "timestamp", "_started",
+                 "duration_ms", "attributes", "error", "_token")
+
+    def __init__(self, name: str, kind: str, parent, agent: str = None, attributes: dict = None):
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.agent = agent or (parent.agent if parent is not None else None)
+        self.name = name
+        self.kind = kind
+        self.timestamp = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "agent": self.agent,
+            "timestamp": round(self.timestamp, 6),
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class _NoopSpan:
+    """span ที่ไม่บันทึกอะไร (ใช้เมื่อปิด tracing) เพื่อให้โค้ดที่เรียกไม่ต้องตรวจสอบ"""
+    trace_id = span_id = parent_id = agent = None
+
+    def set(self, **attributes):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def _percentile(sorted_values: list, q: float) -> float:
+    # nearest-rank
+    index = min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values)))) - 1
+    return sorted_values[index]
+
+class Tracer:
+    """
+    บันทึก span ของ LLM call, Tool call, SQL และการ render แบบ overhead ต่ำ
+
+    - span ที่จบแล้วถูกเก็บใน buffer และเขียนลงไฟล์ JSONL ทีละชุด (เมื่อ trace หลักจบหรือ buffer เต็ม) ไม่ใช่ทุก span
+      ไฟล์ถูกหมุนเป็น <path>.1 เมื่อเกิน max_bytes และข้อผิดพลาดในการเขียนไฟล์ไม่ถูกส่งต่อให้โค้ดที่ถูก trace
+    - เก็บเวลาล่าสุดของแต่ละ (agent, kind) แบบจำกัดจำนวน สำหรับคำนวณ percentile ใน sidebar
+    """
+
+    def __init__(self, export_path: str = None, enabled: bool = None, stats_window: int = None, flush_spans: int = None,
+                 max_bytes: int = None):
+        self.enabled = config.TRACING_ENABLED if enabled is None else enabled
+        self.export_path = config.TRACE_EXPORT_PATH if export_path is None else export_path
+        self.stats_window = stats_window or config.TRACE_STATS_WINDOW
+        self.flush_spans = flush_spans or config.TRACE_FLUSH_SPANS
+        self.max_bytes = config.TRACE_EXPORT_MAX_BYTES if max_bytes is None else max_bytes
+        self.export_errors = 0
+        self.last_export_error = None
+        self._buffer = []
+        self._latencies = defaultdict(lambda: deque(maxlen=self.stats_window))  # (agent, kind) -> duration_ms
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def start_span(self, name: str, kind: str, activate: bool = False, agent: str = None, **attributes):
+        """
+        เริ่ม span ใหม่เป็นลูกของ span ที่ active อยู่ ถ้า activate เป็น True span นี้จะเป็นแม่ของ span ถัดไปใน context นี้
+        ต้องเรียก end_span ใน context เดียวกันเสมอ
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        span = Span(name, kind, _current_span.get(), agent, attributes)
+        if activate:
+            span._token = _current_span.set(span)
+        return span
+
+    def end_span(self, span, error: Exception = None):
+        if span is _NOOP_SPAN:
+            return
+        span.duration_ms = round((time.perf_counter() - span._started) * 1000, 3)
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if span._token is not None:
+            _current_span.reset(span._token)
+            span._token = None
+        self._finish(span)
+
+    @contextmanager
+    def span(self, name: str, kind: str, agent: str = None, **attributes):
+        span = self.start_span(name, kind, activate=True, agent=agent, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, error=e)
+            raise
+        self.end_span(span)
+
+    def record(self, name: str, kind: str, duration_ms: float, **attributes):
+        """
+        บันทึก span ที่วัดเวลาไว้แล้ว (เช่น เวลารวมของการ render ทั้งคำตอบ) เป็นลูกของ span ที่ active อยู่
+        """
+        if not self.enabled:
+            return
+        span = Span(name, kind, _current_span.get(), None, attributes)
+        span.duration_ms = round(duration_ms, 3)
+        self._finish(span)
+
+    def annotate(self, **attributes):
+        """
+        เพิ่ม attribute ให้ span ที่ active อยู่ (ไม่ทำอะไรถ้าไม่มี span)
+        """
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self._latencies[(span.agent or "-", span.kind)].append(span.duration_ms)
+            if self.export_path:
+                self._buffer.append(span)
+            # เขียนไฟล์เมื่อ prompt ของ Agent จบ (ไม่ใช่ทุก span ที่ไม่มีแม่ เช่น SQL ที่รันจาก UI โดยตรง)
+            ready = (span.parent_id is None and span.kind == "agent") or len(self._buffer) >= self.flush_spans
+        if ready:
+            self.flush()
+
+    def flush(self):
+        """
+        เขียน span ทั้งหมดใน buffer ลงไฟล์ JSONL
+        ถ้าเขียนไม่สำเร็จ span ชุดนั้นถูกทิ้งและนับไว้ใน export_errors (tracing ต้องไม่ทำให้งานที่ถูก trace ล้มเหลว)
+        """
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        export_path = self.export_path
+        if not spans or not export_path:
+            return
+        try:
+            payload = "".join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + "\n" for s in spans)
+            with self._export_lock:
+                if self.max_bytes and os.path.exists(export_path) and os.path.getsize(export_path) >= self.max_bytes:
+                    os.replace(export_path, export_path + ".1")
+                with open(export_path, "a", encoding="utf-8") as f:
+                    f.write(payload)
+        except Exception as e:
+            with self._lock:
+                self.export_errors += 1
+                self.last_export_error = f"{type(e).__name__}: {e}"
+
+    def latency_summary(self) -> list:
+        """
+        คืนค่า percentile ของเวลาแยกตาม agent และประเภท span (p50/p95/p99/max ในหน่วยมิลลิวินาที)
+        """
+        with self._lock:
+            snapshot = {key: sorted(values) for key, values in self._latencies.items() if values}
+        return [
+            {
+                "agent": agent,
+                "kind": kind,
+                "count": len(values),
+                "p50_ms": _percentile(values, 50),
+                "p95_ms": _percentile(values, 95),
+                "p99_ms": _percentile(values, 99),
+                "max_ms": values[-1],
+            }
+            for (agent, kind), values in sorted(snapshot.items())
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._latencies.clear()
+            self._buffer = []
+
+def traced_prompt(method):
+    """
+    Decorator สำหรับ process_prompt ของ Agent: สร้าง span หลักของ trace (ชื่อ agent มาจากชื่อ class)
+    """
+    @functools.wraps(method)
+    def wrapper(self, user_prompt, *args, **kwargs):
+        with tracer.span("process_prompt", "agent", agent=type(self).__name__, prompt_chars=len(user_prompt or "")):
+            return method(self, user_prompt, *args, **kwargs)
+    return wrapper
+
+# Tracer ที่ใช้ร่วมกันทั้ง process
+tracer = Tracer()
+atexit.register(tracer.flush)
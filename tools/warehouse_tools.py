@@ -0,0 +1,282 @@
+# tools/warehouse_tools.py
+from sqlalchemy import inspect, text
+from datetime import date, datetime
+import time
+import json
+
+from tools.db_tools import ROW_HASH_NULL, _invalidate_written_tables, db_connection
+from tools.write_queue import write_queue
+import config
+
+# คอลัมน์ที่ใช้จัดการเวอร์ชันของ SCD Type 2 (ไม่ใช่ attribute ที่ติดตามการเปลี่ยนแปลง)
+SCD2_SYSTEM_COLUMNS = ("start_date", "end_date", "is_current", "row_hash")
+
+def row_hash_expression(dialect_name: str, columns: list, alias: str = "") -> str:
+    """
+    สร้าง SQL expression ที่คำนวณ hash ของคอลัมน์ที่กำหนด (SQLite ใช้ฟังก์ชัน row_hash ที่ลงทะเบียนใน db_tools)
+    """
+    prefix = f"{alias}." if alias else ""
+    if dialect_name == "sqlite":
+        return f"row_hash({', '.join(prefix + c for c in columns)})"
+    values = ", ".join(f"coalesce(CAST({prefix}{c} AS TEXT), '{ROW_HASH_NULL}')" for c in columns)
+    return f"md5(concat_ws('|', {values}))"
+
+def _ensure_current_version_index(connection, table_name: str, business_key: str):
+    connection.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{business_key}_current ON {table_name} ({business_key}, is_current)"
+    )
+
+def merge_scd2(database_url: str, source_table: str = "stg_customers", target_table: str = "dim_customer",
+               business_key: str = "customer_id", tracked_columns: list = None, effective_date: str = None,
+               close_missing: bool = False) -> dict:
+    """
+    Merge ข้อมูลจากตาราง staging เข้า dimension แบบ SCD Type 2 ด้วยคำสั่ง SQL แบบ set-based ภายใน transaction เดียว
+    (งานเดียวของ writer ที่เริ่มด้วย BEGIN อย่างชัดเจน ALTER TABLE/CREATE INDEX จึง rollback ไปพร้อมกันถ้าล้มเหลว)
+
+    1. คำนวณ hash ของ attribute ที่ติดตามสำหรับทุกแถวใน staging แล้วเทียบกับ hash ของเวอร์ชันปัจจุบันใน dimension
+    2. เก็บเฉพาะ key ที่เป็นแถวใหม่หรือมีการเปลี่ยนแปลงลง temp table
+    3. ปิดเวอร์ชันเดิมของ key ที่เปลี่ยน (end_date, is_current) และเพิ่มเวอร์ชันใหม่ของ key ที่ใหม่/เปลี่ยน
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        source_table (str): ตาราง staging ต้นทาง
+        target_table (str): ตาราง dimension ปลายทาง (ต้องมี start_date, end_date, is_current)
+        business_key (str): คอลัมน์ natural key ที่ใช้จับคู่ระหว่างสองตาราง
+        tracked_columns (list): attribute ที่ติดตามการเปลี่ยนแปลง (ค่าเริ่มต้นคือคอลัมน์ที่มีในทั้งสองตาราง)
+        effective_date (str): วันที่มีผลของเวอร์ชันใหม่ (ค่าเริ่มต้นคือวันนี้)
+        close_missing (bool): ถ้าเป็น True จะปิดเวอร์ชันปัจจุบันของ key ที่ไม่มีใน staging แล้ว
+
+    Returns:
+        dict: สถิติการ merge (new, changed, unchanged, closed_missing, seconds)
+    """
+    started = time.perf_counter()
+    effective_date = effective_date or date.today().isoformat()
+    added_hash_column = False
+
+    def merge(connection):
+        nonlocal tracked_columns, added_hash_column
+        inspector = inspect(connection)
+        source_columns = [c["name"] for c in inspector.get_columns(source_table)]
+        target_columns = [c["name"] for c in inspector.get_columns(target_table)]
+        if not source_columns:
+            raise ValueError(f"ไม่พบตารางต้นทาง '{source_table}'")
+        missing = {business_key, "start_date", "end_date", "is_current"} - set(target_columns)
+        if missing:
+            raise ValueError(f"ตาราง '{target_table}' ไม่มีคอลัมน์ SCD2 ที่จำเป็น: {sorted(missing)}")
+        if tracked_columns is None:
+            tracked_columns = [c for c in source_columns
+                               if c in target_columns and c != business_key and c not in SCD2_SYSTEM_COLUMNS]
+        if not tracked_columns:
+            raise ValueError(f"ไม่มี attribute ที่ติดตามได้ระหว่าง '{source_table}' และ '{target_table}'")
+
+        dialect = connection.dialect.name
+        if "row_hash" not in target_columns:
+            connection.exec_driver_sql(f"ALTER TABLE {target_table} ADD COLUMN row_hash TEXT")
+            added_hash_column = True
+        _ensure_current_version_index(connection, target_table, business_key)
+        # เวอร์ชันปัจจุบันที่โหลดไว้ก่อนมี row_hash ให้คำนวณ hash ก่อน (ทำครั้งเดียว)
+        connection.exec_driver_sql(
+            f"UPDATE {target_table} SET row_hash = {row_hash_expression(dialect, tracked_columns)} "
+            f"WHERE is_current = TRUE AND row_hash IS NULL"
+        )
+
+        connection.exec_driver_sql("DROP TABLE IF EXISTS _scd2_changes")
+        connection.exec_driver_sql(
+            "CREATE TEMP TABLE _scd2_changes AS "
+            f"SELECT s.{business_key} AS business_key, s.row_hash AS row_hash, "
+            f"CASE WHEN d.{business_key} IS NULL THEN 'new' ELSE 'changed' END AS change_type "
+            f"FROM (SELECT {business_key}, {row_hash_expression(dialect, tracked_columns)} AS row_hash FROM {source_table}) s "
+            f"LEFT JOIN {target_table} d ON d.{business_key} = s.{business_key} AND d.is_current = TRUE "
+            f"WHERE d.{business_key} IS NULL OR d.row_hash <> s.row_hash"
+        )
+        counts = dict(connection.exec_driver_sql(
+            "SELECT change_type, COUNT(*) FROM _scd2_changes GROUP BY change_type"
+        ).fetchall())
+
+        params = {"effective_date": effective_date}
+        connection.execute(text(
+            f"UPDATE {target_table} SET end_date = :effective_date, is_current = FALSE "
+            f"WHERE is_current = TRUE AND {business_key} IN "
+            f"(SELECT business_key FROM _scd2_changes WHERE change_type = 'changed')"
+        ), params)
+        closed_missing = 0
+        if close_missing:
+            closed_missing = connection.execute(text(
+                f"UPDATE {target_table} SET end_date = :effective_date, is_current = FALSE "
+                f"WHERE is_current = TRUE AND NOT EXISTS "
+                f"(SELECT 1 FROM {source_table} s WHERE s.{business_key} = {target_table}.{business_key})"
+            ), params).rowcount
+        column_list = ", ".join([business_key] + tracked_columns)
+        source_list = ", ".join(f"s.{c}" for c in [business_key] + tracked_columns)
+        connection.execute(text(
+            f"INSERT INTO {target_table} ({column_list}, start_date, end_date, is_current, row_hash) "
+            f"SELECT {source_list}, :effective_date, NULL, TRUE, c.row_hash "
+            f"FROM _scd2_changes c JOIN {source_table} s ON s.{business_key} = c.business_key"
+        ), params)
+        source_rows = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {source_table}").scalar()
+        connection.exec_driver_sql("DROP TABLE IF EXISTS _scd2_changes")
+        return counts, closed_missing, source_rows
+
+    # ทั้ง merge เป็นงานเดียวของ writer (อยู่ใน transaction เดียวกัน)
+    counts, closed_missing, source_rows = write_queue.submit(database_url, lambda: db_connection(database_url), merge)
+
+    _invalidate_written_tables(database_url, tables=[target_table], schema_changed=[target_table] if added_hash_column else None)
+    new_rows, changed_rows = counts.get("new", 0), counts.get("changed", 0)
+    return {
+        "target": target_table,
+        "effective_date": effective_date,
+        "tracked_columns": tracked_columns,
+        "new": new_rows,
+        "changed": changed_rows,
+        "unchanged": source_rows - new_rows - changed_rows,
+        "closed_missing": closed_missing,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+def apply_scd2_dimension(database_url: str, source_table: str = "stg_customers", target_table: str = "dim_customer",
+                         business_key: str = "customer_id", tracked_columns_json: str = "", effective_date: str = ""):
+    """
+    โหลดข้อมูลจากตาราง staging เข้า dimension แบบ SCD Type 2 (เพิ่มเวอร์ชันใหม่เฉพาะแถวที่ใหม่หรือเปลี่ยนแปลง)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        source_table (str): ตาราง staging ต้นทาง เช่น 'stg_customers'
+        target_table (str): ตาราง dimension ปลายทาง เช่น 'dim_customer'
+        business_key (str): คอลัมน์ natural key เช่น 'customer_id'
+        tracked_columns_json (str): JSON list ของคอลัมน์ที่ติดตามการเปลี่ยนแปลง (ว่าง = ทุกคอลัมน์ที่มีในทั้งสองตาราง)
+        effective_date (str): วันที่มีผลของเวอร์ชันใหม่ รูปแบบ YYYY-MM-DD (ว่าง = วันนี้)
+
+    Returns:
+        str: สรุปผลการ merge หรือข้อผิดพลาด
+    """
+    try:
+        tracked_columns = json.loads(tracked_columns_json) if tracked_columns_json else None
+        stats = merge_scd2(database_url, source_table, target_table, business_key, tracked_columns, effective_date or None)
+        return (f"SCD2 merge into '{target_table}' (effective {stats['effective_date']}): "
+                f"{stats['new']} new, {stats['changed']} changed, {stats['unchanged']} unchanged "
+                f"in {stats['seconds']}s. Tracked columns: {stats['tracked_columns']}.")
+    except Exception as e:
+        return f"Error applying SCD2 merge into '{target_table}': {str(e)}"
+
+def _read_watermark(connection, pipeline: str):
+    connection.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS etl_watermarks (pipeline TEXT PRIMARY KEY, high_water_mark INTEGER, updated_at TEXT)"
+    )
+    return connection.execute(
+        text("SELECT high_water_mark FROM etl_watermarks WHERE pipeline = :pipeline"), {"pipeline": pipeline}
+    ).scalar()
+
+def _write_watermark(connection, pipeline: str, high_water_mark):
+    connection.execute(text(
+        "INSERT INTO etl_watermarks (pipeline, high_water_mark, updated_at) VALUES (:pipeline, :hwm, :updated_at) "
+        "ON CONFLICT (pipeline) DO UPDATE SET high_water_mark = excluded.high_water_mark, updated_at = excluded.updated_at"
+    ), {"pipeline": pipeline, "hwm": high_water_mark, "updated_at": datetime.now().isoformat(timespec="seconds")})
+
+def load_fact_incremental(database_url: str, source_table: str = "stg_sales", target_table: str = "fact_sales",
+                          dimension_table: str = "dim_customer", lookback: int = None, full_reload: bool = False) -> dict:
+    """
+    โหลดข้อมูลจาก stg_sales เข้า fact_sales แบบ incremental ตาม high-water mark ของ order_id
+
+    - อ่านเฉพาะแถวที่ order_id มากกว่า watermark ลบด้วย lookback (ครอบคลุมแถวที่มาช้าและได้ order_id ย้อนหลัง)
+    - หา customer_key จากเวอร์ชันใน dim_customer ที่มีผล ณ วันที่ขาย (start_date <= sale_date < end_date)
+      ยอดขายก่อนเวอร์ชันแรกของลูกค้าใช้เวอร์ชันแรก (ข้อมูลก่อนเริ่มเก็บประวัติ)
+    - ข้าม order_id ที่มีใน fact แล้ว (anti-join) จึงรันซ้ำได้โดยไม่เกิดข้อมูลซ้ำ
+    - บันทึก watermark ใหม่ในตาราง etl_watermarks ภายใน transaction เดียวกับการโหลด
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        source_table (str): ตาราง staging ของยอดขาย
+        target_table (str): ตาราง fact ปลายทาง
+        dimension_table (str): ตาราง dimension ของลูกค้า (SCD2)
+        lookback (int): จำนวน order_id ก่อน watermark ที่ตรวจซ้ำสำหรับแถวที่มาช้า
+        full_reload (bool): ถ้าเป็น True จะไม่ใช้ watermark (ยังคงข้ามแถวที่โหลดแล้ว)
+
+    Returns:
+        dict: สถิติการโหลด (rows_loaded, unresolved_customers, previous/new high-water mark, seconds)
+    """
+    started = time.perf_counter()
+    lookback = config.FACT_LOAD_LOOKBACK if lookback is None else lookback
+    pipeline = f"{source_table}->{target_table}"
+
+    def load(connection):
+        target_columns = [c["name"] for c in inspect(connection).get_columns(target_table)]
+        if not target_columns:
+            raise ValueError(f"ไม่พบตาราง fact '{target_table}'")
+        # คอลัมน์ใน fact -> ค่าจาก staging/dimension (ใช้เฉพาะคอลัมน์ที่ตาราง fact มีจริง)
+        column_sources = {
+            "order_id": "s.order_id",
+            "customer_key": "d.customer_key",
+            "customer_id": "s.customer_id",
+            "product_id": "s.product_id",
+            "sale_date": "s.order_date",
+            "amount": "s.amount",
+        }
+        columns = [c for c in column_sources if c in target_columns]
+        if "order_id" not in columns:
+            raise ValueError(f"ตาราง '{target_table}' ต้องมีคอลัมน์ order_id")
+
+        connection.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{target_table}_order_id ON {target_table} (order_id)")
+        _ensure_current_version_index(connection, dimension_table, "customer_id")
+        previous_hwm = None if full_reload else _read_watermark(connection, pipeline)
+        lower_bound = None if previous_hwm is None else previous_hwm - lookback
+
+        delta_filter = "" if lower_bound is None else "s.order_id > :lower_bound AND "
+        params = {} if lower_bound is None else {"lower_bound": lower_bound}
+        # point-in-time join กับ SCD2: เวอร์ชันที่มีผล ณ วันที่ขาย ส่วนยอดขายก่อนเวอร์ชันแรกใช้เวอร์ชันแรก (customer_key ต่ำสุด)
+        delta = (
+            f"FROM {source_table} s "
+            f"LEFT JOIN (SELECT customer_id, MIN(customer_key) AS first_key FROM {dimension_table} GROUP BY customer_id) v "
+            f"ON v.customer_id = s.customer_id "
+            f"LEFT JOIN {dimension_table} d ON d.customer_id = s.customer_id "
+            f"AND (s.order_date >= d.start_date OR d.customer_key = v.first_key) "
+            f"AND (d.end_date IS NULL OR s.order_date < d.end_date) "
+            f"WHERE {delta_filter}NOT EXISTS (SELECT 1 FROM {target_table} f WHERE f.order_id = s.order_id)"
+        )
+        unresolved = 0
+        if "customer_key" in columns:
+            # นับก่อน INSERT ใน transaction เดียวกัน จึงนับเฉพาะแถวที่กำลังจะโหลดรอบนี้
+            unresolved = connection.execute(text(f"SELECT COUNT(*) {delta} AND d.customer_key IS NULL"), params).scalar()
+        rows_loaded = connection.execute(text(
+            f"INSERT INTO {target_table} ({', '.join(columns)}) "
+            f"SELECT {', '.join(column_sources[c] for c in columns)} {delta}"
+        ), params).rowcount
+        source_filter = "" if lower_bound is None else "WHERE order_id > :lower_bound"
+        source_max = connection.execute(text(f"SELECT MAX(order_id) FROM {source_table} {source_filter}"), params).scalar()
+        candidates = [v for v in (previous_hwm, source_max) if v is not None]
+        new_hwm = max(candidates) if candidates else None
+        if new_hwm is not None:
+            _write_watermark(connection, pipeline, new_hwm)
+        return rows_loaded, unresolved, previous_hwm, new_hwm
+
+    rows_loaded, unresolved, previous_hwm, new_hwm = write_queue.submit(database_url, lambda: db_connection(database_url), load)
+
+    # fact ได้รับเฉพาะ INSERT (mart/profile ต่อแบบ incremental ได้) ส่วน etl_watermarks ถูก upsert
+    _invalidate_written_tables(database_url, tables=[target_table], inserts_only=True)
+    _invalidate_written_tables(database_url, tables=["etl_watermarks"], schema_changed=["etl_watermarks"])
+    return {
+        "target": target_table,
+        "rows_loaded": rows_loaded,
+        "unresolved_customers": unresolved,
+        "previous_high_water_mark": previous_hwm,
+        "high_water_mark": new_hwm,
+        "seconds": round(time.perf_counter() - started, 4),
+    }
+
+def load_fact_sales(database_url: str, full_reload: bool = False):
+    """
+    โหลดยอดขายใหม่จาก stg_sales เข้า fact_sales แบบ incremental (เฉพาะแถวหลัง high-water mark, รันซ้ำได้โดยไม่ซ้ำ)
+
+    Args:
+        database_url (str): URL สำหรับเชื่อมต่อฐานข้อมูล
+        full_reload (bool): ถ้าเป็น True จะตรวจ stg_sales ทั้งตารางแทนการเริ่มจาก watermark
+
+    Returns:
+        str: สรุปผลการโหลดหรือข้อผิดพลาด
+    """
+    try:
+        stats = load_fact_incremental(database_url, full_reload=full_reload)
+        return (f"Loaded {stats['rows_loaded']} new rows into 'fact_sales' in {stats['seconds']}s "
+                f"(high-water mark {stats['previous_high_water_mark']} -> {stats['high_water_mark']}, "
+                f"{stats['unresolved_customers']} rows without a matching customer_key).")
+    except Exception as e:
+        return f"Error loading 'fact_sales': {str(e)}"
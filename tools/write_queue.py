@@ -0,0 +1,266 @@
+# tools/write_queue.py
+"""
+ตัวประสานงานการเขียนแบบ single writer สำหรับ SQLite
+
+SQLite อนุญาตให้มี writer ได้ครั้งละหนึ่ง connection เท่านั้น ถ้าแต่ละ session/Agent เขียนผ่าน connection ของตัวเอง
+transaction จะแย่ง lock กันและล้มเหลวด้วย "database is locked" เมื่อรอเกิน busy_timeout
+โมดูลนี้ส่งงานเขียนทั้งหมดของแต่ละฐานข้อมูลเข้าคิวของ writer thread เดียวที่ถือ connection เฉพาะของตัวเอง:
+
+- งานที่รออยู่ในคิวถูกรวมเป็น transaction เดียว (group commit) โดยแต่ละงานอยู่ใน SAVEPOINT ของตัวเอง
+  งานที่ล้มเหลวจะ rollback เฉพาะส่วนของตัวเองโดยไม่กระทบงานอื่นในกลุ่ม
+- transaction เริ่มด้วย BEGIN IMMEDIATE (จอง write lock ตั้งแต่ต้น) และลองใหม่ถ้า process อื่นถือ lock อยู่
+- การอ่านยังใช้ connection จาก pool ได้พร้อมกันตามปกติ (WAL)
+
+งานคือ callable(connection) ที่ห้าม commit/rollback เอง ผลลัพธ์ของงานจะคืนให้ผู้เรียกหลังจาก commit สำเร็จแล้วเท่านั้น
+ฐานข้อมูลที่ไม่ใช่ไฟล์ SQLite (เช่น in-memory หรือ PostgreSQL) รันงานใน thread ของผู้เรียกด้วย transaction ของตัวเอง
+"""
+from concurrent.futures import Future
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+import contextvars
+import threading
+import queue
+import time
+import re
+
+import config
+
+# คำสั่งที่รันภายใน transaction ไม่ได้ จึงต้องรันเป็นงานเดี่ยวนอก group
+_NON_TRANSACTIONAL = re.compile(r"^\s*(vacuum|attach|detach|begin|commit|end|rollback|savepoint|release)\b", re.IGNORECASE)
+
+_STOP = object()
+
+def requires_own_transaction(statement: str) -> bool:
+    return _NON_TRANSACTIONAL.match(statement) is not None
+
+class _Job:
+    __slots__ = ("work", "transactional", "future", "context", "submitted")
+
+    def __init__(self, work, transactional: bool):
+        self.work = work
+        self.transactional = transactional
+        self.future = Future()
+        self.context = contextvars.copy_context()  # ให้ span ของ tracing ใน writer thread เป็นลูกของ span ผู้เรียก
+        self.submitted = time.perf_counter()
+
+class _Writer:
+    """
+    writer thread ของฐานข้อมูลหนึ่งตัว (เริ่มเมื่อมีงานแรกและหยุดเองเมื่อว่างนานเกิน WRITE_QUEUE_IDLE_S)
+    """
+
+    def __init__(self, database_url: str, connect, stats: dict, lock: threading.Lock):
+        self.database_url = database_url
+        self.connect = connect
+        self.stats = stats
+        self._stats_lock = lock
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.running = False
+
+    def _next_group(self, first: _Job) -> list:
+        group = [first]
+        if not first.transactional:
+            return group
+        deadline = time.perf_counter() + config.WRITE_QUEUE_GROUP_WINDOW_MS / 1000
+        while len(group) < config.WRITE_QUEUE_MAX_GROUP:
+            try:
+                timeout = deadline - time.perf_counter()
+                job = self.jobs.get(timeout=timeout) if timeout > 0 else self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP or not job.transactional:
+                # งานเดี่ยวรอรอบถัดไป (ใส่กลับท้ายคิวไม่ได้เพราะจะสลับลำดับ จึงเก็บไว้เป็นงานแรกของรอบถัดไป)
+                self._held = job
+                break
+            group.append(job)
+        return group
+
+    def _begin(self, connection):
+        """
+        BEGIN IMMEDIATE พร้อมลองใหม่ถ้า process อื่นถือ write lock อยู่นานเกิน busy_timeout
+        """
+        deadline = time.perf_counter() + config.WRITE_QUEUE_LOCK_RETRY_S
+        delay = 0.05
+        while True:
+            try:
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+                return
+            except OperationalError as e:
+                connection.rollback()
+                if "locked" not in str(e).lower() or time.perf_counter() >= deadline:
+                    raise
+                with self._stats_lock:
+                    self.stats["lock_retries"] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    def _run_group(self, connection, group: list):
+        started = time.perf_counter()
+        results = []
+        if not group[0].transactional:
+            job = group[0]
+            try:
+                results.append((job, job.context.run(job.work, connection), None))
+                connection.commit()
+            except Exception as e:
+                connection.rollback()
+                results = [(job, None, e)]
+        else:
+            try:
+                self._begin(connection)
+                for index, job in enumerate(group):
+                    savepoint = f"write_job_{index}"
+                    connection.exec_driver_sql(f"SAVEPOINT {savepoint}")
+                    try:
+                        results.append((job, job.context.run(job.work, connection), None))
+                        connection.exec_driver_sql(f"RELEASE SAVEPOINT {savepoint}")
+                    except Exception as e:
+                        connection.exec_driver_sql(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                        connection.exec_driver_sql(f"RELEASE SAVEPOINT {savepoint}")
+                        results.append((job, None, e))
+                connection.commit()
+            except Exception as e:
+                # BEGIN หรือ COMMIT ล้มเหลว: ทุกงานในกลุ่มล้มเหลว (งานที่สำเร็จแล้วถูก rollback ด้วย)
+                connection.rollback()
+                results = [(job, None, e) for job in group]
+
+        finished = time.perf_counter()
+        with self._stats_lock:
+            self.stats["groups"] += 1
+            self.stats["jobs"] += len(group)
+            self.stats["failed_jobs"] += sum(1 for _, _, error in results if error is not None)
+            self.stats["max_group_size"] = max(self.stats["max_group_size"], len(group))
+            self.stats["busy_ms"] += (finished - started) * 1000
+            self.stats["wait_total_ms"] += sum((started - job.submitted) * 1000 for job in group)
+        for job, result, error in results:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def loop(self):
+        self._held = None
+        try:
+            self._serve()
+        except BaseException as e:
+            # เปิด connection ไม่ได้ (หรือ writer ล้มเหลวเอง): ส่ง error ให้งานที่ค้างอยู่แทนการปล่อยให้รอตลอดไป
+            with self._stats_lock:
+                self.running = False
+                pending = [self._held] if self._held is not None else []
+                while not self.jobs.empty():
+                    pending.append(self.jobs.get_nowait())
+            for job in pending:
+                if job is not _STOP:
+                    job.future.set_exception(e)
+
+    def _serve(self):
+        with self.connect() as connection:
+            while True:
+                job, self._held = self._held, None
+                if job is None:
+                    try:
+                        job = self.jobs.get(timeout=config.WRITE_QUEUE_IDLE_S)
+                    except queue.Empty:
+                        with self._stats_lock:
+                            # ตรวจคิวอีกครั้งภายใต้ lock เดียวกับ submit เพื่อไม่ให้งานที่เพิ่งเข้าคิวค้าง
+                            if self.jobs.empty():
+                                self.running = False
+                                return
+                        continue
+                if job is _STOP:
+                    self.running = False
+                    return
+                self._run_group(connection, self._next_group(job))
+
+class WriteCoordinator:
+    """
+    คิวงานเขียนแบบ single writer ต่อ database_url ที่ใช้ร่วมกันทั้ง process
+    """
+
+    def __init__(self):
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def enabled_for(self, database_url: str) -> bool:
+        if not config.WRITE_QUEUE_ENABLED:
+            return False
+        url = make_url(database_url)
+        return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+    def submit(self, database_url: str, connect, work, transactional: bool = True):
+        """
+        รันงานเขียน work(connection) ผ่าน writer ของฐานข้อมูลนี้และรอผลลัพธ์ (exception ของงานถูกส่งต่อให้ผู้เรียก)
+
+        Args:
+            database_url (str): URL ของฐานข้อมูล
+            connect: callable ที่คืนค่า context manager ของ connection (เช่น lambda: db_connection(url))
+            work: callable(connection) ที่ทำงานเขียนโดยไม่ commit เอง
+            transactional (bool): False สำหรับคำสั่งที่รันใน transaction ไม่ได้ (เช่น VACUUM)
+        """
+        if not self.enabled_for(database_url):
+            with connect() as connection:
+                try:
+                    if transactional and connection.dialect.name == "sqlite":
+                        # pysqlite เริ่ม transaction เองเฉพาะก่อน DML ทำให้ DDL ก่อนหน้านั้น commit ทันที จึงเริ่มเองให้ครอบทั้งงาน
+                        connection.exec_driver_sql("BEGIN")
+                    result = work(connection)
+                    connection.commit()
+                    return result
+                except Exception:
+                    connection.rollback()
+                    raise
+
+        writer = self._writer(database_url, connect)
+        if threading.current_thread() is writer.thread:
+            raise RuntimeError("งานเขียนเรียก submit ซ้ำจาก writer thread (ใช้ connection ที่ได้รับแทน)")
+        job = _Job(work, transactional)
+        with self._lock:
+            writer.jobs.put(job)
+            if not writer.running:
+                writer.running = True
+                writer.thread = threading.Thread(target=writer.loop, name="sqlite-writer", daemon=True)
+                writer.thread.start()
+        return job.future.result()
+
+    def _writer(self, database_url: str, connect) -> _Writer:
+        with self._lock:
+            writer = self._writers.get(database_url)
+            if writer is None:
+                stats = {"jobs": 0, "groups": 0, "failed_jobs": 0, "max_group_size": 0,
+                         "lock_retries": 0, "busy_ms": 0.0, "wait_total_ms": 0.0}
+                writer = self._writers[database_url] = _Writer(database_url, connect, stats, self._lock)
+            return writer
+
+    def stats(self, database_url: str = None) -> dict:
+        """
+        สถิติของ writer แต่ละฐานข้อมูล (จำนวนงาน, จำนวน group commit, ขนาด group เฉลี่ย, เวลารอในคิวเฉลี่ย)
+        """
+        with self._lock:
+            report = {}
+            for url, writer in self._writers.items():
+                if database_url and url != database_url:
+                    continue
+                stats = dict(writer.stats)
+                stats["avg_group_size"] = round(stats["jobs"] / stats["groups"], 2) if stats["groups"] else 0.0
+                stats["avg_wait_ms"] = round(stats["wait_total_ms"] / stats["jobs"], 3) if stats["jobs"] else 0.0
+                stats["queued"] = writer.jobs.qsize()
+                stats["running"] = writer.running
+                report[url] = stats
+            return report
+
+    def close(self):
+        """
+        ให้ writer ทุกตัวทำงานที่อยู่ในคิวให้เสร็จแล้วหยุดและคืน connection (ใช้ก่อน dispose engine)
+        """
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers = {}
+            for writer in writers:
+                if writer.running:
+                    writer.jobs.put(_STOP)
+        for writer in writers:
+            if writer.thread is not None:
+                writer.thread.join()
+
+# Write coordinator ที่ใช้ร่วมกันทั้ง process
+write_queue = WriteCoordinator()